@@ -0,0 +1,290 @@
+"""Синтетический каталог фильмов, персон и жанров для бенчмарков."""
+
+import csv
+import io
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Generator, Iterable, NamedTuple
+
+GENRE_NAMES = (
+    'Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime',
+    'Documentary', 'Drama', 'Family', 'Fantasy', 'History', 'Horror',
+    'Music', 'Musical', 'Mystery', 'News', 'Reality-TV', 'Romance',
+    'Sci-Fi', 'Short', 'Sport', 'Talk-Show', 'Thriller', 'War', 'Western',
+    'Game-Show',
+)
+FIRST_NAMES = (
+    'Alex', 'Anna', 'Boris', 'Chris', 'Dana', 'Elena', 'Frank', 'Grace',
+    'Harry', 'Irina', 'John', 'Kate', 'Leo', 'Maria', 'Nick', 'Olga',
+    'Peter', 'Rita', 'Sam', 'Tanya', 'Victor', 'Yana',
+)
+LAST_NAMES = (
+    'Smith', 'Ivanov', 'Brown', 'Petrova', 'Taylor', 'Sokolov', 'Wilson',
+    'Kuznetsova', 'Moore', 'Popov', 'Clark', 'Volkova', 'Lewis', 'Orlov',
+)
+WORDS = (
+    'star', 'night', 'return', 'empire', 'last', 'city', 'dream', 'war',
+    'love', 'shadow', 'galaxy', 'secret', 'road', 'storm', 'legend', 'hope',
+)
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+SCHEMA_SQL = """
+    CREATE SCHEMA IF NOT EXISTS content;
+    CREATE TABLE IF NOT EXISTS content.film_work (
+        id uuid PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        creation_date DATE,
+        rating FLOAT,
+        type TEXT NOT NULL,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.genre (
+        id uuid PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.person (
+        id uuid PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.genre_film_work (
+        id uuid PRIMARY KEY,
+        genre_id uuid NOT NULL REFERENCES content.genre (id),
+        film_work_id uuid NOT NULL REFERENCES content.film_work (id),
+        created timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.person_film_work (
+        id uuid PRIMARY KEY,
+        person_id uuid NOT NULL REFERENCES content.person (id),
+        film_work_id uuid NOT NULL REFERENCES content.film_work (id),
+        role TEXT NOT NULL,
+        created timestamp with time zone
+    );
+"""
+
+INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS film_work_modified_idx
+        ON content.film_work (modified, id);
+    CREATE INDEX IF NOT EXISTS genre_modified_idx
+        ON content.genre (modified, id);
+    CREATE INDEX IF NOT EXISTS person_modified_idx
+        ON content.person (modified, id);
+    CREATE INDEX IF NOT EXISTS genre_film_work_film_work_idx
+        ON content.genre_film_work (film_work_id);
+    CREATE INDEX IF NOT EXISTS genre_film_work_genre_idx
+        ON content.genre_film_work (genre_id);
+    CREATE INDEX IF NOT EXISTS person_film_work_film_work_idx
+        ON content.person_film_work (film_work_id);
+    CREATE INDEX IF NOT EXISTS person_film_work_person_idx
+        ON content.person_film_work (person_id);
+    ANALYZE;
+"""
+
+DROP_SQL = """
+    DROP TABLE IF EXISTS content.person_film_work, content.genre_film_work,
+        content.person, content.genre, content.film_work;
+"""
+
+
+class Film(NamedTuple):
+    """Фильм каталога вместе со связями."""
+
+    id: str
+    title: str
+    description: str
+    rating: float
+    type: str
+    modified: datetime
+    genres: tuple[int]
+    persons: tuple[tuple[int, str]]
+
+
+class Catalogue:
+    """
+    Детерминированный генератор каталога заданного размера.
+    Популярность персон распределена по степенному закону: небольшое
+    число актеров снимается во многих фильмах, большинство - в одном-двух.
+    """
+
+    def __init__(self,
+                 films: int,
+                 persons: int = 0,
+                 seed: int = 42,
+                 actors: tuple[int, int] = (3, 12),
+                 writers: tuple[int, int] = (1, 3)):
+        """
+        Инициализация генератора.
+        :param films: число фильмов
+        :param persons: число персон, по умолчанию половина числа фильмов
+        :param seed: зерно генератора случайных чисел
+        :param actors: минимальное и максимальное число актеров в фильме
+        :param writers: минимальное и максимальное число сценаристов
+        """
+        self.films = films
+        self.persons = persons or max(films // 2, 10)
+        self.seed = seed
+        self.actors = actors
+        self.writers = writers
+        rng = random.Random(seed)
+        self.genre_ids = [self._uuid(rng) for _ in GENRE_NAMES]
+        self.person_ids = [self._uuid(rng) for _ in range(self.persons)]
+        self.person_names = [
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number}'
+            for number in range(self.persons)
+        ]
+
+    @staticmethod
+    def _uuid(rng: random.Random) -> str:
+        """
+        Детерминированный uuid4.
+        :param rng: генератор случайных чисел
+        :return:
+        """
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def _person(self, rng: random.Random) -> int:
+        """
+        Выбрать персону с учетом популярности: первый процент персон
+        получает около десятой части ролей.
+        :param rng: генератор случайных чисел
+        :return: номер персоны
+        """
+        return int(self.persons * rng.random() ** 2)
+
+    def iter_films(self) -> Generator[Film, None, None]:
+        """
+        Фильмы каталога.
+        :return:
+        """
+        rng = random.Random(self.seed + 1)
+        order = list(range(self.persons))
+        random.Random(self.seed + 2).shuffle(order)
+        for number in range(self.films):
+            cast = {(order[self._person(rng)], 'director')}
+            for role, (low, high) in (('actor', self.actors),
+                                      ('writer', self.writers)):
+                for _ in range(rng.randint(low, high)):
+                    cast.add((order[self._person(rng)], role))
+            yield Film(
+                id=self._uuid(rng),
+                title=' '.join(rng.choice(WORDS)
+                               for _ in range(rng.randint(1, 4))).title(),
+                description=' '.join(rng.choice(WORDS)
+                                     for _ in range(rng.randint(10, 60))),
+                rating=round(rng.uniform(1, 10), 1),
+                type=rng.choice(('movie', 'movie', 'movie', 'tv_show')),
+                modified=EPOCH + timedelta(seconds=number),
+                genres=tuple(rng.sample(range(len(GENRE_NAMES)),
+                                        rng.randint(1, 3))),
+                persons=tuple(sorted(cast)),
+            )
+
+    def iter_rows(self) -> Generator[dict, None, None]:
+        """
+        Строки фильмов в том виде, в котором их возвращает FILMWORKS_QUERY.
+        :return:
+        """
+        for film in self.iter_films():
+            yield {
+                'id': film.id,
+                'title': film.title,
+                'description': film.description,
+                'rating': film.rating,
+                'type': film.type,
+                'created': film.modified,
+                'modified': film.modified,
+                'persons': [
+                    {'role': role,
+                     'id': self.person_ids[person],
+                     'name': self.person_names[person]}
+                    for person, role in film.persons
+                ],
+                'genres': [GENRE_NAMES[genre] for genre in film.genres],
+            }
+
+
+def _copy(cur, table: str, columns: str, rows: Iterable[tuple],
+          chunk_size: int = 50_000) -> None:
+    """
+    Загрузить строки в таблицу командой COPY порциями.
+    :param cur: курсор
+    :param table: название таблицы
+    :param columns: колонки через запятую
+    :param rows: строки
+    :param chunk_size: число строк в порции
+    :return:
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+
+    def send() -> None:
+        buffer.seek(0)
+        cur.copy_expert(
+            f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_size == 0:
+            send()
+    if count % chunk_size:
+        send()
+
+
+def populate(conn, catalogue: Catalogue, drop: bool = False) -> None:
+    """
+    Создать схему и заполнить базу данными каталога.
+    Фильмы генерируются заново для каждой таблицы, чтобы не держать
+    каталог в памяти целиком.
+    :param conn: соединение psycopg2
+    :param catalogue: каталог
+    :param drop: удалить существующие таблицы
+    :return:
+    """
+    rng = random.Random(catalogue.seed + 3)
+    with conn.cursor() as cur:
+        if drop:
+            cur.execute(DROP_SQL)
+        cur.execute(SCHEMA_SQL)
+        _copy(cur, 'content.genre', 'id, name, created, modified', (
+            (id_, name, EPOCH, EPOCH)
+            for id_, name in zip(catalogue.genre_ids, GENRE_NAMES)
+        ))
+        _copy(cur, 'content.person', 'id, full_name, created, modified', (
+            (id_, name, EPOCH, EPOCH)
+            for id_, name in zip(catalogue.person_ids,
+                                 catalogue.person_names)
+        ))
+        _copy(cur, 'content.film_work',
+              'id, title, description, rating, type, created, modified', (
+                  (film.id, film.title, film.description, film.rating,
+                   film.type, film.modified, film.modified)
+                  for film in catalogue.iter_films()
+              ))
+        _copy(cur, 'content.genre_film_work',
+              'id, genre_id, film_work_id, created', (
+                  (Catalogue._uuid(rng), catalogue.genre_ids[genre],
+                   film.id, film.modified)
+                  for film in catalogue.iter_films()
+                  for genre in film.genres
+              ))
+        _copy(cur, 'content.person_film_work',
+              'id, person_id, film_work_id, role, created', (
+                  (Catalogue._uuid(rng), catalogue.person_ids[person],
+                   film.id, role, film.modified)
+                  for film in catalogue.iter_films()
+                  for person, role in film.persons
+              ))
+        cur.execute(INDEXES_SQL)
+    conn.commit()
@@ -0,0 +1,173 @@
+"""
+Локальная замена Elasticsearch для бенчмарков.
+Реализует только запросы, которые выполняет загрузчик: проверку и
+создание индекса, чтение uuid индекса и bulk. Документы не хранятся,
+подсчитывается только их число и объем.
+"""
+
+import gzip
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class FakeElasticState:
+    """Счетчики и индексы фейкового сервера."""
+
+    def __init__(self, bulk_latency: float = 0.0, bandwidth: float = 0.0):
+        """
+        Инициализация состояния.
+        :param bulk_latency: искусственная задержка bulk-запроса в секундах
+        :param bandwidth: имитируемая пропускная способность сети
+            в мегабитах в секунду, 0 - без ограничения
+        """
+        self.bulk_latency = bulk_latency
+        self.bandwidth = bandwidth
+        self.indices = {}
+        self.bulk_requests = 0
+        self.documents = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        """
+        Сбросить счетчики.
+        :return:
+        """
+        with self.lock:
+            self.bulk_requests = self.documents = 0
+            self.bytes = self.wire_bytes = 0
+
+
+class FakeElasticHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов фейкового Elasticsearch."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state: FakeElasticState = None
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.wire_length = len(body)
+        if self.state.bandwidth:
+            time.sleep(len(body) * 8 / (self.state.bandwidth * 1_000_000))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status: int, body: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _index_name(self) -> str:
+        return self.path.split('?')[0].strip('/').split('/')[0]
+
+    def do_HEAD(self) -> None:
+        index = self._index_name()
+        status = 200 if not index or index in self.state.indices else 404
+        self._send(status)
+
+    def do_PUT(self) -> None:
+        if self.path.split('?')[0].endswith('/_bulk'):
+            self.do_POST()
+            return
+        self._read_body()
+        index = self._index_name()
+        self.state.indices.setdefault(index, uuid.uuid4().hex)
+        self._send(200, {'acknowledged': True, 'index': index})
+
+    def do_GET(self) -> None:
+        path = self.path.split('?')[0]
+        index = self._index_name()
+        if path == '/':
+            self._send(200, {
+                'name': 'fake',
+                'cluster_name': 'benchmark',
+                'version': {'number': '8.4.0'},
+                'tagline': 'You Know, for Search',
+            })
+        elif '/_settings' in path and index in self.state.indices:
+            self._send(200, {index: {'settings': {'index': {
+                'uuid': self.state.indices[index],
+            }}}})
+        else:
+            self._send(404, {'error': 'not supported', 'status': 404})
+
+    def do_POST(self) -> None:
+        body = self._read_body()
+        path = self.path.split('?')[0]
+        if not path.endswith('/_bulk'):
+            self._send(200, {})
+            return
+        lines = body.splitlines()
+        items = []
+        for action_line in lines[::2]:
+            action, meta = next(iter(json.loads(action_line).items()))
+            items.append({action: {
+                '_index': meta.get('_index'),
+                '_id': meta.get('_id'),
+                'status': 201,
+                'result': 'created',
+            }})
+        if self.state.bulk_latency:
+            time.sleep(self.state.bulk_latency)
+        with self.state.lock:
+            self.state.bulk_requests += 1
+            self.state.documents += len(items)
+            self.state.bytes += len(body)
+            self.state.wire_bytes += self.wire_length
+        self._send(200, {'took': 1, 'errors': False, 'items': items})
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FakeElastic:
+    """Фейковый Elasticsearch в фоновом потоке."""
+
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 bulk_latency: float = 0.0,
+                 bandwidth: float = 0.0):
+        """
+        Инициализация сервера.
+        :param host: адрес
+        :param port: порт, 0 - любой свободный
+        :param bulk_latency: искусственная задержка bulk-запроса в секундах
+        :param bandwidth: имитируемая пропускная способность в Мбит/с
+        """
+        self.state = FakeElasticState(bulk_latency, bandwidth)
+        handler = type('Handler', (FakeElasticHandler,), {'state': self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name='fake-elastic', daemon=True
+        )
+
+    @property
+    def host(self) -> str:
+        return self.server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def __enter__(self) -> 'FakeElastic':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,390 @@
+"""
+Бенчмарки ETL.
+
+Данные для бенчмарков с PostgreSQL генерируются в отдельную базу
+на том же сервере, что и POSTGRES_DB: ее название передается опцией
+--database или переменной окружения BENCHMARK_POSTGRES_DB.
+
+Примеры запуска из каталога etl:
+    python benchmarks/run.py generate --films 100000 --drop
+    python benchmarks/run.py run --rows 10000 --postgres -o results.json
+    python benchmarks/run.py compare baseline.json results.json
+"""
+
+import argparse
+import gc
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, Generator, Optional
+
+from elasticsearch import Elasticsearch
+from elasticsearch.serializer import NdjsonSerializer
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from benchmarks.catalogue import Catalogue, populate
+from benchmarks.fake_elastic import FakeElastic
+from config import SETTINGS
+from main import load
+from utils.elastic_loader import ElasticLoader, es_create_connection
+from utils.postgres_extractor import (PostgresMovieExtractor,
+                                      postgres_conn_context)
+from utils.serializers import create_serializers
+from utils.storage import MemoryStorage, State
+from utils.transformer import Filmwork, FilmworkRecord
+
+BENCHMARKS = {}
+
+
+def benchmark_dsl(dbname: str) -> dict:
+    """
+    Параметры подключения к базе бенчмарков. Генерация пересоздает
+    и заполняет таблицы content, поэтому база ETL не используется.
+    :param dbname: название базы бенчмарков
+    :return:
+    """
+    if not dbname or dbname == SETTINGS.POSTGRES_DSL.dbname:
+        raise SystemExit('--database or BENCHMARK_POSTGRES_DB must be set '
+                         'to a database other than POSTGRES_DB.')
+    return {**SETTINGS.POSTGRES_DSL.dict(), 'dbname': dbname}
+
+
+def benchmark(name: str, postgres: bool = False) -> Callable:
+    """
+    Зарегистрировать бенчмарк. Функция бенчмарка получает контекст
+    запуска и возвращает число обработанных элементов, возможно вместе
+    со словарем дополнительных показателей.
+    :param name: название бенчмарка
+    :param postgres: требуется ли база данных
+    :return:
+    """
+
+    def decorator(func: Callable) -> Callable:
+        BENCHMARKS[name] = (func, postgres)
+        return func
+
+    return decorator
+
+
+class Context:
+    """Общие данные бенчмарков одного запуска."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rows = list(Catalogue(args.rows, seed=args.seed).iter_rows())
+        self.documents = [FilmworkRecord(**row).as_document()
+                          for row in self.rows]
+        self.fake_elastic = FakeElastic(bulk_latency=args.bulk_latency,
+                                        bandwidth=args.bandwidth)
+
+    def postgres_dsl(self) -> dict:
+        """
+        Параметры подключения к базе бенчмарков.
+        :return:
+        """
+        return {**benchmark_dsl(self.args.database),
+                'options': '-c search_path=content,public'}
+
+    def elastic_connection(self):
+        """
+        Соединение с фейковым Elasticsearch с настройками из окружения.
+        :return:
+        """
+        return es_create_connection(host=self.fake_elastic.host,
+                                    port=self.fake_elastic.port)
+
+    @contextmanager
+    def elastic_client(
+            self,
+            serializer: str,
+            compress: bool
+    ) -> Generator[Elasticsearch, None, None]:
+        """
+        Клиент фейкового Elasticsearch с заданным сериализатором
+        и сжатием запросов.
+        :param serializer: json или orjson
+        :param compress: сжимать ли тела запросов gzip
+        :return:
+        """
+        options = {'http_compress': compress}
+        serializers = create_serializers(serializer)
+        if serializers:
+            options['serializers'] = serializers
+        client = Elasticsearch(
+            hosts=f'http://{self.fake_elastic.host}:{self.fake_elastic.port}/',
+            **options
+        )
+        try:
+            yield client
+        finally:
+            client.transport.close()
+
+
+@benchmark('transform.filmwork')
+def bench_filmwork(ctx: Context) -> int:
+    for row in ctx.rows:
+        Filmwork(**row).as_document()
+    return len(ctx.rows)
+
+
+@benchmark('transform.filmwork_record')
+def bench_filmwork_record(ctx: Context) -> int:
+    for row in ctx.rows:
+        FilmworkRecord(**row).as_document()
+    return len(ctx.rows)
+
+
+def bench_serialize(serializer: str, ctx: Context) -> int:
+    serializers = create_serializers(serializer) or {}
+    ndjson = serializers.get(NdjsonSerializer.mimetype, NdjsonSerializer())
+    for start in range(0, len(ctx.documents), SETTINGS.BATCH_SIZE):
+        lines = []
+        for document in ctx.documents[start:start + SETTINGS.BATCH_SIZE]:
+            lines.append(
+                {'index': {'_index': 'movies', '_id': document['id']}}
+            )
+            lines.append(document)
+        ndjson.dumps(lines)
+    return len(ctx.documents)
+
+
+def bench_loader_save(serializer: str,
+                      compress: bool,
+                      ctx: Context) -> tuple[int, dict]:
+    ctx.fake_elastic.state.reset()
+    with ctx.elastic_client(serializer, compress) as es_client:
+        loader = ElasticLoader(es_client, 'benchmark_movies')
+        for document in ctx.documents:
+            loader.add_in_batch(document)
+            if loader.is_batch_ready():
+                loader.save()
+        loader.flush()
+        loader.close()
+    state = ctx.fake_elastic.state
+    return len(ctx.documents), {
+        'bytes': state.bytes,
+        'wire_bytes': state.wire_bytes,
+        'compression_ratio': state.bytes / max(state.wire_bytes, 1),
+    }
+
+
+for _serializer in ('json', 'orjson'):
+    benchmark(f'serialize.{_serializer}')(
+        partial(bench_serialize, _serializer)
+    )
+    for _compress in (False, True):
+        benchmark(
+            f'loader.save.{_serializer}{"+gzip" if _compress else ""}'
+        )(partial(bench_loader_save, _serializer, _compress))
+
+
+@benchmark('extract.get_filmworks', postgres=True)
+def bench_get_filmworks(ctx: Context) -> int:
+    with postgres_conn_context(ctx.postgres_dsl()) as pg_conn:
+        extractor = PostgresMovieExtractor(pg_conn, State(MemoryStorage()))
+        with pg_conn.cursor() as cur:
+            cur.execute('SELECT id FROM film_work ORDER BY modified, id '
+                        'LIMIT %s', (ctx.args.rows,))
+            ids = [row[0] for row in cur.fetchall()]
+        count = 0
+        for start in range(0, len(ids), SETTINGS.BATCH_SIZE):
+            count += len(extractor._fetch_rows(
+                tuple(ids[start:start + SETTINGS.BATCH_SIZE])
+            ))
+    return count
+
+
+@benchmark('extract.stream_all', postgres=True)
+def bench_stream_all(ctx: Context) -> int:
+    with postgres_conn_context(ctx.postgres_dsl()) as pg_conn:
+        extractor = PostgresMovieExtractor(pg_conn, State(MemoryStorage()))
+        return sum(len(rows) for rows, _ in extractor.stream_all())
+
+
+@benchmark('e2e.load', postgres=True)
+def bench_load(ctx: Context) -> int:
+    with postgres_conn_context(ctx.postgres_dsl()) as pg_conn, \
+            ctx.elastic_connection() as es_client:
+        ctx.fake_elastic.state.reset()
+        extractor = PostgresMovieExtractor(pg_conn, State(MemoryStorage()))
+        loader = ElasticLoader(es_client, 'benchmark_movies')
+        try:
+            load(extractor, loader)
+        finally:
+            loader.close()
+    return ctx.fake_elastic.state.documents
+
+
+def measure(func: Callable, ctx: Context, repeat: int) -> dict:
+    """
+    Выполнить бенчмарк несколько раз.
+    :param func: функция бенчмарка
+    :param ctx: контекст запуска
+    :param repeat: число повторов
+    :return: результат
+    """
+    timings, result = [], 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(ctx)
+        timings.append(time.perf_counter() - start)
+    items, extra = result if isinstance(result, tuple) else (result, {})
+    best = min(timings)
+    return {
+        'items': items,
+        'repeat': repeat,
+        'best_seconds': best,
+        'median_seconds': statistics.median(timings),
+        'items_per_second': items / best if best else None,
+        **extra,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=parentdir, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Выполнить выбранные бенчмарки.
+    :param args: аргументы командной строки
+    :return: результаты с метаданными запуска
+    """
+    ctx = Context(args)
+    results = {}
+    with ctx.fake_elastic:
+        for name, (func, postgres) in BENCHMARKS.items():
+            if args.only and not any(name.startswith(prefix)
+                                     for prefix in args.only):
+                continue
+            if postgres and not args.postgres:
+                continue
+            results[name] = measure(func, ctx, args.repeat)
+            line = (f"{name:32} {results[name]['items_per_second']:>14,.0f} "
+                    f"items/s")
+            if 'wire_bytes' in results[name]:
+                line += (f"  {results[name]['wire_bytes'] / 1024:>10,.0f} "
+                         f"KiB sent")
+            print(line)
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'rows': args.rows,
+            'seed': args.seed,
+            'bulk_latency': args.bulk_latency,
+            'bandwidth': args.bandwidth,
+            'batch_size': SETTINGS.BATCH_SIZE,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Сравнить результаты двух запусков.
+    :param baseline: результаты базового запуска
+    :param current: результаты текущего запуска
+    :return:
+    """
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base or not base['items_per_second']:
+            print(f'{name:32} {"new":>10}')
+            continue
+        change = result['items_per_second'] / base['items_per_second'] - 1
+        print(f'{name:32} {base["items_per_second"]:>14,.0f} -> '
+              f'{result["items_per_second"]:>14,.0f} items/s '
+              f'({change:+.1%})')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бенчмарки ETL.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    database = argparse.ArgumentParser(add_help=False)
+    database.add_argument(
+        '--database', default=os.environ.get('BENCHMARK_POSTGRES_DB', ''),
+        help='база бенчмарков на сервере POSTGRES_HOST, по умолчанию '
+             'BENCHMARK_POSTGRES_DB'
+    )
+
+    generate = commands.add_parser(
+        'generate', parents=[database],
+        help='заполнить базу синтетическим каталогом'
+    )
+    generate.add_argument('--films', type=int, default=10_000)
+    generate.add_argument('--persons', type=int, default=0)
+    generate.add_argument('--seed', type=int, default=42)
+    generate.add_argument('--drop', action='store_true',
+                          help='пересоздать таблицы')
+
+    run_parser = commands.add_parser('run', parents=[database],
+                                     help='выполнить бенчмарки')
+    run_parser.add_argument('--rows', type=int, default=10_000,
+                            help='число фильмов в бенчмарке')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--bulk-latency', type=float, default=0.0,
+                            help='задержка ответа фейкового bulk, секунд')
+    run_parser.add_argument('--bandwidth', type=float, default=0.0,
+                            help='имитируемая пропускная способность сети '
+                                 'до фейкового Elasticsearch, Мбит/с')
+    run_parser.add_argument('--postgres', action='store_true',
+                            help='выполнить бенчмарки с базой данных')
+    run_parser.add_argument('--only', nargs='*', default=(),
+                            help='префиксы названий бенчмарков')
+    run_parser.add_argument('-o', '--output', help='файл результатов')
+    run_parser.add_argument('--baseline', help='результаты для сравнения')
+
+    compare_parser = commands.add_parser(
+        'compare', help='сравнить два файла результатов'
+    )
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        catalogue = Catalogue(args.films, args.persons, args.seed)
+        with postgres_conn_context(benchmark_dsl(args.database)) as pg_conn:
+            started = time.perf_counter()
+            populate(pg_conn, catalogue, drop=args.drop)
+        print(f'Generated {args.films} films in '
+              f'{time.perf_counter() - started:.1f}s.')
+    elif args.command == 'run':
+        results = run(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare(json.load(f), results)
+    else:
+        with open(args.baseline) as f, open(args.current) as g:
+            compare(json.load(f), json.load(g))
+
+
+if __name__ == '__main__':
+    main()
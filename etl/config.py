@@ -1,7 +1,8 @@
 import logging
 import os
+from typing import Literal
 
-from pydantic import BaseSettings, Field
+from pydantic import BaseSettings, Field, root_validator
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +27,11 @@ class ElasticDSL(BaseSettings):
     host: str = Field(default='127.0.0.1', env='ELASTIC_HOST')
     port: str = Field(default='9200', env='ELASTIC_PORT')
     ES_INDEX_NAME: str = 'movies'
+    ES_KEEP_VERSIONS: int = Field(default=2, env='ES_KEEP_VERSIONS')
+    ES_SERIALIZER: Literal['json', 'orjson'] = Field(
+        default='orjson', env='ES_SERIALIZER'
+    )
+    ES_HTTP_COMPRESS: bool = Field(default=False, env='ES_HTTP_COMPRESS')
     ES_MAPPING: dict = {
         'settings': {
             'refresh_interval': '1s',
@@ -76,6 +82,9 @@ class ElasticDSL(BaseSettings):
                 'imdb_rating': {
                     'type': 'float'
                 },
+                'modified': {
+                    'type': 'date'
+                },
                 'genre': {
                     'type': 'keyword'
                 },
@@ -133,6 +142,52 @@ class ElasticDSL(BaseSettings):
             },
         },
     }
+    ES_GENRES_INDEX_NAME: str = Field(
+        default='genres', env='ES_GENRES_INDEX_NAME'
+    )
+    ES_GENRES_MAPPING: dict = {
+        'settings': ES_MAPPING['settings'],
+        'mappings': {
+            'dynamic': 'strict',
+            'properties': {
+                'id': {
+                    'type': 'keyword'
+                },
+                'name': {
+                    'type': 'text',
+                    'analyzer': 'ru_en',
+                    'fields': {
+                        'raw': {
+                            'type': 'keyword'
+                        }
+                    }
+                },
+            },
+        },
+    }
+    ES_PERSONS_INDEX_NAME: str = Field(
+        default='persons', env='ES_PERSONS_INDEX_NAME'
+    )
+    ES_PERSONS_MAPPING: dict = {
+        'settings': ES_MAPPING['settings'],
+        'mappings': {
+            'dynamic': 'strict',
+            'properties': {
+                'id': {
+                    'type': 'keyword'
+                },
+                'full_name': {
+                    'type': 'text',
+                    'analyzer': 'ru_en',
+                    'fields': {
+                        'raw': {
+                            'type': 'keyword'
+                        }
+                    }
+                },
+            },
+        },
+    }
 
     class Config:
         env_file = os.environ.get('PATH_TO_ENV', default='../.env')
@@ -142,8 +197,85 @@ class ElasticDSL(BaseSettings):
 class Settings(BaseSettings):
     FIRST_DATE: str = '2000-01-01'
     ETL_DELAY: int = Field(default=60, env='ETL_DELAY')
+    ETL_MODE: Literal['sync', 'async', 'listen'] = Field(
+        default='sync', env='ETL_MODE'
+    )
+    PIPELINE_QUEUE_SIZE: int = Field(default=4, env='PIPELINE_QUEUE_SIZE')
+    LISTEN_CHANNEL: str = Field(default='etl_changes', env='LISTEN_CHANNEL')
+    LISTEN_DEBOUNCE: float = Field(default=1.0, env='LISTEN_DEBOUNCE')
+    LISTEN_INSTALL_TRIGGERS: bool = Field(
+        default=True, env='LISTEN_INSTALL_TRIGGERS'
+    )
     BATCH_SIZE: int = 100
+    EXTRA_INDICES: list[Literal['genres', 'persons']] = Field(
+        default=[], env='EXTRA_INDICES'
+    )
+    ADAPTIVE_BATCH: bool = Field(default=False, env='ADAPTIVE_BATCH')
+    BATCH_SIZE_MIN: int = Field(default=20, env='BATCH_SIZE_MIN')
+    BATCH_SIZE_MAX: int = Field(default=5000, env='BATCH_SIZE_MAX')
+    EXTRACT_TARGET_LATENCY: float = Field(
+        default=0.5, env='EXTRACT_TARGET_LATENCY'
+    )
+    BULK_TARGET_LATENCY: float = Field(default=1.0, env='BULK_TARGET_LATENCY')
+    CHANGE_SOURCE: Literal['modified', 'outbox'] = Field(
+        default='modified', env='CHANGE_SOURCE'
+    )
+    OUTBOX_INSTALL_TRIGGERS: bool = Field(
+        default=True, env='OUTBOX_INSTALL_TRIGGERS'
+    )
+    FULL_LOAD_STREAM: bool = Field(default=True, env='FULL_LOAD_STREAM')
+    FULL_LOAD_ITERSIZE: int = Field(default=5000, env='FULL_LOAD_ITERSIZE')
+    RECONCILE_PAGE_SIZE: int = Field(default=5000, env='RECONCILE_PAGE_SIZE')
+    SNAPSHOT_DIR: str = Field(default='./snapshot', env='SNAPSHOT_DIR')
+    SNAPSHOT_CHUNK_SIZE: int = Field(default=5000, env='SNAPSHOT_CHUNK_SIZE')
+    SNAPSHOT_COMPRESS_LEVEL: int = Field(
+        default=6, env='SNAPSHOT_COMPRESS_LEVEL'
+    )
+    SNAPSHOT_RESTORE_WORKERS: int = Field(
+        default=4, env='SNAPSHOT_RESTORE_WORKERS'
+    )
+    PARTITIONS: int = Field(default=0, env='PARTITIONS')
+    PARTITIONS_PER_WORKER: int = Field(default=0, env='PARTITIONS_PER_WORKER')
+    PARTITION_LOCK_NAMESPACE: int = Field(
+        default=7342, env='PARTITION_LOCK_NAMESPACE'
+    )
+    HANDOFF_LOCK_KEY: int = Field(default=7341, env='HANDOFF_LOCK_KEY')
+    REPLICA_DSN: str = Field(default='', env='POSTGRES_REPLICA_DSN')
+    REPLICA_MAX_LAG: float = Field(default=30.0, env='REPLICA_MAX_LAG')
+    PROFILE_CYCLES: int = Field(default=1, env='PROFILE_CYCLES')
+    PROFILE_SAMPLE_INTERVAL: float = Field(
+        default=0.005, env='PROFILE_SAMPLE_INTERVAL'
+    )
+    CONNECTION_CHECK_INTERVAL: float = Field(
+        default=30.0, env='CONNECTION_CHECK_INTERVAL'
+    )
+    BULK_MAX_BYTES: int = Field(default=10 * 1024 * 1024, env='BULK_MAX_BYTES')
+    BULK_CONCURRENCY: int = Field(default=1, env='BULK_CONCURRENCY')
+    BULK_MAX_RETRIES: int = Field(default=5, env='BULK_MAX_RETRIES')
+    BULK_RETRY_BACKOFF: float = Field(default=0.5, env='BULK_RETRY_BACKOFF')
+    DEAD_LETTER_FILE: str = Field(
+        default='./dead_letter.ndjson', env='DEAD_LETTER_FILE'
+    )
+    TRANSFORM_WORKERS: int = Field(default=0, env='TRANSFORM_WORKERS')
+    TRANSFORM_CHUNK_SIZE: int = Field(default=500, env='TRANSFORM_CHUNK_SIZE')
     STATE_FILE: str = Field(default='./state.json', env='FILEPATH_JSON')
+    STATE_DB_FILE: str = Field(default='./state.db', env='STATE_DB_FILE')
+    STATE_BACKEND: Literal['json', 'sqlite', 'postgres'] = Field(
+        default='json', env='STATE_BACKEND'
+    )
+    STATE_FLUSH_INTERVAL: float = Field(
+        default=1.0, env='STATE_FLUSH_INTERVAL'
+    )
+    HASH_CACHE_FILE: str = Field(
+        default='./document_hashes.db', env='HASH_CACHE_FILE'
+    )
+    HASH_CACHE_SIZE: int = Field(default=1_000_000, env='HASH_CACHE_SIZE')
+    METRICS_HOST: str = Field(default='127.0.0.1', env='METRICS_HOST')
+    METRICS_PORT: int = Field(default=8000, env='METRICS_PORT')
+    PARTIAL_UPDATES: bool = Field(default=False, env='PARTIAL_UPDATES')
+    DIMENSION_CACHE_FILE: str = Field(
+        default='./dimensions.db', env='DIMENSION_CACHE_FILE'
+    )
 
     POSTGRES_DSL: PostgresDSL = PostgresDSL()
     ELASTIC_DSL: ElasticDSL = ElasticDSL()
@@ -152,5 +284,58 @@ class Settings(BaseSettings):
         env_file = os.environ.get('PATH_TO_ENV', default='../.env')
         env_file_encoding = 'utf-8'
 
+    @root_validator(pre=True)
+    def async_full_load_default(cls, values: dict) -> dict:
+        """
+        Асинхронный конвейер выгружает фильмы батчами ID: если
+        FULL_LOAD_STREAM не задан явно, в режиме async он выключен.
+        """
+        if values.get('ETL_MODE') == 'async':
+            values.setdefault('FULL_LOAD_STREAM', False)
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def check_async_mode(cls, values: dict) -> dict:
+        """
+        Асинхронный конвейер загружает изменения по полям modified
+        с основного сервера в один индекс без партиций, батчами
+        постоянного размера и одним bulk-запросом за раз: остальные
+        режимы он бы молча проигнорировал.
+        """
+        if values['ETL_MODE'] != 'async':
+            return values
+        unsupported = [name for name, enabled in (
+            ('CHANGE_SOURCE=outbox', values['CHANGE_SOURCE'] == 'outbox'),
+            ('PARTITIONS', values['PARTITIONS'] > 1),
+            ('EXTRA_INDICES', bool(values['EXTRA_INDICES'])),
+            ('PARTIAL_UPDATES', values['PARTIAL_UPDATES']),
+            ('FULL_LOAD_STREAM', values['FULL_LOAD_STREAM']),
+            ('ADAPTIVE_BATCH', values['ADAPTIVE_BATCH']),
+            ('POSTGRES_REPLICA_DSN', bool(values['REPLICA_DSN'])),
+            ('BULK_CONCURRENCY', values['BULK_CONCURRENCY'] > 1),
+            ('TRANSFORM_WORKERS', values['TRANSFORM_WORKERS'] > 0),
+        ) if enabled]
+        if unsupported:
+            raise ValueError(
+                'ETL_MODE=async does not support '
+                + ', '.join(unsupported)
+                + '; use ETL_MODE=sync or disable them.'
+            )
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def check_partitions_state(cls, values: dict) -> dict:
+        """
+        Процессы с партициями пишут позиции в общее состояние: файлы
+        json и sqlite у каждого процесса свои, и позиции чужих партиций
+        в них устаревают.
+        """
+        if values['PARTITIONS'] > 1 and values['STATE_BACKEND'] != 'postgres':
+            raise ValueError(
+                'PARTITIONS > 1 requires STATE_BACKEND=postgres, '
+                f"got STATE_BACKEND={values['STATE_BACKEND']}."
+            )
+        return values
+
 
 SETTINGS = Settings()
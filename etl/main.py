@@ -1,58 +1,702 @@
 """Основной модуль для импорта кино из PostgreSQL в ElasticSearch."""
 
+import argparse
+import asyncio
 import logging
+import sys
 import time
+from contextlib import ExitStack, nullcontext
+from functools import partial
+from typing import (ContextManager, Generator, Iterable, Optional,
+                    Sequence)
 
+import asyncpg
+from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionError
-from psycopg2 import OperationalError
+from psycopg2 import InterfaceError, OperationalError
 
 from config import SETTINGS
+from utils.async_elastic_loader import (AsyncElasticLoader,
+                                        async_es_create_connection)
+from utils.async_postgres_extractor import (AsyncPostgresMovieExtractor,
+                                            init_connection)
 from utils.backoff import backoff
-from utils.elastic_loader import ElasticLoader, es_create_connection
-from utils.postgres_extractor import (PostgresMovieExtractor,
+from utils.batch_size import AdaptiveBatchSize
+from utils.cache import (DimensionCache, DocumentHashCache,
+                         dimension_cache_context, hash_cache_context)
+from utils.connections import (ElasticConnection, PostgresConnection,
+                               ReplicaConnection, ReplicaRead)
+from utils.elastic_loader import (ConcurrentElasticLoader, ElasticLoader,
+                                  RenameError)
+from utils.index_rebuilder import IndexRebuilder, handoff_lock
+from utils.metrics import (ROWS_PER_SECOND, STAGE_SECONDS, checkpoint_cycle,
+                           rows_extracted, start_metrics_server)
+from utils.notify import ChangeListener
+from utils.outbox import install_outbox
+from utils.partitions import PartitionLeases, PartitionSet
+from utils.postgres_extractor import (POSITION_KEYS, Checkpoint,
+                                      PostgresMovieExtractor, StateKeys,
                                       postgres_conn_context)
-from utils.storage import JsonFileStorage, State
+from utils.profiling import PROFILER
+from utils.reconciler import Reconciler
+from utils.sinks import Sink, create_sinks
+from utils.snapshot import SnapshotLoader, SnapshotWriter, read_manifest
+from utils.storage import MemoryStorage, State, state_context
+from utils.transform_pool import TransformPool
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+EXTRACT_BATCH = (
+    AdaptiveBatchSize('extract', SETTINGS.EXTRACT_TARGET_LATENCY)
+    if SETTINGS.ADAPTIVE_BATCH else None
+)
+BULK_BATCH = (
+    AdaptiveBatchSize('bulk', SETTINGS.BULK_TARGET_LATENCY)
+    if SETTINGS.ADAPTIVE_BATCH else None
+)
+SINKS = create_sinks(SETTINGS.EXTRA_INDICES)
+REPLICA = (
+    ReplicaConnection(SETTINGS.REPLICA_DSN) if SETTINGS.REPLICA_DSN else None
+)
+LEASES = (
+    PartitionLeases(SETTINGS.POSTGRES_DSL.dict())
+    if SETTINGS.PARTITIONS > 1 else None
+)
+TRANSFORM_POOL = (
+    TransformPool() if SETTINGS.TRANSFORM_WORKERS > 0 else None
+)
 
-def load(extractor: PostgresMovieExtractor, loader: ElasticLoader) -> None:
+
+def open_state() -> ContextManager[State]:
+    """
+    Открыть состояние загрузки в хранилище, выбранном в настройках.
+
+    :return: контекстный менеджер состояния.
+    """
+    if SETTINGS.STATE_BACKEND == 'sqlite':
+        file_path = SETTINGS.STATE_DB_FILE
+    else:
+        file_path = SETTINGS.STATE_FILE
+    return state_context(
+        SETTINGS.STATE_BACKEND, file_path, SETTINGS.STATE_FLUSH_INTERVAL,
+        SETTINGS.POSTGRES_DSL.dict(),
+    )
+
+
+def replica_session() -> ContextManager[Optional[ReplicaRead]]:
+    """
+    Открыть реплику для чтения на время цикла, если она задана.
+
+    :return: контекстный менеджер реплики; None - чтение с основного
+        сервера.
+    """
+    if REPLICA is None:
+        return nullcontext()
+    return REPLICA.read_session()
+
+
+def transform_rows(dataklass: type, rows: list) -> list[dict]:
+    """
+    Преобразовать строки в документы в текущем процессе.
+
+    :param dataklass: класс представления фильма.
+    :param rows: строки фильмов.
+    :return: документы.
+    """
+    with STAGE_SECONDS.labels(stage='transform').time():
+        return [dataklass(**row).as_document() for row in rows]
+
+
+def observe_throughput(rows_before: float, started: float) -> None:
+    """
+    Обновить скорость обработки строк за цикл загрузки.
+
+    :param rows_before: значение счетчика строк в начале цикла.
+    :param started: время начала цикла по time.monotonic().
+    :return:
+    """
+    elapsed = time.monotonic() - started
+    if elapsed > 0:
+        ROWS_PER_SECOND.set((rows_extracted() - rows_before) / elapsed)
+
+
+def feed_sinks(
+        extractor: PostgresMovieExtractor,
+        batches: Iterable[tuple[list, Optional[Checkpoint]]],
+        sinks: Sequence[tuple[Sink, ElasticLoader]]
+) -> Generator[tuple[list, Optional[Checkpoint]], None, None]:
+    """
+    Передать батчи строк в дополнительные индексы и вернуть их дальше
+    без изменений. Каждый индекс фиксирует чекпоинты в своих ключах
+    состояния после загрузки своих документов.
+
+    :param extractor: объект, извлекающий из базы данных класс.
+    :param batches: батчи строк и чекпоинты.
+    :param sinks: дополнительные индексы и их загрузчики.
+    :return: те же батчи строк и чекпоинты.
+    """
+    for rows, checkpoint in batches:
+        for sink, sink_loader in sinks:
+            with STAGE_SECONDS.labels(stage='transform').time():
+                documents = sink.transform(rows)
+            if checkpoint:
+                documents.extend(
+                    document for document in map(sink.rename_document,
+                                                 checkpoint.renames)
+                    if document
+                )
+                sink_loader.add_checkpoint(partial(
+                    extractor.commit, checkpoint, sink.state_prefix
+                ))
+            for document in documents:
+                sink_loader.add_in_batch(document)
+            if sink_loader.is_batch_ready():
+                sink_loader.save()
+        yield rows, checkpoint
+
+
+def load(extractor: PostgresMovieExtractor,
+         loader: ElasticLoader,
+         transform_pool: Optional[TransformPool] = None,
+         changes: Optional[dict[str, set[str]]] = None,
+         sinks: Sequence[tuple[Sink, ElasticLoader]] = ()) -> None:
     """
     Загрузка батчей данных из базы данных Postgres в индекс Elasticsearch.
 
     :param extractor: объект, извлекающий из базы данных класс.
     :param loader: объект, загружающий документы в полнотекстовый индекс.
+    :param transform_pool: пул процессов для преобразования строк,
+        без пула строки преобразуются в текущем процессе.
+    :param changes: ID изменений по таблицам; если переданы, загружаются
+        только связанные с ними фильмы, иначе - все изменения с чекпоинта.
+    :param sinks: дополнительные индексы и их загрузчики, заполняемые
+        из тех же строк.
     :return:
     """
     dataklass = extractor.dataklass
-    for batch in extractor.extract_all():
-        for row in batch:
-            obj = dataklass(**row)
-            loader.add_in_batch(obj.as_document())
+    if changes is None:
+        batches = extractor.extract_all()
+    else:
+        batches = extractor.extract_changes(changes)
+    if sinks:
+        batches = feed_sinks(extractor, batches, sinks)
+    if transform_pool:
+        documents_batches = transform_pool.imap(dataklass, batches)
+    else:
+        documents_batches = (
+            (transform_rows(dataklass, batch),
+             [checkpoint] if checkpoint else [])
+            for batch, checkpoint in batches
+        )
+    for documents, checkpoints in documents_batches:
+        for document in documents:
+            loader.add_in_batch(document)
+        for checkpoint in checkpoints:
+            for rename in checkpoint.renames:
+                loader.add_rename(rename)
+            loader.add_checkpoint(partial(extractor.commit, checkpoint))
         if loader.is_batch_ready():
             loader.save()
-    loader.save()
+    loader.flush()
+    for _, sink_loader in sinks:
+        sink_loader.flush()
+
+
+def prepare_hash_cache(hash_cache: Optional[DocumentHashCache],
+                       state: State,
+                       prefixes: Sequence[str] = ('',)) -> None:
+    """
+    Очистить кэш хешей перед полной перезагрузкой, чтобы сброс
+    состояния приводил к повторной отправке всех документов.
+
+    :param hash_cache: кэш хешей документов.
+    :param state: состояние загрузки.
+    :param prefixes: префиксы ключей состояния индекса по партициям.
+    :return:
+    """
+    if hash_cache is None:
+        return
+    state_keys = [key for key in POSITION_KEYS if key != StateKeys.OUTBOX]
+    if not any(state.get_state(prefix + key)
+               for prefix in prefixes for key in state_keys):
+        logger.info('State is empty, clearing document hash cache.')
+        hash_cache.clear()
 
 
-@backoff((ConnectionError, OperationalError))
-def etl() -> None:
+def create_loader(
+        es_client: Elasticsearch,
+        index: str,
+        hash_cache: Optional[DocumentHashCache] = None,
+        mapping: dict = SETTINGS.ELASTIC_DSL.ES_MAPPING
+) -> ElasticLoader:
+    """
+    Создать загрузчик в зависимости от настроек конкурентности.
+
+    :param es_client: соединение с Elasticsearch.
+    :param index: название индекса или алиаса.
+    :param hash_cache: кэш хешей документов.
+    :param mapping: маппинг индекса.
+    :return:
+    """
+    loader_class = (ConcurrentElasticLoader
+                    if SETTINGS.BULK_CONCURRENCY > 1 else ElasticLoader)
+    return loader_class(es_client, index, mapping, hash_cache=hash_cache,
+                        batch_sizer=BULK_BATCH)
+
+
+def run_load(extractor: PostgresMovieExtractor,
+             loader: ElasticLoader,
+             changes: Optional[dict[str, set[str]]] = None,
+             sinks: Sequence[tuple[Sink, ElasticLoader]] = ()) -> None:
+    """
+    Выполнить загрузку с пулом процессов преобразования, если он включен,
+    и освободить ресурсы загрузчиков.
+
+    :param extractor: объект, извлекающий из базы данных класс.
+    :param loader: объект, загружающий документы в полнотекстовый индекс.
+    :param changes: ID изменений по таблицам для точечной загрузки.
+    :param sinks: дополнительные индексы и их загрузчики.
+    :return:
+    """
+    logger.info('Started loading.')
+    rows_before, started = rows_extracted(), time.monotonic()
+    cycle = checkpoint_cycle() if changes is None else nullcontext()
+    try:
+        with PROFILER.cycle(), cycle:
+            load(extractor, loader, TRANSFORM_POOL, changes, sinks)
+    finally:
+        loader.close()
+        for _, sink_loader in sinks:
+            sink_loader.close()
+    observe_throughput(rows_before, started)
+    logger.info('Finished loaded.')
+
+
+@backoff((ConnectionError, OperationalError, InterfaceError, RenameError))
+def etl(pg: PostgresConnection,
+        es: ElasticConnection,
+        changes: Optional[dict[str, set[str]]] = None) -> None:
     """
     Функция, описывающая процесс ETL.
+    Соединения переиспользуются между циклами; при ошибке заново
+    открывается только разорванное соединение, а цикл продолжается
+    с последнего чекпоинта.
+    При включенных партициях процесс загружает только захваченные
+    партиции, а если свободных партиций нет, ждет следующего цикла.
+    Изменения по чекпоинтам читаются с реплики, если она задана;
+    точечная загрузка по уведомлениям читает с основного сервера,
+    куда изменения попадают раньше.
+    Цикл держит блокировку переключения индекса: перезагрузка
+    не переключит алиас и не перепишет позиции, пока цикл не запишет
+    свои.
+    :param pg: соединение с PostgreSQL.
+    :param es: соединение с Elasticsearch.
+    :param changes: ID изменений по таблицам для точечной загрузки.
+    :return:
+    """
+    partitions = None
+    partition_prefixes = ('',)
+    if LEASES is not None:
+        partitions = LEASES.claim()
+        if not partitions.held:
+            logger.info('No free partitions, standing by.')
+            return
+        partition_prefixes = partitions.prefixes
+    with pg.session() as pg_conn, es.session() as es_client, \
+            handoff_lock(pg_conn), open_state() as state, \
+            ExitStack() as stack:
+        hash_cache = stack.enter_context(hash_cache_context(
+            SETTINGS.HASH_CACHE_FILE, SETTINGS.HASH_CACHE_SIZE
+        ))
+        dim_cache = stack.enter_context(dimension_cache_context(
+            SETTINGS.DIMENSION_CACHE_FILE, SETTINGS.PARTIAL_UPDATES
+        ))
+        replica = None
+        if changes is None:
+            replica = stack.enter_context(replica_session())
+        replica_conn, replayed = replica or (None, None)
+        prepare_hash_cache(hash_cache, state, partition_prefixes)
+        loader = create_loader(
+            es_client, SETTINGS.ELASTIC_DSL.ES_INDEX_NAME, hash_cache
+        )
+        if dim_cache is not None:
+            dim_cache.bind(loader.index_uuid())
+        sinks = []
+        for sink in SINKS:
+            sink_cache = stack.enter_context(hash_cache_context(
+                sink.hash_cache_file, SETTINGS.HASH_CACHE_SIZE
+            ))
+            prepare_hash_cache(sink_cache, state, [
+                partition + sink.state_prefix
+                for partition in partition_prefixes
+            ])
+            sinks.append((sink, create_loader(
+                es_client, sink.index, sink_cache, sink.mapping
+            )))
+        ext_obj = PostgresMovieExtractor(
+            pg_conn, state, dim_cache, EXTRACT_BATCH,
+            ('',) + tuple(sink.state_prefix for sink in SINKS),
+            partitions, replica_conn, replayed, LEASES,
+        )
+        run_load(ext_obj, loader, changes, sinks)
+
+
+def save_cursors(cursors: dict) -> None:
+    """
+    Перенести в основное состояние позиции, полученные загрузкой всех
+    фильмов. Позиции, которых у новой версии индекса нет, удаляются:
+    они относятся к прежней версии. При включенных партициях позиции
+    подходят всем партициям и записываются в ключи каждой из них.
+    :param cursors: позиции по ключам состояния.
+    :return:
+    """
+    partition_prefixes = ('',)
+    if LEASES is not None:
+        partition_prefixes = PartitionSet(SETTINGS.PARTITIONS,
+                                          ()).all_prefixes
+    with open_state() as state:
+        for key in POSITION_KEYS:
+            for partition in partition_prefixes:
+                state.set_state(partition + key, cursors.get(key) or None)
+
+
+def save_dimensions(index_uuid: str,
+                    names: Optional[DimensionCache] = None) -> None:
+    """
+    Привязать кэш имен персон и жанров к новой версии индекса и
+    заменить его содержимое именами, с которыми фильмы загружены в нее.
+    Без имен кэш остается пустым, и изменения персон и жанров после
+    позиций новой версии извлекают связанные фильмы заново.
+    :param index_uuid: uuid новой версии индекса
+    :param names: кэш имен, заполненный при загрузке новой версии
+    :return:
+    """
+    with dimension_cache_context(SETTINGS.DIMENSION_CACHE_FILE,
+                                 SETTINGS.PARTIAL_UPDATES) as dim_cache:
+        if dim_cache is None:
+            return
+        dim_cache.bind(index_uuid)
+        dim_cache.clear()
+        if names is not None:
+            dim_cache.update(names.items())
+
+
+@backoff((ConnectionError, OperationalError, InterfaceError))
+def rebuild(pg: PostgresConnection, es: ElasticConnection) -> None:
+    """
+    Полная перезагрузка индекса без простоя: фильмы загружаются
+    в новую версию индекса, после чего на нее переключается алиас.
+    Чекпоинты перезагрузки переносятся в основное состояние, а имена
+    персон и жанров из ее снимка базы - в кэш имен.
+    :param pg: соединение с PostgreSQL.
+    :param es: соединение с Elasticsearch.
+    :return:
+    """
+    with pg.session() as pg_conn, es.session() as es_client, \
+            replica_session() as replica, dimension_cache_context(
+                ':memory:', SETTINGS.PARTIAL_UPDATES) as rebuild_dims:
+        rebuilder = IndexRebuilder(
+            es_client, SETTINGS.ELASTIC_DSL.ES_INDEX_NAME
+        )
+        index = rebuilder.create_version()
+        rebuild_state = State(MemoryStorage())
+        replica_conn, replayed = replica or (None, None)
+        ext_obj = PostgresMovieExtractor(
+            pg_conn, rebuild_state, rebuild_dims, EXTRACT_BATCH,
+            replica_conn=replica_conn, replayed=replayed,
+        )
+        run_load(ext_obj, create_loader(es_client, index))
+        rebuilder.finalize(index)
+        with handoff_lock(pg_conn, exclusive=True):
+            rebuilder.swap(index)
+            save_dimensions(rebuilder.index_uuid(index), rebuild_dims)
+            save_cursors({key: rebuild_state.get_state(key)
+                          for key in POSITION_KEYS})
+        rebuilder.prune(index)
+
+
+@backoff((ConnectionError, OperationalError, InterfaceError))
+def reconcile(pg: PostgresConnection, es: ElasticConnection) -> None:
+    """
+    Сверка индекса фильмов с базой: отсутствующие и устаревшие документы
+    загружаются заново, документы удаленных фильмов удаляются.
+    Состояние загрузки не меняется.
+    :param pg: соединение с PostgreSQL.
+    :param es: соединение с Elasticsearch.
+    :return:
+    """
+    with pg.session() as pg_conn, es.session() as es_client, \
+            hash_cache_context(SETTINGS.HASH_CACHE_FILE,
+                               SETTINGS.HASH_CACHE_SIZE) as hash_cache:
+        ext_obj = PostgresMovieExtractor(pg_conn, State(MemoryStorage()))
+        loader = create_loader(es_client, SETTINGS.ELASTIC_DSL.ES_INDEX_NAME)
+        try:
+            Reconciler(ext_obj, loader, hash_cache).run()
+        finally:
+            loader.close()
+
+
+@backoff((OperationalError, InterfaceError))
+def snapshot(pg: PostgresConnection, directory: str) -> None:
+    """
+    Выгрузить все фильмы в снимок без обращения к Elasticsearch.
+    :param pg: соединение с PostgreSQL.
+    :param directory: каталог снимка.
+    :return:
+    """
+    with pg.session() as pg_conn, replica_session() as replica:
+        snapshot_state = State(MemoryStorage())
+        replica_conn, replayed = replica or (None, None)
+        ext_obj = PostgresMovieExtractor(
+            pg_conn, snapshot_state, batch_sizer=EXTRACT_BATCH,
+            replica_conn=replica_conn, replayed=replayed,
+        )
+        run_load(ext_obj, SnapshotWriter(directory, snapshot_state))
+
+
+@backoff((ConnectionError, OperationalError, InterfaceError))
+def restore(pg: PostgresConnection,
+            es: ElasticConnection,
+            directory: str) -> None:
+    """
+    Загрузить снимок в новую версию индекса без чтения фильмов из базы
+    и переключить на нее алиас. Позиции снимка переносятся
+    в основное состояние, а кэш имен персон и жанров очищается.
+    :param pg: соединение с PostgreSQL для блокировки переключения.
+    :param es: соединение с Elasticsearch.
+    :param directory: каталог снимка.
+    :return:
+    """
+    manifest = read_manifest(directory)
+    if (SETTINGS.CHANGE_SOURCE == 'outbox'
+            and not manifest['state'].get(StateKeys.OUTBOX)):
+        raise ValueError(f'Snapshot in {directory} has no outbox position '
+                         'and cannot be restored with CHANGE_SOURCE=outbox.')
+    with pg.session() as pg_conn, es.session() as es_client:
+        rebuilder = IndexRebuilder(
+            es_client, SETTINGS.ELASTIC_DSL.ES_INDEX_NAME
+        )
+        index = rebuilder.create_version()
+        loader = SnapshotLoader(es_client, index)
+        try:
+            loader.restore(directory)
+        finally:
+            loader.close()
+        rebuilder.finalize(index)
+        with handoff_lock(pg_conn, exclusive=True):
+            rebuilder.swap(index)
+            save_dimensions(rebuilder.index_uuid(index))
+            save_cursors(manifest['state'])
+        rebuilder.prune(index)
+
+
+async def async_load(
+        extractor: AsyncPostgresMovieExtractor,
+        loader: AsyncElasticLoader,
+        queue_size: int = SETTINGS.PIPELINE_QUEUE_SIZE
+) -> None:
+    """
+    Асинхронная загрузка: извлечение, преобразование и загрузка идут
+    параллельно, связанные ограниченными очередями. Заполненная очередь
+    приостанавливает предыдущую стадию. Преобразование выполняется
+    в отдельном потоке, чтобы не останавливать цикл событий, пока
+    идут запросы к базе и индексу.
+
+    :param extractor: объект, извлекающий из базы данных класс.
+    :param loader: объект, загружающий документы в полнотекстовый индекс.
+    :param queue_size: размер очередей между стадиями.
+    :return:
+    """
+    rows_queue = asyncio.Queue(maxsize=queue_size)
+    docs_queue = asyncio.Queue(maxsize=queue_size)
+    dataklass = extractor.dataklass
+
+    async def extract() -> None:
+        async for item in extractor.extract_all():
+            await rows_queue.put(item)
+        await rows_queue.put(None)
+
+    async def transform() -> None:
+        while (item := await rows_queue.get()) is not None:
+            batch, checkpoint = item
+            documents = await asyncio.to_thread(transform_rows,
+                                                dataklass, batch)
+            await docs_queue.put((documents, checkpoint))
+        await docs_queue.put(None)
+
+    async def save() -> None:
+        while (item := await docs_queue.get()) is not None:
+            documents, checkpoint = item
+            for document in documents:
+                loader.add_in_batch(document)
+            if checkpoint:
+                loader.add_checkpoint(partial(extractor.commit, checkpoint))
+            if loader.is_batch_ready():
+                await loader.save()
+        await loader.flush()
+
+    tasks = [asyncio.create_task(stage())
+             for stage in (extract, transform, save)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@backoff((ConnectionError, OperationalError, OSError,
+          asyncpg.PostgresConnectionError))
+def async_etl() -> None:
+    """
+    Функция, описывающая процесс ETL в асинхронном режиме.
+    Состояние фиксируется так же, как в etl(), под той же блокировкой
+    переключения индекса.
+    :return:
+    """
+
+    async def run() -> None:
+        logging.info('Initializing async postgresql and elasticsearch '
+                     'connection.')
+        pg_conn = await asyncpg.connect(
+            database=SETTINGS.POSTGRES_DSL.dbname,
+            user=SETTINGS.POSTGRES_DSL.user,
+            password=SETTINGS.POSTGRES_DSL.password,
+            host=SETTINGS.POSTGRES_DSL.host,
+            port=SETTINGS.POSTGRES_DSL.port,
+        )
+        try:
+            await init_connection(pg_conn)
+            await pg_conn.execute('SELECT pg_advisory_lock_shared($1)',
+                                  SETTINGS.HANDOFF_LOCK_KEY)
+            async with async_es_create_connection(
+                    **SETTINGS.ELASTIC_DSL.dict()) as es_client:
+                with open_state() as state, hash_cache_context(
+                        SETTINGS.HASH_CACHE_FILE,
+                        SETTINGS.HASH_CACHE_SIZE) as hash_cache:
+                    prepare_hash_cache(hash_cache, state)
+                    loader = AsyncElasticLoader(
+                        es_client,
+                        SETTINGS.ELASTIC_DSL.ES_INDEX_NAME,
+                        hash_cache=hash_cache,
+                    )
+                    await loader.create_index()
+                    ext_obj = AsyncPostgresMovieExtractor(pg_conn, state)
+                    logger.info('Started loading.')
+                    rows_before = rows_extracted()
+                    started = time.monotonic()
+                    with checkpoint_cycle():
+                        await async_load(ext_obj, loader)
+                    observe_throughput(rows_before, started)
+                    logger.info('Finished loaded.')
+        finally:
+            await pg_conn.close()
+
+    asyncio.run(run())
+
+
+@backoff((OperationalError, InterfaceError))
+def prepare_outbox(pg: PostgresConnection) -> None:
+    """
+    Установить журнал изменений, если он выбран источником изменений.
+    :param pg: соединение с PostgreSQL.
+    :return:
+    """
+    with pg.session() as pg_conn:
+        install_outbox(pg_conn)
+
+
+@backoff((OperationalError,))
+def listen_etl(pg: PostgresConnection, es: ElasticConnection) -> None:
+    """
+    ETL по уведомлениям PostgreSQL: изменения, полученные через
+    LISTEN/NOTIFY, загружаются через debounce-окно, а полный проход
+    по чекпоинтам раз в ETL_DELAY секунд остается страховочным.
+    :param pg: соединение с PostgreSQL для загрузки.
+    :param es: соединение с Elasticsearch.
     :return:
     """
-    logging.info('Initializing postgresql and elasticsearch connection.')
-    with postgres_conn_context(SETTINGS.POSTGRES_DSL.dict()) as pg_conn, \
-            es_create_connection(**SETTINGS.ELASTIC_DSL.dict()) as es_client:
-        state = State(JsonFileStorage(SETTINGS.STATE_FILE))
-        loader = ElasticLoader(es_client, SETTINGS.ELASTIC_DSL.ES_INDEX_NAME)
-        ext_obj = PostgresMovieExtractor(pg_conn, state)
-        logger.info('Started loading.')
-        load(ext_obj, loader)
-        logger.info('Finished loaded.')
+    logging.info('Initializing postgresql listener connection.')
+    with postgres_conn_context(SETTINGS.POSTGRES_DSL.dict()) as listen_conn:
+        listener = ChangeListener(listen_conn, SETTINGS.LISTEN_CHANNEL)
+        if SETTINGS.LISTEN_INSTALL_TRIGGERS:
+            listener.install_triggers()
+        listener.listen()
+        next_sweep = time.monotonic()
+        while True:
+            if time.monotonic() >= next_sweep:
+                etl(pg, es)
+                next_sweep = time.monotonic() + SETTINGS.ETL_DELAY
+            changes = listener.collect(
+                timeout=next_sweep - time.monotonic(),
+                debounce=SETTINGS.LISTEN_DEBOUNCE,
+            )
+            if changes:
+                logger.info(
+                    'Received changes: '
+                    + ', '.join(f'{table}={len(ids)}'
+                                for table, ids in changes.items())
+                )
+                etl(pg, es, changes)
 
 
 if __name__ == '__main__':
-    while True:
-        etl()
-        time.sleep(SETTINGS.ETL_DELAY)
+    parser = argparse.ArgumentParser(
+        description='ETL фильмов из PostgreSQL в Elasticsearch.'
+    )
+    parser.add_argument(
+        'command',
+        nargs='?',
+        default='run',
+        choices=('run', 'rebuild', 'reconcile', 'snapshot', 'restore'),
+        help='run - постоянная загрузка изменений, '
+             'rebuild - полная перезагрузка индекса без простоя, '
+             'reconcile - сверка индекса с базой и исправление расхождений, '
+             'snapshot - выгрузка документов в снимок, '
+             'restore - загрузка снимка в новую версию индекса',
+    )
+    parser.add_argument(
+        'path',
+        nargs='?',
+        default=SETTINGS.SNAPSHOT_DIR,
+        help='каталог снимка для команд snapshot и restore',
+    )
+    args = parser.parse_args()
+    PROFILER.install()
+    if SETTINGS.METRICS_PORT:
+        start_metrics_server(SETTINGS.METRICS_HOST, SETTINGS.METRICS_PORT)
+    pg = PostgresConnection(SETTINGS.POSTGRES_DSL.dict())
+    es = ElasticConnection(**SETTINGS.ELASTIC_DSL.dict())
+    try:
+        if (SETTINGS.CHANGE_SOURCE == 'outbox'
+                and SETTINGS.OUTBOX_INSTALL_TRIGGERS):
+            prepare_outbox(pg)
+        if args.command == 'rebuild':
+            rebuild(pg, es)
+            sys.exit()
+        if args.command == 'reconcile':
+            reconcile(pg, es)
+            sys.exit()
+        if args.command == 'snapshot':
+            snapshot(pg, args.path)
+            sys.exit()
+        if args.command == 'restore':
+            restore(pg, es, args.path)
+            sys.exit()
+        if SETTINGS.ETL_MODE == 'listen':
+            listen_etl(pg, es)
+        while True:
+            if SETTINGS.ETL_MODE == 'async':
+                async_etl()
+            else:
+                etl(pg, es)
+            time.sleep(SETTINGS.ETL_DELAY)
+    finally:
+        if TRANSFORM_POOL is not None:
+            TRANSFORM_POOL.close()
+        if LEASES is not None:
+            LEASES.release()
+        if REPLICA is not None:
+            REPLICA.reset()
+        pg.reset()
+        es.reset()
@@ -0,0 +1,85 @@
+"""Соединение с PostgreSQL в памяти для тестов извлечения."""
+
+import copy
+from typing import Callable, Iterable
+
+Handler = Callable[[dict, tuple], Iterable]
+
+
+class FakeCursor:
+    """Курсор, передающий запросы обработчикам FakeConnection."""
+
+    def __init__(self, conn: 'FakeConnection'):
+        self.conn = conn
+        self.rows = []
+        self.itersize = 0
+
+    def execute(self, query: str, values: tuple = ()) -> None:
+        if query.startswith('SET TRANSACTION'):
+            self.conn.repeatable_read = True
+            return
+        self.rows = list(self.conn.handle(query, values))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size: int) -> list:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def __iter__(self) -> 'FakeCursor':
+        return self
+
+    def __next__(self):
+        if not self.rows:
+            raise StopIteration
+        return self.rows.pop(0)
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    """
+    Соединение с базой в памяти. В транзакции REPEATABLE READ запросы
+    видят снимок, сделанный первым запросом, иначе - текущие данные.
+    Запрос выполняет обработчик, заданный для его текста: он получает
+    видимые данные и параметры запроса и возвращает строки.
+    """
+
+    closed = False
+
+    def __init__(self, data: dict, handlers: dict[str, Handler]):
+        self.data = data
+        self.handlers = handlers
+        self.repeatable_read = False
+        self.snapshot = None
+
+    def view(self) -> dict:
+        if not self.repeatable_read:
+            return self.data
+        if self.snapshot is None:
+            self.snapshot = copy.deepcopy(self.data)
+        return self.snapshot
+
+    def handle(self, query: str, values: tuple) -> Iterable:
+        handler = self.handlers.get(query)
+        if handler is None:
+            raise AssertionError(f'Unexpected query: {query}')
+        return handler(self.view(), values)
+
+    def cursor(self, name: str = None) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        self.repeatable_read = False
+        self.snapshot = None
@@ -0,0 +1,84 @@
+"""Стадии асинхронного конвейера."""
+
+import asyncio
+import inspect
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import main
+
+
+class FakeExtractor:
+    """Извлекатель, выдающий заданные батчи строк."""
+
+    dataklass = dict
+
+    def __init__(self, batches: list):
+        self.batches = batches
+        self.committed = []
+
+    async def extract_all(self):
+        for batch in self.batches:
+            yield batch
+
+    def commit(self, checkpoint: str) -> None:
+        self.committed.append(checkpoint)
+
+
+class FakeLoader:
+    """Загрузчик, фиксирующий чекпоинты при каждом сохранении."""
+
+    def __init__(self):
+        self.documents = []
+        self.checkpoints = []
+
+    def add_in_batch(self, document: dict) -> None:
+        self.documents.append(document)
+
+    def add_checkpoint(self, checkpoint) -> None:
+        self.checkpoints.append(checkpoint)
+
+    def is_batch_ready(self) -> bool:
+        return True
+
+    async def save(self) -> None:
+        for checkpoint in self.checkpoints:
+            checkpoint()
+        self.checkpoints = []
+
+    async def flush(self) -> None:
+        await self.save()
+
+
+class AsyncLoadTest(unittest.TestCase):
+    """Преобразование не выполняется в потоке цикла событий."""
+
+    def test_transform_runs_off_event_loop(self) -> None:
+        threads = []
+
+        def transform_rows(dataklass: type, rows: list) -> list:
+            threads.append(threading.current_thread())
+            return [{'id': row['id']} for row in rows]
+
+        extractor = FakeExtractor([([{'id': 1}], 'first'),
+                                   ([{'id': 2}], 'second')])
+        loader = FakeLoader()
+        with mock.patch.object(main, 'transform_rows', transform_rows):
+            asyncio.run(main.async_load(extractor, loader))
+        self.assertEqual(2, len(threads))
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual([{'id': 1}, {'id': 2}], loader.documents)
+        self.assertEqual(['first', 'second'], extractor.committed)
+
+
+if __name__ == '__main__':
+    unittest.main()
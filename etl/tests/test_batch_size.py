@@ -0,0 +1,88 @@
+"""Подбор размера батча по задержке и отказам."""
+
+import inspect
+import os
+import sys
+import unittest
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.batch_size import AdaptiveBatchSize
+
+
+def batch_size(initial: int = 100,
+               minimum: int = 10,
+               maximum: int = 1000) -> AdaptiveBatchSize:
+    """
+    Размер батча с целевой задержкой в одну секунду.
+    :param initial: начальный размер
+    :param minimum: минимальный размер
+    :param maximum: максимальный размер
+    :return:
+    """
+    return AdaptiveBatchSize('test', 1.0, initial=initial,
+                             minimum=minimum, maximum=maximum)
+
+
+class ObserveTest(unittest.TestCase):
+    """Размер сдвигается к целевой задержке в заданных границах."""
+
+    def test_growth_capped(self) -> None:
+        sizer = batch_size()
+        sizer.observe(0.001, 100)
+        self.assertEqual(150, sizer.value)
+
+    def test_smoothing(self) -> None:
+        sizer = batch_size()
+        sizer.observe(2.0, 100)
+        self.assertEqual(75, sizer.value)
+        sizer.observe(1.0, 100)
+        self.assertEqual(87, sizer.value)
+
+    def test_halved_on_rejection(self) -> None:
+        sizer = batch_size()
+        sizer.observe(0.001, 100, rejected=True)
+        self.assertEqual(50, sizer.value)
+
+    def test_clamped_to_floor(self) -> None:
+        sizer = batch_size(minimum=40)
+        for _ in range(3):
+            sizer.observe(1.0, 100, rejected=True)
+        self.assertEqual(40, sizer.value)
+
+    def test_clamped_to_ceiling(self) -> None:
+        sizer = batch_size(maximum=120)
+        sizer.observe(0.001, 100)
+        self.assertEqual(120, sizer.value)
+
+    def test_initial_clamped(self) -> None:
+        self.assertEqual(1000, batch_size(initial=5000).value)
+        self.assertEqual(10, batch_size(initial=1).value)
+
+    def test_empty_observation_ignored(self) -> None:
+        sizer = batch_size()
+        sizer.observe(0.0, 100)
+        sizer.observe(1.0, 0)
+        self.assertEqual(100, sizer.value)
+
+    def test_small_change_not_logged(self) -> None:
+        sizer = batch_size()
+        with self.assertNoLogs(level='INFO'):
+            sizer.observe(1.1, 100)
+        self.assertEqual(95, sizer.value)
+
+    def test_large_change_logged(self) -> None:
+        sizer = batch_size()
+        with self.assertLogs(level='INFO') as logs:
+            sizer.observe(1.0, 100, rejected=True)
+        self.assertIn('Test batch size set to 50', logs.output[0])
+        with self.assertNoLogs(level='INFO'):
+            sizer.observe(1.1, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Проверка несовместимых настроек при запуске."""
+
+import inspect
+import os
+import sys
+import unittest
+
+from pydantic import ValidationError
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import Settings
+
+
+class AsyncModeTest(unittest.TestCase):
+    """Режим async не запускается с возможностями, которых у него нет."""
+
+    def test_default_settings(self) -> None:
+        settings = Settings(ETL_MODE='async')
+        self.assertEqual('async', settings.ETL_MODE)
+        self.assertFalse(settings.FULL_LOAD_STREAM)
+
+    def test_unsupported_settings(self) -> None:
+        for name, value in (('CHANGE_SOURCE', 'outbox'),
+                            ('PARTITIONS', 4),
+                            ('EXTRA_INDICES', ['genres']),
+                            ('PARTIAL_UPDATES', True),
+                            ('FULL_LOAD_STREAM', True),
+                            ('ADAPTIVE_BATCH', True),
+                            ('REPLICA_DSN', 'host=replica'),
+                            ('BULK_CONCURRENCY', 4),
+                            ('TRANSFORM_WORKERS', 2)):
+            with self.subTest(name):
+                with self.assertRaisesRegex(ValidationError, name):
+                    Settings(ETL_MODE='async', **{name: value})
+
+    def test_sync_mode_accepts_them(self) -> None:
+        settings = Settings(ETL_MODE='sync', PARTIAL_UPDATES=True,
+                            EXTRA_INDICES=['genres'])
+        self.assertTrue(settings.PARTIAL_UPDATES)
+
+
+class PartitionsStateTest(unittest.TestCase):
+    """Партиции требуют общего состояния в PostgreSQL."""
+
+    def test_local_state_rejected(self) -> None:
+        for backend in ('json', 'sqlite'):
+            with self.subTest(backend):
+                with self.assertRaisesRegex(ValidationError,
+                                            'STATE_BACKEND=postgres'):
+                    Settings(PARTITIONS=4, STATE_BACKEND=backend)
+
+    def test_postgres_state_accepted(self) -> None:
+        settings = Settings(PARTITIONS=4, STATE_BACKEND='postgres')
+        self.assertEqual(4, settings.PARTITIONS)
+
+    def test_single_partition_uses_any_state(self) -> None:
+        settings = Settings(PARTITIONS=1, STATE_BACKEND='json')
+        self.assertEqual('json', settings.STATE_BACKEND)
+
+
+if __name__ == '__main__':
+    unittest.main()
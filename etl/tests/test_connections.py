@@ -0,0 +1,75 @@
+"""Выбор реплики или основного сервера по отставанию реплики."""
+
+import inspect
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from psycopg2 import OperationalError
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from fakes import FakeConnection
+from utils.connections import (REPLICA_LAG_QUERY, ReplicaConnection,
+                               ReplicaRead)
+
+REPLAYED = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class ReadSessionTest(unittest.TestCase):
+    """Цикл читает с реплики, только если она догнала основной сервер."""
+
+    def read(self, status: tuple) -> ReplicaRead:
+        """
+        Открыть сессию чтения с репликой в заданном состоянии.
+        :param status: (in_recovery, replayed, receiving, lag)
+        :return: результат read_session
+        """
+        conn = FakeConnection({}, {
+            REPLICA_LAG_QUERY: lambda data, values: [status],
+        })
+        replica = ReplicaConnection('host=replica', max_lag=5.0)
+        with mock.patch('psycopg2.connect', return_value=conn):
+            with replica.read_session() as read:
+                return read
+
+    def test_replica_within_lag(self) -> None:
+        read = self.read((True, REPLAYED, True, 1.0))
+        self.assertIsNotNone(read)
+        self.assertEqual(REPLAYED, read.replayed)
+
+    def test_primary_when_lag_exceeds_limit(self) -> None:
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertIsNone(self.read((True, REPLAYED, True, 6.0)))
+        self.assertIn('exceeds 5.0s, reading from primary', logs.output[0])
+
+    def test_primary_when_not_receiving(self) -> None:
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(self.read((True, REPLAYED, False, 0.0)))
+
+    def test_primary_when_nothing_replayed(self) -> None:
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(self.read((True, None, True, None)))
+
+    def test_primary_server_not_clamped(self) -> None:
+        read = self.read((False, None, False, None))
+        self.assertIsNotNone(read)
+        self.assertIsNone(read.replayed)
+
+    def test_primary_when_replica_unavailable(self) -> None:
+        replica = ReplicaConnection('host=replica', max_lag=5.0)
+        with mock.patch('psycopg2.connect',
+                        side_effect=OperationalError('refused')), \
+                self.assertLogs(level='WARNING'):
+            with replica.read_session() as read:
+                self.assertIsNone(read)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+"""Загрузка документов bulk-запросами и фиксация чекпоинтов."""
+
+import inspect
+import json
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from elasticsearch.exceptions import BadRequestError
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS
+from utils.cache import DocumentHashCache
+from utils.elastic_loader import ConcurrentElasticLoader, ElasticLoader
+
+
+def fake_client() -> mock.Mock:
+    """
+    Клиент Elasticsearch, у которого индекс уже создан.
+    :return:
+    """
+    client = mock.Mock()
+    client.indices.exists.return_value = True
+    client.indices.get_settings.return_value = {
+        'movies': {'settings': {'index': {'uuid': 'uuid'}}}
+    }
+    client.indices.get_mapping.return_value = {
+        'movies': SETTINGS.ELASTIC_DSL.ES_MAPPING
+    }
+    client.transport.serializers.dumps = (
+        lambda data: json.dumps(data, default=str).encode()
+    )
+    return client
+
+
+class FakeExecutor:
+    """Пул, возвращающий незавершенные futures, которыми управляет тест."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, function, *args) -> Future:
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, **kwargs) -> None:
+        pass
+
+
+class LoaderTestCase(unittest.TestCase):
+    """Фейковый клиент и dead-letter файл во временном каталоге."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dead_letter_file = os.path.join(directory.name,
+                                             'dead_letter.ndjson')
+        self.client = fake_client()
+        self.committed = []
+
+    def checkpoint(self, name: str):
+        """
+        Чекпоинт, записывающий свое имя при фиксации.
+        :param name: имя чекпоинта
+        :return:
+        """
+        return lambda: self.committed.append(name)
+
+
+class ConcurrentOrderTest(LoaderTestCase):
+    """Чекпоинты фиксируются в порядке батчей, а не ответов."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.loader = ConcurrentElasticLoader(
+            self.client, 'movies', concurrency=3,
+            dead_letter_file=self.dead_letter_file,
+        )
+        self.executor = self.loader._executor = FakeExecutor()
+
+    def send(self, name: str) -> None:
+        """
+        Отправить батч из одного документа с чекпоинтом.
+        :param name: ID документа и имя чекпоинта
+        :return:
+        """
+        self.loader.add_in_batch({'id': name})
+        self.loader.add_checkpoint(self.checkpoint(name))
+        self.loader.save()
+
+    def test_later_batch_waits_for_earlier(self) -> None:
+        self.send('first')
+        self.send('second')
+        first, second = self.executor.futures
+        second.set_result(set())
+        self.loader._complete(2)
+        self.assertEqual([], self.committed)
+        first.set_result(set())
+        self.loader._complete(2)
+        self.assertEqual(['first', 'second'], self.committed)
+
+    def test_checkpoint_without_documents_keeps_order(self) -> None:
+        self.send('first')
+        self.loader.add_checkpoint(self.checkpoint('empty'))
+        self.loader.save()
+        self.assertEqual([], self.committed)
+        self.executor.futures[0].set_result(set())
+        self.loader.flush()
+        self.assertEqual(['first', 'empty'], self.committed)
+
+    def test_failed_batch_stops_later_checkpoints(self) -> None:
+        self.send('first')
+        self.send('second')
+        first, second = self.executor.futures
+        second.set_result(set())
+        first.set_exception(ConnectionError('bulk failed'))
+        with self.assertRaises(ConnectionError):
+            self.loader.flush()
+        self.assertEqual([], self.committed)
+
+
+class MappingUpdateTest(LoaderTestCase):
+    """Маппинг существующего индекса дополняется только новыми полями."""
+
+    def loader(self) -> ElasticLoader:
+        """
+        Загрузчик существующего индекса.
+        :return:
+        """
+        return ElasticLoader(self.client, 'movies',
+                             dead_letter_file=self.dead_letter_file)
+
+    def set_existing(self, *removed: str) -> None:
+        """
+        Маппинг индекса без указанных полей.
+        :param removed: поля, которых нет в индексе
+        :return:
+        """
+        mapping = SETTINGS.ELASTIC_DSL.ES_MAPPING['mappings']
+        properties = {name: field
+                      for name, field in mapping['properties'].items()
+                      if name not in removed}
+        self.client.indices.get_mapping.return_value = {
+            'movies_v1': {'mappings': {'properties': properties}}
+        }
+
+    def test_current_mapping_not_updated(self) -> None:
+        self.loader()
+        self.client.indices.put_mapping.assert_not_called()
+
+    def test_missing_field_added(self) -> None:
+        self.set_existing('modified')
+        self.loader()
+        self.client.indices.put_mapping.assert_called_once_with(
+            index='movies',
+            properties={'modified': {'type': 'date'}},
+        )
+
+    def test_incompatible_mapping_logged(self) -> None:
+        self.set_existing('modified')
+        self.client.indices.put_mapping.side_effect = BadRequestError(
+            'illegal_argument_exception', mock.Mock(), {}
+        )
+        with self.assertLogs(level='ERROR') as logs:
+            self.loader()
+        self.assertIn('main.py rebuild', logs.output[0])
+
+
+def bulk_response(statuses: dict) -> dict:
+    """
+    Ответ bulk-запроса со статусами документов.
+    :param statuses: статусы по ID документов в порядке отправки
+    :return:
+    """
+    return {'errors': any(status >= 300 for status in statuses.values()),
+            'items': [{'index': {'_id': id_, 'status': status,
+                                 'error': {'type': 'error'}
+                                 if status >= 300 else None}}
+                      for id_, status in statuses.items()]}
+
+
+def sent_ids(operations: bytes) -> list[str]:
+    """
+    ID документов в теле bulk-запроса.
+    :param operations: тело запроса
+    :return:
+    """
+    return [json.loads(line)['index']['_id']
+            for line in operations.splitlines()[::2]]
+
+
+class BulkFailuresTest(LoaderTestCase):
+    """Повтор отклоненных документов и запись ошибок в dead-letter файл."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        patcher = mock.patch('utils.elastic_loader.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hash_cache = DocumentHashCache(':memory:', 100)
+        self.addCleanup(self.hash_cache.close)
+        self.loader = ElasticLoader(
+            self.client, 'movies', hash_cache=self.hash_cache,
+            max_retries=2, dead_letter_file=self.dead_letter_file,
+        )
+
+    def dead_letters(self) -> list[str]:
+        """
+        ID документов в dead-letter файле.
+        :return:
+        """
+        if not os.path.exists(self.dead_letter_file):
+            return []
+        with open(self.dead_letter_file, encoding='utf-8') as f:
+            return [json.loads(line)['id'] for line in f]
+
+    def test_handle_results_splits_retry_and_dead_letter(self) -> None:
+        documents = [{'id': 'ok'}, {'id': 'busy'}, {'id': 'invalid'}]
+        results = ElasticLoader._bulk_results(bulk_response(
+            {'ok': 201, 'busy': 429, 'invalid': 400}
+        ))
+        retry, failed = self.loader._handle_results(documents, results, 0)
+        self.assertEqual([{'id': 'busy'}], retry)
+        self.assertEqual({'invalid'}, failed)
+        self.assertEqual(['invalid'], self.dead_letters())
+
+    def test_handle_results_dead_letters_after_last_retry(self) -> None:
+        results = ElasticLoader._bulk_results(bulk_response({'busy': 503}))
+        retry, failed = self.loader._handle_results([{'id': 'busy'}],
+                                                    results, 2)
+        self.assertEqual([], retry)
+        self.assertEqual({'busy'}, failed)
+        self.assertEqual(['busy'], self.dead_letters())
+
+    def test_bulk_resends_only_rejected_documents(self) -> None:
+        self.client.bulk.side_effect = [
+            bulk_response({'ok': 200, 'busy': 429, 'invalid': 400}),
+            bulk_response({'busy': 200}),
+        ]
+        failed = self.loader._bulk(
+            [{'id': 'ok'}, {'id': 'busy'}, {'id': 'invalid'}]
+        )
+        self.assertEqual({'invalid'}, failed)
+        self.assertEqual(
+            [['ok', 'busy', 'invalid'], ['busy']],
+            [sent_ids(call.kwargs['operations'])
+             for call in self.client.bulk.call_args_list],
+        )
+
+    def test_checkpoint_moves_past_dead_letters(self) -> None:
+        self.client.bulk.return_value = bulk_response(
+            {'ok': 200, 'invalid': 400}
+        )
+        for id_ in ('ok', 'invalid'):
+            self.loader.add_in_batch({'id': id_})
+        self.loader.add_checkpoint(self.checkpoint('batch'))
+        self.loader.save()
+        self.assertEqual(['batch'], self.committed)
+        self.assertEqual(['invalid'], self.dead_letters())
+        self.client.bulk.reset_mock()
+        self.client.bulk.return_value = bulk_response({'invalid': 200})
+        for id_ in ('ok', 'invalid'):
+            self.loader.add_in_batch({'id': id_})
+        self.loader.save()
+        self.assertEqual(
+            [['invalid']],
+            [sent_ids(call.kwargs['operations'])
+             for call in self.client.bulk.call_args_list],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
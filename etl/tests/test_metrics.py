@@ -0,0 +1,64 @@
+"""Отставание позиций в метриках."""
+
+import inspect
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.metrics import REGISTRY, checkpoint_cycle, observe_checkpoint
+
+
+def lag(key: str) -> float:
+    """
+    Опубликованное отставание позиции.
+    :param key: ключ состояния
+    :return:
+    """
+    return REGISTRY.get_sample_value('etl_checkpoint_lag_seconds',
+                                     {'key': key})
+
+
+def cursor(seconds_ago: int) -> tuple[str, str]:
+    """
+    Курсор изменения, сделанного seconds_ago секунд назад.
+    :param seconds_ago: давность изменения
+    :return:
+    """
+    moment = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    return moment.isoformat(), '00000000-0000-0000-0000-000000000000'
+
+
+class CheckpointLagTest(unittest.TestCase):
+    """Отставание не растет, пока изменений нет."""
+
+    def test_lag_measured_at_commit(self) -> None:
+        with checkpoint_cycle():
+            observe_checkpoint('test_commit', cursor(60))
+        self.assertAlmostEqual(60, lag('test_commit'), delta=5)
+
+    def test_cycle_without_changes_reports_zero(self) -> None:
+        with checkpoint_cycle():
+            observe_checkpoint('test_idle', cursor(60))
+            observe_checkpoint('test_busy', cursor(60))
+        with checkpoint_cycle():
+            observe_checkpoint('test_busy', cursor(30))
+        self.assertEqual(0, lag('test_idle'))
+        self.assertAlmostEqual(30, lag('test_busy'), delta=5)
+
+    def test_failed_cycle_keeps_lag(self) -> None:
+        with checkpoint_cycle():
+            observe_checkpoint('test_failed', cursor(60))
+        with self.assertRaises(ConnectionError), checkpoint_cycle():
+            raise ConnectionError('cycle failed')
+        self.assertAlmostEqual(60, lag('test_failed'), delta=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Совпадение партиций фильмов в Python и в запросе выгрузки."""
+
+import inspect
+import os
+import re
+import sys
+import unittest
+import uuid
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.partitions import PartitionSet, partition_of
+from utils.postgres_extractor import FILMWORKS_STREAM_QUERY
+
+PARTITION_PREDICATE = re.compile(
+    r"\('x' \|\| lpad\(left\(fw\.id::text, (\d+)\), (\d+), '0'\)\)"
+    r"::bit\((\d+)\)::bigint\s+%% %s = ANY\(%s\)"
+)
+
+
+def sql_partition(film_id: str, count: int) -> int:
+    """
+    Вычислить условие партиции из FILMWORKS_STREAM_QUERY так,
+    как его вычисляет PostgreSQL.
+    :param film_id: ID фильма
+    :param count: число партиций
+    :return:
+    """
+    chars, width, bits = map(
+        int, PARTITION_PREDICATE.search(FILMWORKS_STREAM_QUERY).groups()
+    )
+    value = int(film_id[:chars].rjust(width, '0'), 16)
+    if value >= 2 ** (bits - 1):
+        value -= 2 ** bits
+    remainder = abs(value) % count
+    return remainder if value >= 0 else -remainder
+
+
+class PartitionOfTest(unittest.TestCase):
+    """partition_of выбирает те же фильмы, что и запрос выгрузки."""
+
+    ids = [
+        '00000000-0000-0000-0000-000000000000',
+        '7fffffff-ffff-ffff-ffff-ffffffffffff',
+        '80000000-0000-0000-0000-000000000000',
+        'ffffffff-ffff-ffff-ffff-ffffffffffff',
+        *(str(uuid.uuid5(uuid.NAMESPACE_OID, str(index)))
+          for index in range(200)),
+    ]
+
+    def test_query_has_partition_predicate(self) -> None:
+        self.assertRegex(FILMWORKS_STREAM_QUERY, PARTITION_PREDICATE)
+
+    def test_matches_sql_predicate(self) -> None:
+        for count in (2, 3, 7, 16):
+            for film_id in self.ids:
+                with self.subTest(count=count, film_id=film_id):
+                    self.assertEqual(sql_partition(film_id, count),
+                                     partition_of(film_id, count))
+
+    def test_partitions_cover_every_film_once(self) -> None:
+        count = 5
+        partitions = [PartitionSet(count, (index,))
+                      for index in range(count)]
+        for film_id in self.ids:
+            with self.subTest(film_id=film_id):
+                self.assertEqual(1, sum(partition.contains(film_id)
+                                        for partition in partitions))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Извлечение изменений при записи в базу во время цикла."""
+
+import inspect
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS
+from fakes import FakeConnection
+from utils.postgres_extractor import (DIMENSIONS_MODIFIED_QUERY,
+                                      FILM_WORK_IDS_QUERY, FILMWORKS_QUERY,
+                                      FILMWORKS_STREAM_QUERY, GENRE_IDS_QUERY,
+                                      NIL_ID, OUTBOX_POSITION_QUERY,
+                                      PERSON_IDS_QUERY, PostgresMovieExtractor,
+                                      StateKeys, clamp_cursor)
+from utils.storage import MemoryStorage, State
+
+FILM_ID = '10000000-0000-0000-0000-000000000000'
+GENRE_ID = '20000000-0000-0000-0000-000000000000'
+
+
+def after(rows: list, values: tuple) -> list:
+    """
+    Строки после курсора (modified, id), упорядоченные по нему.
+    :param rows: строки с колонками (id, modified)
+    :param values: курсор
+    :return:
+    """
+    return sorted((row for row in rows
+                   if tuple(row.values())[::-1] > tuple(values)),
+                  key=lambda row: tuple(row.values())[::-1])
+
+
+class ExtractorConnection(FakeConnection):
+    """
+    Соединение с фильмами и связями жанров. Записи из writes
+    применяются после очередного извлечения фильмов.
+    """
+
+    def __init__(self, data: dict):
+        super().__init__(data, {
+            FILM_WORK_IDS_QUERY: lambda data, values: after(
+                [{'id': id_, 'modified': modified}
+                 for id_, modified in data['films'].items()], values
+            ),
+            GENRE_IDS_QUERY: lambda data, values: after(
+                [{'film_work_id': film_id, 'modified': modified}
+                 for film_id, modified in data['genre_links']], values
+            ),
+            PERSON_IDS_QUERY: lambda data, values: [],
+            DIMENSIONS_MODIFIED_QUERY: lambda data, values: [
+                {'person': None, 'genre': None}
+            ],
+            OUTBOX_POSITION_QUERY: lambda data, values: data['outbox'][-1:],
+            FILMWORKS_STREAM_QUERY: self.stream_films,
+            FILMWORKS_QUERY: self.get_films,
+        })
+        self.fetched = []
+        self.writes = []
+
+    def stream_films(self, data: dict, values: tuple) -> list:
+        rows = [{'id': id_, 'film_work_modified': modified}
+                for id_, modified in data['films'].items()]
+        self.fetched.extend(rows)
+        return rows
+
+    def get_films(self, data: dict, values: tuple) -> list:
+        rows = [{'id': id_, 'modified': data['films'][id_]}
+                for id_ in values[0]]
+        self.fetched.extend(rows)
+        while self.writes:
+            self.writes.pop(0)(self.data)
+        return rows
+
+
+def run_cycle(extractor: PostgresMovieExtractor) -> None:
+    """
+    Выполнить цикл извлечения, фиксируя все чекпоинты.
+    :param extractor: извлекатель
+    :return:
+    """
+    for _, checkpoint in extractor.extract_all():
+        if checkpoint is not None:
+            extractor.commit(checkpoint)
+
+
+class ChangedIdsTest(unittest.TestCase):
+    """Изменение фильма между источниками не теряется."""
+
+    def test_write_between_feeds_is_extracted(self) -> None:
+        conn = ExtractorConnection({
+            'films': {FILM_ID: '2021-01-01 00:00:00+00:00'},
+            'genre_links': [(FILM_ID, '2021-01-02 00:00:00+00:00')],
+        })
+        state = State(MemoryStorage())
+        state.set_state(StateKeys.GENRE, ['2021-01-01', GENRE_ID])
+        state.set_state(StateKeys.PERSON, ['2021-01-01', GENRE_ID])
+        state.set_state(StateKeys.FILMWORK,
+                        ['2021-01-01 00:00:00+00:00', FILM_ID])
+
+        def edit_film(data: dict) -> None:
+            data['films'][FILM_ID] = '2021-01-03 00:00:00+00:00'
+
+        conn.writes.append(edit_film)
+        extractor = PostgresMovieExtractor(conn, state)
+        run_cycle(extractor)
+        run_cycle(extractor)
+        self.assertIn('2021-01-03 00:00:00+00:00',
+                      [row['modified'] for row in conn.fetched])
+
+
+class OutboxFullLoadTest(unittest.TestCase):
+    """Полная загрузка в режиме outbox фиксирует позицию журнала."""
+
+    def test_empty_outbox_state_streams_and_saves_position(self) -> None:
+        conn = ExtractorConnection({
+            'films': {FILM_ID: '2021-01-01 00:00:00+00:00'},
+            'genre_links': [],
+            'outbox': [{'txid': 42, 'seq': 7}],
+        })
+        state = State(MemoryStorage())
+        with mock.patch.object(SETTINGS, 'CHANGE_SOURCE', 'outbox'), \
+                mock.patch.object(SETTINGS, 'FULL_LOAD_STREAM', False):
+            run_cycle(PostgresMovieExtractor(conn, state))
+        self.assertEqual([FILM_ID], [row['id'] for row in conn.fetched])
+        self.assertEqual(['42', '7'], state.get_state(StateKeys.OUTBOX))
+
+
+class ClampCursorTest(unittest.TestCase):
+    """Курсор не уходит дальше момента воспроизведения реплики."""
+
+    replayed = datetime(2021, 1, 2, tzinfo=timezone.utc)
+
+    def test_cursor_before_replay_kept(self) -> None:
+        cursor = ('2021-01-01 00:00:00+00:00', FILM_ID)
+        self.assertEqual(cursor, clamp_cursor(cursor, self.replayed))
+
+    def test_cursor_at_replay_kept(self) -> None:
+        cursor = ('2021-01-02 00:00:00+00:00', FILM_ID)
+        self.assertEqual(cursor, clamp_cursor(cursor, self.replayed))
+
+    def test_cursor_after_replay_clamped(self) -> None:
+        cursor = ('2021-01-03 00:00:00+00:00', FILM_ID)
+        self.assertEqual((str(self.replayed), NIL_ID),
+                         clamp_cursor(cursor, self.replayed))
+
+    def test_naive_cursor_compared_as_utc(self) -> None:
+        cursor = ('2021-01-02 00:00:01', FILM_ID)
+        self.assertEqual((str(self.replayed), NIL_ID),
+                         clamp_cursor(cursor, self.replayed))
+
+
+if __name__ == '__main__':
+    unittest.main()
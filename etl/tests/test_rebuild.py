@@ -0,0 +1,442 @@
+"""Переименование персоны при полной перезагрузке и загрузке снимка."""
+
+import inspect
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from unittest import mock
+
+from dateutil.parser import parse
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import main
+from config import SETTINGS
+from fakes import FakeConnection
+from utils.index_rebuilder import IndexRebuilder
+from utils.postgres_extractor import (DIMENSION_NAMES_QUERY,
+                                      DIMENSIONS_MODIFIED_QUERY,
+                                      DIRECTOR_FILM_IDS_QUERY,
+                                      FILM_WORK_IDS_QUERY, FILMWORKS_QUERY,
+                                      FILMWORKS_STREAM_QUERY,
+                                      GENRE_CHANGES_QUERY,
+                                      PERSON_CHANGES_QUERY,
+                                      PERSON_FILM_IDS_QUERY, StateKeys)
+
+FILM_ID = '10000000-0000-0000-0000-000000000000'
+PERSON_ID = '30000000-0000-0000-0000-000000000000'
+
+
+def moment(day: int) -> datetime:
+    """
+    Дата изменения строки.
+    :param day: день января 2021 года
+    :return:
+    """
+    return datetime(2021, 1, day, tzinfo=timezone.utc)
+
+
+class Row(dict):
+    """Строка результата, доступная по названию и номеру колонки."""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+def after(rows: list, cursor: tuple) -> list:
+    """
+    Строки после курсора (modified, id), упорядоченные по нему.
+    :param rows: строки с колонками id и modified
+    :param cursor: курсор
+    :return:
+    """
+    position = (parse(cursor[0]), cursor[1])
+    return sorted(
+        (row for row in rows if (row['modified'], row['id']) > position),
+        key=lambda row: (row['modified'], row['id']),
+    )
+
+
+def film_row(data: dict, film_id: str) -> Row:
+    """
+    Строка фильма с его актером.
+    :param data: данные базы
+    :param film_id: ID фильма
+    :return:
+    """
+    film = data['films'][film_id]
+    person = data['persons'][film['person']]
+    return Row(
+        id=film_id, title=film['title'], description=None, rating=None,
+        type='movie', created=film['modified'],
+        film_work_modified=film['modified'],
+        modified=max(film['modified'], person['modified']),
+        persons=[{'role': 'actor', 'id': film['person'],
+                  'name': person['name']}],
+        genres=[], genre_objs=[],
+    )
+
+
+class RebuildConnection(FakeConnection):
+    """
+    Соединение с фильмами и персонами. Вызовы advisory-блокировок
+    записываются в events, on_stream вызывается при выгрузке фильмов.
+    """
+
+    def __init__(self, data: dict):
+        super().__init__(data, {
+            DIMENSIONS_MODIFIED_QUERY: lambda data, values: [
+                Row(person=max(person['modified']
+                               for person in data['persons'].values()),
+                    genre=None)
+            ],
+            DIMENSION_NAMES_QUERY: lambda data, values: [
+                ('person', id_, person['name'])
+                for id_, person in data['persons'].items()
+            ],
+            FILMWORKS_STREAM_QUERY: self.stream_films,
+            FILMWORKS_QUERY: lambda data, values: [
+                film_row(data, id_) for id_ in values[0]
+            ],
+            FILM_WORK_IDS_QUERY: lambda data, values: after(
+                [Row(id=id_, modified=film['modified'])
+                 for id_, film in data['films'].items()], values
+            ),
+            PERSON_CHANGES_QUERY: lambda data, values: after(
+                [Row(id=id_, modified=person['modified'],
+                     name=person['name'])
+                 for id_, person in data['persons'].items()], values
+            ),
+            GENRE_CHANGES_QUERY: lambda data, values: [],
+            PERSON_FILM_IDS_QUERY: lambda data, values: [
+                Row(film_work_id=id_) for id_, film in data['films'].items()
+                if film['person'] in values[0]
+            ],
+            DIRECTOR_FILM_IDS_QUERY: lambda data, values: [],
+        })
+        self.on_stream = lambda: None
+        self.events = []
+
+    def stream_films(self, data: dict, values: tuple) -> list:
+        rows = [film_row(data, id_) for id_ in data['films']]
+        self.on_stream()
+        return rows
+
+    def handle(self, query: str, values: tuple) -> list:
+        if 'advisory' in query:
+            self.events.append(query.split()[1].split('(')[0])
+            return []
+        return super().handle(query, values)
+
+
+class FakePostgres:
+    """Замена PostgresConnection с одним соединением."""
+
+    def __init__(self, data: dict):
+        self.conn = RebuildConnection(data)
+
+    @contextmanager
+    def session(self):
+        try:
+            yield self.conn
+        finally:
+            self.conn.rollback()
+
+
+class FakeIndices:
+    """Операции с индексами FakeElastic."""
+
+    def __init__(self, es: 'FakeElastic'):
+        self.es = es
+
+    def exists(self, index: str) -> bool:
+        return index in self.es.documents or index in self.es.aliases
+
+    def create(self, index: str, body: dict) -> None:
+        self.es.documents[index] = {}
+        self.es.uuids[index] = f'uuid-{len(self.es.uuids)}'
+
+    def get_settings(self, index: str, name: str) -> dict:
+        index = self.es.resolve(index)
+        return {index: {'settings': {'index': {'uuid': self.es.uuids[index]}}}}
+
+    def exists_alias(self, name: str) -> bool:
+        return name in self.es.aliases
+
+    def get_alias(self, name: str) -> dict:
+        return {self.es.aliases[name]: {'aliases': {name: {}}}}
+
+    def update_aliases(self, actions: list) -> None:
+        self.es.events.append('update_aliases')
+        for action in actions:
+            (kind, params), = action.items()
+            if kind == 'remove_index':
+                del self.es.documents[params['index']]
+            elif kind == 'add':
+                self.es.aliases[params['alias']] = params['index']
+
+    def get(self, index: str) -> dict:
+        prefix = index.rstrip('*')
+        return {name: {} for name in self.es.documents
+                if name.startswith(prefix)}
+
+    def get_mapping(self, index: str) -> dict:
+        return {index: SETTINGS.ELASTIC_DSL.ES_MAPPING}
+
+    def put_mapping(self, **kwargs) -> None:
+        pass
+
+    def put_settings(self, **kwargs) -> None:
+        pass
+
+    def refresh(self, **kwargs) -> None:
+        pass
+
+    def forcemerge(self, **kwargs) -> None:
+        pass
+
+    def delete(self, index: str) -> None:
+        del self.es.documents[index]
+
+
+class FakeElastic:
+    """
+    Elasticsearch в памяти: индексы, алиасы, bulk-запросы
+    и переименование актеров через update_by_query.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.aliases = {}
+        self.uuids = {}
+        self.events = []
+        self.indices = FakeIndices(self)
+        self.transport = mock.Mock()
+        self.transport.serializers.dumps = (
+            lambda data: json.dumps(data, default=str).encode()
+        )
+
+    def resolve(self, index: str) -> str:
+        return self.aliases.get(index, index)
+
+    def options(self, **kwargs) -> 'FakeElastic':
+        return self
+
+    def bulk(self, index: str, operations: bytes) -> dict:
+        documents = self.documents[self.resolve(index)]
+        lines = operations.splitlines()
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            id_ = json.loads(action)['index']['_id']
+            documents[id_] = json.loads(source)
+            items.append({'index': {'_id': id_, 'status': 200}})
+        return {'errors': False, 'items': items}
+
+    def update_by_query(self, index: str, query: dict, script: dict,
+                        conflicts: str) -> dict:
+        params = script['params']
+        updated = 0
+        for document in self.documents[self.resolve(index)].values():
+            for actor in document['actors']:
+                if (actor['id'] == params['id']
+                        and actor['name'] == params['old_name']):
+                    actor['name'] = params['new_name']
+                    names = document['actors_names']
+                    names[names.index(params['old_name'])] = (
+                        params['new_name']
+                    )
+                    updated += 1
+        return {'updated': updated}
+
+    def actor_name(self, film_id: str) -> str:
+        """
+        Имя актера в документе фильма, доступном по алиасу.
+        :param film_id: ID фильма
+        :return:
+        """
+        document = self.documents[self.resolve('movies')][film_id]
+        return document['actors'][0]['name']
+
+
+class FakeElasticConnection:
+    """Замена ElasticConnection."""
+
+    def __init__(self):
+        self.client = FakeElastic()
+
+    @contextmanager
+    def session(self):
+        yield self.client
+
+
+class IndexVersionsTest(unittest.TestCase):
+    """Версии индекса, созданные в одну секунду, не совпадают."""
+
+    def test_versions_created_at_once_differ(self) -> None:
+        es = FakeElastic()
+        rebuilder = IndexRebuilder(es, 'movies')
+        with mock.patch('utils.index_rebuilder.datetime') as clock:
+            clock.utcnow.return_value = datetime(2021, 1, 1)
+            first = rebuilder.create_version()
+            second = rebuilder.create_version()
+        self.assertNotEqual(first, second)
+        self.assertEqual({first, second}, set(es.documents))
+
+    def test_prune_keeps_newest_versions(self) -> None:
+        es = FakeElastic()
+        rebuilder = IndexRebuilder(es, 'movies', keep_versions=2)
+        legacy = 'movies_20201231000000'
+        es.indices.create(index=legacy, body={})
+        es.indices.create(index='movies_backup', body={})
+        versions = []
+        for day in (1, 2, 3):
+            with mock.patch('utils.index_rebuilder.datetime') as clock:
+                clock.utcnow.return_value = datetime(2021, 1, day)
+                versions.append(rebuilder.create_version())
+        rebuilder.prune(versions[-1])
+        self.assertEqual({'movies_backup', *versions[1:]}, set(es.documents))
+
+
+class EtlTestCase(unittest.TestCase):
+    """Процессы ETL над базой и Elasticsearch в памяти."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for name, value in (
+                ('STATE_BACKEND', 'json'),
+                ('STATE_FILE', os.path.join(self.directory, 'state.json')),
+                ('DIMENSION_CACHE_FILE',
+                 os.path.join(self.directory, 'dimensions.db')),
+                ('DEAD_LETTER_FILE',
+                 os.path.join(self.directory, 'dead_letter.ndjson')),
+                ('PARTIAL_UPDATES', True),
+                ('HASH_CACHE_SIZE', 0),
+                ('CHANGE_SOURCE', 'modified'),
+                ('FULL_LOAD_STREAM', True)):
+            patcher = mock.patch.object(SETTINGS, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.data = {
+            'films': {FILM_ID: {'title': 'Star Wars', 'modified': moment(1),
+                                'person': PERSON_ID}},
+            'persons': {PERSON_ID: {'name': 'Mark Hamill',
+                                    'modified': moment(1)}},
+        }
+        self.pg = FakePostgres(self.data)
+        self.es = FakeElasticConnection()
+
+    def rename(self, name: str, day: int) -> None:
+        """
+        Переименовать персону в базе.
+        :param name: новое имя
+        :param day: день изменения
+        :return:
+        """
+        self.data['persons'][PERSON_ID] = {'name': name,
+                                           'modified': moment(day)}
+
+    def etl(self) -> None:
+        """
+        Выполнить цикл ETL отдельным процессом со своим соединением.
+        :return:
+        """
+        main.etl(FakePostgres(self.data), self.es)
+
+
+class RenameAfterRebuildTest(EtlTestCase):
+    """
+    Переименование персоны, примененное к прежней версии индекса,
+    попадает и в новую версию, загруженную из более раннего снимка.
+    """
+
+    def test_rename_during_rebuild(self) -> None:
+        self.etl()
+
+        def rename_in_live_index() -> None:
+            self.rename('Luke Skywalker', 2)
+            self.etl()
+            self.assertEqual('Luke Skywalker',
+                             self.es.client.actor_name(FILM_ID))
+
+        self.pg.conn.on_stream = rename_in_live_index
+        main.rebuild(self.pg, self.es)
+        self.assertEqual('Mark Hamill', self.es.client.actor_name(FILM_ID))
+        self.etl()
+        self.assertEqual('Luke Skywalker', self.es.client.actor_name(FILM_ID))
+
+    def test_rename_before_restore(self) -> None:
+        self.etl()
+        snapshot_dir = os.path.join(self.directory, 'snapshot')
+        main.snapshot(self.pg, snapshot_dir)
+        self.rename('Luke Skywalker', 2)
+        self.etl()
+        main.restore(self.pg, self.es, snapshot_dir)
+        self.assertEqual('Mark Hamill', self.es.client.actor_name(FILM_ID))
+        self.etl()
+        self.assertEqual('Luke Skywalker', self.es.client.actor_name(FILM_ID))
+
+
+class DimensionStateKeysTest(EtlTestCase):
+    """
+    Позиции персон по самим персонам и по связям с фильмами хранятся
+    под разными ключами.
+    """
+
+    def state(self) -> dict:
+        """
+        Сохраненное состояние загрузки.
+        :return:
+        """
+        with open(SETTINGS.STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_enable_partial_updates(self) -> None:
+        with mock.patch.object(SETTINGS, 'PARTIAL_UPDATES', False):
+            self.etl()
+        link_position = self.state()[StateKeys.PERSON]
+        self.assertNotIn(StateKeys.PERSON_DIMENSION, self.state())
+        self.rename('Luke Skywalker', 2)
+        self.etl()
+        self.assertEqual('Luke Skywalker', self.es.client.actor_name(FILM_ID))
+        state = self.state()
+        self.assertEqual(link_position, state[StateKeys.PERSON])
+        self.assertEqual([str(moment(2)), PERSON_ID],
+                         state[StateKeys.PERSON_DIMENSION])
+
+
+class HandoffLockTest(EtlTestCase):
+    """Переключение алиаса и запись позиций идут под блокировкой."""
+
+    def test_rebuild_swaps_under_exclusive_lock(self) -> None:
+        self.etl()
+        events = self.es.client.events = self.pg.conn.events
+        save_cursors = main.save_cursors
+        with mock.patch.object(
+                main, 'save_cursors',
+                side_effect=lambda cursors: (events.append('save_cursors'),
+                                             save_cursors(cursors))):
+            main.rebuild(self.pg, self.es)
+        self.assertEqual(['pg_advisory_lock', 'update_aliases',
+                          'save_cursors', 'pg_advisory_unlock'], events)
+
+    def test_cycle_holds_shared_lock(self) -> None:
+        pg = FakePostgres(self.data)
+        main.etl(pg, self.es)
+        self.assertEqual(['pg_advisory_lock_shared',
+                          'pg_advisory_unlock_shared'], pg.conn.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Сравнение ключей базы и индекса при сверке."""
+
+import inspect
+import os
+import sys
+import unittest
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.reconciler import Drift, diff_keys
+
+
+def diff(source: list, target: list) -> list:
+    """
+    Расхождения между списками ключей.
+    :param source: пары (id, версия) базы
+    :param target: пары (id, версия) индекса
+    :return:
+    """
+    return list(diff_keys(iter(source), iter(target)))
+
+
+class DiffKeysTest(unittest.TestCase):
+    """diff_keys находит каждое расхождение ровно один раз."""
+
+    def test_equal_streams(self) -> None:
+        keys = [('a', 1), ('b', 2)]
+        self.assertEqual([], diff(keys, keys))
+
+    def test_empty_streams(self) -> None:
+        self.assertEqual([], diff([], []))
+        self.assertEqual([(Drift.MISSING, 'a')], diff([('a', 1)], []))
+        self.assertEqual([(Drift.ORPHANED, 'a')], diff([], [('a', 1)]))
+
+    def test_every_kind_of_drift(self) -> None:
+        source = [('a', 1), ('b', 2), ('d', 4), ('f', 6)]
+        target = [('b', 2), ('c', 3), ('d', 5), ('e', 5)]
+        self.assertEqual(
+            [(Drift.MISSING, 'a'), (Drift.ORPHANED, 'c'),
+             (Drift.STALE, 'd'), (Drift.ORPHANED, 'e'),
+             (Drift.MISSING, 'f')],
+            diff(source, target),
+        )
+
+    def test_document_without_version_is_stale(self) -> None:
+        self.assertEqual([(Drift.STALE, 'a')],
+                         diff([('a', 1)], [('a', None)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Загрузка снимка телами bulk-запросов ограниченного размера."""
+
+import inspect
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.snapshot import SnapshotLoader, SnapshotWriter, read_manifest
+
+
+class SnapshotLoaderTest(unittest.TestCase):
+    """Файл снимка отправляется частями, поврежденный - не отправляется."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        writer = SnapshotWriter(self.directory)
+        for index in range(10):
+            writer.add_in_batch({'id': f'film{index}', 'title': 'x' * 100})
+        writer.flush()
+        self.client = mock.Mock()
+        self.client.indices.exists.return_value = False
+        self.client.bulk.return_value = {'errors': False, 'items': []}
+        self.loader = SnapshotLoader(
+            self.client, 'movies', batch_bytes=500,
+            dead_letter_file=os.path.join(self.directory, 'dead.ndjson'),
+        )
+
+    def test_chunk_sent_in_bounded_bodies(self) -> None:
+        self.assertEqual(10, self.loader.restore(self.directory))
+        bodies = [call.kwargs['operations']
+                  for call in self.client.bulk.call_args_list]
+        self.assertGreater(len(bodies), 1)
+        lines = b''.join(bodies).splitlines()
+        self.assertEqual([f'film{index}' for index in range(10)],
+                         [json.loads(line)['index']['_id']
+                          for line in lines[::2]])
+        for body in bodies:
+            self.assertLess(len(body), 500 + max(map(len, lines)) * 2 + 2)
+
+    def test_corrupted_chunk_not_sent(self) -> None:
+        chunk = read_manifest(self.directory)['chunks'][0]
+        with open(os.path.join(self.directory, chunk['file']), 'ab') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            self.loader.restore(self.directory)
+        self.client.bulk.assert_not_called()
+
+    def test_only_retryable_items_resent(self) -> None:
+        self.loader = SnapshotLoader(
+            self.client, 'movies', batch_bytes=10 ** 6,
+            dead_letter_file=os.path.join(self.directory, 'dead.ndjson'),
+        )
+        self.client.transport.serializers.dumps.side_effect = (
+            lambda data: json.dumps(data).encode()
+        )
+        items = [{'index': {'_id': f'film{index}', 'status': 201}}
+                 for index in range(10)]
+        items[1] = {'index': {'_id': 'film1', 'status': 429,
+                              'error': {'type': 'es_rejected_execution'}}}
+        items[2] = {'index': {'_id': 'film2', 'status': 400,
+                              'error': {'type': 'mapper_parsing_exception'}}}
+        self.client.bulk.side_effect = [
+            {'errors': True, 'items': items},
+            {'errors': False,
+             'items': [{'index': {'_id': 'film1', 'status': 201}}]},
+        ]
+        with mock.patch('time.sleep'):
+            self.loader.restore(self.directory)
+        resent = self.client.bulk.call_args_list[1].kwargs['operations']
+        self.assertEqual(['film1'],
+                         [json.loads(line)['index']['_id']
+                          for line in resent.splitlines()[::2]])
+        with open(os.path.join(self.directory, 'dead.ndjson')) as f:
+            self.assertEqual(['film2'], [json.loads(line)['id']
+                                         for line in f])
+
+
+if __name__ == '__main__':
+    unittest.main()
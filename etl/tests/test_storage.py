@@ -0,0 +1,116 @@
+"""Сохранение состояния в файлах и восстановление после сбоя записи."""
+
+import inspect
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.storage import JsonFileStorage, SQLiteStorage
+
+STATE = {'filmwork': ['2021-01-01 00:00:00+00:00', 'id'], 'count': 1}
+
+
+class StorageTestCase(unittest.TestCase):
+    """Временный каталог для файлов хранилища."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+
+class JsonFileStorageTest(StorageTestCase):
+    """Файл состояния перезаписывается атомарно."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.file_path = os.path.join(self.directory, 'state.json')
+
+    def test_round_trip(self) -> None:
+        JsonFileStorage(self.file_path).save_state(STATE)
+        self.assertEqual(STATE,
+                         JsonFileStorage(self.file_path).retrieve_state())
+
+    def test_missing_file_is_empty_state(self) -> None:
+        self.assertEqual({}, JsonFileStorage(self.file_path).retrieve_state())
+
+    def test_file_and_directory_synced(self) -> None:
+        events = []
+        with mock.patch('os.fsync',
+                        side_effect=lambda fd: events.append('fsync')), \
+                mock.patch('os.replace',
+                           side_effect=lambda *args: events.append('replace')):
+            JsonFileStorage(self.file_path).save_state(STATE)
+        self.assertEqual(['fsync', 'replace', 'fsync'], events)
+
+    def test_interrupted_write_keeps_previous_state(self) -> None:
+        storage = JsonFileStorage(self.file_path)
+        storage.save_state(STATE)
+
+        def crash(obj: dict, fp, **kwargs) -> None:
+            fp.write('{"filmwork":')
+            raise KeyboardInterrupt
+
+        with mock.patch('json.dump', side_effect=crash), \
+                self.assertRaises(KeyboardInterrupt):
+            storage.save_state({'filmwork': None})
+        self.assertEqual(STATE,
+                         JsonFileStorage(self.file_path).retrieve_state())
+        self.assertEqual(['state.json'], os.listdir(self.directory))
+
+
+class SQLiteStorageTest(StorageTestCase):
+    """Ключи сохраняются отдельными строками в одной транзакции."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.file_path = os.path.join(self.directory, 'state.db')
+
+    def open(self) -> SQLiteStorage:
+        """
+        Открыть хранилище, закрываемое после теста.
+        :return:
+        """
+        storage = SQLiteStorage(self.file_path)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_round_trip(self) -> None:
+        self.open().save_state(STATE)
+        self.assertEqual(STATE, self.open().retrieve_state())
+
+    def test_keys_of_other_writer_kept(self) -> None:
+        first, second = self.open(), self.open()
+        first.save_state({'first': 1})
+        second.save_state({'second': 2})
+        first.save_state({'first': 3})
+        self.assertEqual({'first': 3, 'second': 2},
+                         self.open().retrieve_state())
+
+    def test_interrupted_write_keeps_previous_state(self) -> None:
+        storage = self.open()
+        storage.save_state(STATE)
+        storage.conn.execute("""
+            CREATE TRIGGER fail BEFORE INSERT ON state
+            WHEN NEW.key = 'fail'
+            BEGIN SELECT RAISE(ABORT, 'interrupted'); END
+        """)
+        with self.assertRaises(sqlite3.DatabaseError):
+            storage.save_state({**STATE, 'count': 2, 'fail': True})
+        self.assertEqual(STATE, self.open().retrieve_state())
+        storage.conn.execute('DROP TRIGGER fail')
+        storage.save_state({**STATE, 'count': 2})
+        self.assertEqual(2, self.open().retrieve_state()['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
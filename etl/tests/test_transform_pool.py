@@ -0,0 +1,93 @@
+"""Порядок документов пула преобразования при любом порядке задач."""
+
+import inspect
+import os
+import random
+import sys
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.transform_pool import TransformPool
+
+
+class Document:
+    """Представление фильма, возвращающее номер строки."""
+
+    def __init__(self, id: int):
+        self.id = id
+
+    def as_document(self) -> dict:
+        return {'id': self.id}
+
+
+class ShuffledFuture(Future):
+    """Задача, ожидание которой завершает все задачи исполнителя."""
+
+    def __init__(self, executor: 'ShuffledExecutor'):
+        super().__init__()
+        self.executor = executor
+
+    def result(self, timeout: float = None):
+        self.executor.complete()
+        return super().result(timeout)
+
+
+class ShuffledExecutor:
+    """Исполнитель, завершающий отправленные задачи в случайном порядке."""
+
+    def __init__(self, *args, **kwargs):
+        self.random = random.Random(7)
+        self.pending = []
+        self.submitted = []
+        self.completed = []
+
+    def submit(self, fn, *args) -> Future:
+        future = ShuffledFuture(self)
+        self.pending.append((future, fn, args))
+        self.submitted.append(future)
+        return future
+
+    def complete(self) -> None:
+        self.random.shuffle(self.pending)
+        for future, fn, args in self.pending:
+            future.set_result(fn(*args))
+            self.completed.append(future)
+        self.pending = []
+
+    def shutdown(self, **kwargs) -> None:
+        pass
+
+
+class ImapTest(unittest.TestCase):
+    """Документы и чекпоинты выдаются в порядке батчей."""
+
+    def test_shuffled_completion_keeps_order(self) -> None:
+        with mock.patch('utils.transform_pool.ProcessPoolExecutor',
+                        ShuffledExecutor):
+            pool = TransformPool(workers=3, chunk_size=4)
+        batches = [([{'id': index * 3 + row} for row in range(3)], index + 1)
+                   for index in range(10)]
+        documents, covered = [], []
+        for chunk, checkpoints in pool.imap(Document, batches):
+            before = len(documents)
+            documents.extend(document['id'] for document in chunk)
+            for checkpoint in checkpoints:
+                self.assertIn(checkpoint * 3,
+                              range(before + 1, len(documents) + 1))
+            covered.extend(checkpoints)
+        pool.close()
+        executor = pool._executor
+        self.assertNotEqual(executor.submitted, executor.completed)
+        self.assertEqual(list(range(30)), documents)
+        self.assertEqual(list(range(1, 11)), covered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Эквивалентность FilmworkRecord и Filmwork."""
+
+import inspect
+import os
+import sys
+import unittest
+import uuid
+from datetime import datetime, timezone
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from utils.transformer import ROLE_TO_FIELDS, Filmwork, FilmworkRecord
+
+
+def person(role: str, name: str) -> dict:
+    """
+    Персона фильма в формате строки FILMWORKS_QUERY.
+    :param role: роль
+    :param name: имя
+    :return:
+    """
+    return {'role': role, 'id': str(uuid.uuid4()), 'name': name}
+
+
+def film_row(persons: list, genres: list, **fields) -> dict:
+    """
+    Строка фильма с полями, которые принимает Filmwork.
+    :param persons: персоны
+    :param genres: названия жанров
+    :return:
+    """
+    row = {
+        'id': str(uuid.uuid4()),
+        'title': 'Star Wars',
+        'description': 'A long time ago...',
+        'rating': 8.6,
+        'type': 'movie',
+        'created': datetime(2021, 6, 16, tzinfo=timezone.utc),
+        'modified': datetime(2021, 6, 17, tzinfo=timezone.utc),
+        'persons': persons,
+        'genres': genres,
+    }
+    row.update(fields)
+    return row
+
+
+class FilmworkRecordTest(unittest.TestCase):
+    """FilmworkRecord строит те же документы, что и Filmwork."""
+
+    rows = {
+        'no persons and genres': film_row([], []),
+        'null genre from COALESCE': film_row([], [None]),
+        'no rating and description': film_row(
+            [], ['Drama'], rating=None, description=None
+        ),
+        'every role': film_row(
+            [person(role, f'{role} name') for role in ROLE_TO_FIELDS],
+            ['Action', 'Sci-Fi'],
+        ),
+        'several persons per role': film_row(
+            [person('actor', 'Mark Hamill'),
+             person('actor', 'Harrison Ford'),
+             person('writer', 'George Lucas'),
+             person('director', 'George Lucas'),
+             person('director', 'Irvin Kershner')],
+            ['Adventure'],
+        ),
+        'only directors': film_row(
+            [person('director', 'Denis Villeneuve')], ['Sci-Fi']
+        ),
+    }
+
+    def assert_equivalent(self, row: dict) -> None:
+        expected = Filmwork(**row).as_document()
+        actual = FilmworkRecord(**row).as_document()
+        self.assertEqual(actual, expected)
+        self.assertEqual(list(actual), list(expected))
+
+    def test_equivalent_documents(self) -> None:
+        for name, row in self.rows.items():
+            with self.subTest(name):
+                self.assert_equivalent(row)
+
+    def test_genre_filled_from_genres(self) -> None:
+        row = self.rows['every role']
+        document = FilmworkRecord(**row).as_document()
+        self.assertEqual(document['genre'], ['Action', 'Sci-Fi'])
+
+    def test_null_genre_dropped(self) -> None:
+        row = self.rows['null genre from COALESCE']
+        for dataklass in (Filmwork, FilmworkRecord):
+            with self.subTest(dataklass.__name__):
+                document = dataklass(**row).as_document()
+                self.assertEqual(document['genre'], [])
+
+    def test_extra_columns_ignored(self) -> None:
+        row = self.rows['every role']
+        genre_objs = [{'id': str(uuid.uuid4()), 'name': 'Action'}]
+        document = FilmworkRecord(
+            **row, genre_objs=genre_objs
+        ).as_document()
+        self.assertEqual(document, Filmwork(**row).as_document())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import inspect
+import itertools
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import (BadRequestError, ConnectionError,
+                                      ConnectionTimeout)
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import logging
+from utils.elastic_loader import ElasticLoader, es_client_options
+
+
+@asynccontextmanager
+async def async_es_create_connection(**kwargs):
+    es = AsyncElasticsearch(
+        hosts=f"http://{kwargs['host']}:{kwargs['port']}/",
+        **es_client_options()
+    )
+    yield es
+    await es.close()
+
+
+class AsyncElasticLoader(ElasticLoader):
+    """Асинхронный загрузчик фильмов в индекс Elasticsearch."""
+
+    def _create_index(self) -> None:
+        """
+        Индекс создается асинхронно в create_index.
+        :return:
+        """
+
+    def _bind_hash_cache(self) -> None:
+        """
+        Кэш хешей привязывается асинхронно в create_index.
+        :return:
+        """
+
+    async def create_index(self) -> None:
+        """
+        Метод создания индекса.
+        :return:
+        """
+        if not await self.es_client.indices.exists(index=self.index):
+            logging.info(f"Create index - {self.index}.")
+            await self.es_client.indices.create(
+                index=self.index, body=self.mapping
+            )
+        else:
+            logging.info(f"Index {self.index} is already created.")
+            missing = self._missing_properties(
+                await self.es_client.indices.get_mapping(index=self.index)
+            )
+            if missing:
+                try:
+                    await self.es_client.indices.put_mapping(
+                        index=self.index, properties=missing
+                    )
+                except BadRequestError as error:
+                    self._log_incompatible_mapping(missing, error)
+        if self.hash_cache is not None:
+            settings = await self.es_client.indices.get_settings(
+                index=self.index, name='index.uuid'
+            )
+            self.hash_cache.bind(self._parse_index_uuid(settings))
+
+    async def _bulk(self,
+                    documents: list[dict],
+                    sources: Optional[list[bytes]] = None) -> set[str]:
+        """
+        Отправить документы в Elasticsearch bulk-запросом, повторяя
+        только отклоненные документы или запрос целиком при ошибке
+        соединения.
+        :param documents: документы
+        :param sources: документы, уже сериализованные в add_in_batch
+        :return: ID документов, записанных в dead-letter файл
+        """
+        failed_ids = set()
+        pending = self._pending(documents, sources)
+        for attempt in itertools.count():
+            started = time.perf_counter()
+            try:
+                response = await self.es_client.bulk(
+                    index=self.index, operations=self._bulk_body(pending)
+                )
+            except (ConnectionError, ConnectionTimeout) as error:
+                self._observe_bulk(time.perf_counter() - started,
+                                   len(pending), rejected=True)
+                await asyncio.sleep(self._retry_request(error, attempt))
+                continue
+            seconds, size = time.perf_counter() - started, len(pending)
+            documents, failed = self._handle_results(
+                [document for document, _ in pending],
+                self._bulk_results(response), attempt
+            )
+            self._observe_bulk(seconds, size, rejected=bool(documents))
+            failed_ids |= failed
+            if not documents:
+                return failed_ids
+            pending = self._retried(pending, documents)
+            await asyncio.sleep(self._retry_delay(attempt))
+
+    async def save(self) -> None:
+        """
+        Сохранить все объекты из буфера в ElasticSearch и зафиксировать
+        накопленные чекпоинты.
+        :return:
+        """
+        documents, sources, hashes, checkpoints = self._take_batch()
+        failed_ids = (await self._bulk(documents, sources)
+                      if documents else set())
+        self._commit(checkpoints, hashes, failed_ids)
+
+    async def flush(self) -> None:
+        """
+        Сохранить буфер.
+        :return:
+        """
+        await self.save()
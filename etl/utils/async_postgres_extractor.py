@@ -0,0 +1,156 @@
+import inspect
+import json
+import os
+import re
+import sys
+from typing import AsyncGenerator, Optional
+
+import asyncpg
+from dateutil.parser import parse
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS
+from utils.postgres_extractor import (FILM_WORK_IDS_QUERY, FILMWORKS_QUERY,
+                                      GENRE_IDS_QUERY, PERSON_IDS_QUERY,
+                                      ChangeSet, Checkpoint,
+                                      PostgresMovieExtractor, StateKeys,
+                                      to_cursor)
+from utils.metrics import ROWS, STAGE_SECONDS, observe_checkpoint
+from utils.storage import State
+from utils.transformer import FilmworkRecord
+
+
+def to_asyncpg_query(query: str) -> str:
+    """
+    Заменить параметры запроса psycopg2 (%s) на параметры asyncpg ($n).
+    :param query: запрос в формате psycopg2
+    :return:
+    """
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub('%s', lambda _: f'${next(counter)}', query)
+
+
+async def init_connection(conn: asyncpg.Connection) -> None:
+    """
+    Настроить соединение так, чтобы строки совпадали со строками psycopg2:
+    json - как python-объекты, uuid - как строки.
+    :param conn: соединение
+    :return:
+    """
+    await conn.set_type_codec(
+        'json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog'
+    )
+    await conn.set_type_codec(
+        'uuid', encoder=str, decoder=str, schema='pg_catalog', format='text'
+    )
+
+
+class AsyncPostgresMovieExtractor:
+    """Асинхронный аналог PostgresMovieExtractor на базе asyncpg."""
+
+    def __init__(self, conn: asyncpg.Connection, state: State):
+        """
+        Инициализация параметров класса.
+        :param conn: соединение с базой
+        :param state: объект-хранилище
+        """
+        self.conn = conn
+        self.state = state
+        self.dataklass = FilmworkRecord
+
+    async def _execute_raw(
+            self,
+            query: str,
+            values: tuple,
+            batch_size: int = SETTINGS.BATCH_SIZE
+    ) -> AsyncGenerator[list, None]:
+        """
+        Метод для получения данных из базы по запросу.
+        :param query: запрос в формате psycopg2
+        :param values: параметры для запроса
+        :param batch_size: размер батча
+        :return:
+        """
+        async with self.conn.transaction(readonly=True):
+            cur = await self.conn.cursor(to_asyncpg_query(query), *values)
+            while rows := await cur.fetch(batch_size):
+                yield rows
+
+    async def _ids_since(
+            self,
+            query: str,
+            cursor: tuple[str, str]
+    ) -> AsyncGenerator[tuple[tuple[str], tuple[str, str]], None]:
+        """
+        Получить ID фильмов по запросу с курсором (modified, id).
+        :param query: запрос, возвращающий пары (id, modified)
+        :param cursor: курсор, после которого начинается выборка
+        :return:
+        """
+        modified, id_ = cursor
+        async for batch in self._execute_raw(query, (parse(modified), id_)):
+            yield PostgresMovieExtractor._split_batch(batch)
+
+    async def get_filmworks(self, ids: tuple[str]) -> list:
+        """
+        Получить фильмы с указанными ID.
+        :param ids: список id извлекаемых фильмов
+        :return:
+        """
+        with STAGE_SECONDS.labels(stage='extract').time():
+            rows = await self.conn.fetch(
+                to_asyncpg_query(FILMWORKS_QUERY), list(ids)
+            )
+        ROWS.inc(len(rows))
+        return [dict(row) for row in rows]
+
+    async def changed_ids(
+            self,
+            batch_size: int = SETTINGS.BATCH_SIZE
+    ) -> AsyncGenerator[tuple[tuple[str], Optional[Checkpoint]], None]:
+        """
+        Объединить источники изменений в единый набор ID фильмов.
+        :param batch_size: размер батча ID
+        :return: батчи ID и чекпоинты источников
+        """
+        feeds = (
+            (StateKeys.GENRE, GENRE_IDS_QUERY),
+            (StateKeys.PERSON, PERSON_IDS_QUERY),
+            (StateKeys.FILMWORK, FILM_WORK_IDS_QUERY),
+        )
+        change_set = ChangeSet(batch_size)
+        for state_key, query in feeds:
+            cursor = to_cursor(self.state.get_state(state_key))
+            async for ids, cursor in self._ids_since(query, cursor):
+                for item in change_set.add(ids, Checkpoint(state_key, cursor)):
+                    yield item
+            for item in change_set.flush():
+                yield item
+
+    async def extract_all(
+            self
+    ) -> AsyncGenerator[tuple[list, Optional[Checkpoint]], None]:
+        """
+        Извлечь все обновленные фильмы. Источники изменений и фильмы
+        читаются из одного снимка базы, как в PostgresMovieExtractor.
+        :return: батчи строк и чекпоинты
+        """
+        async with self.conn.transaction(isolation='repeatable_read',
+                                         readonly=True):
+            async for ids, checkpoint in self.changed_ids():
+                rows = await self.get_filmworks(ids) if ids else []
+                yield rows, checkpoint
+
+    def commit(self, checkpoint: Checkpoint) -> None:
+        """
+        Зафиксировать позицию источника изменений в хранилище.
+        :param checkpoint: чекпоинт
+        :return:
+        """
+        self.state.set_state(checkpoint.key, list(checkpoint.cursor))
+        observe_checkpoint(checkpoint.key, checkpoint.cursor)
@@ -3,6 +3,8 @@ import time
 from functools import wraps
 from typing import Any, Callable
 
+from utils.metrics import RETRIES
+
 logger = logging.getLogger()
 
 
@@ -39,6 +41,7 @@ def backoff(
                     return func(*args, **kwargs)
                 except exceptions as err:
                     log.exception(err)
+                    RETRIES.labels(operation=func.__name__).inc()
                     t = t * factor
                     if t > border_sleep_time:
                         t = border_sleep_time
@@ -0,0 +1,93 @@
+"""Адаптивный размер батча по наблюдаемой задержке операций."""
+
+import inspect
+import os
+import sys
+import threading
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+from utils.metrics import BATCH_SIZE
+
+SMOOTHING = 0.5
+MAX_GROWTH = 2.0
+REJECT_FACTOR = 0.5
+LOG_CHANGE = 0.1
+
+
+class AdaptiveBatchSize:
+    """
+    Размер батча, который подстраивается под целевую задержку.
+    По времени обработки батча оценивается размер, укладывающийся
+    в целевую задержку, и текущий размер сдвигается к нему не более
+    чем вдвое за шаг. При отказе (перегрузка кластера, таймаут)
+    размер уменьшается вдвое. Размер всегда остается в границах.
+    """
+
+    def __init__(self,
+                 name: str,
+                 target_latency: float,
+                 initial: int = SETTINGS.BATCH_SIZE,
+                 minimum: int = SETTINGS.BATCH_SIZE_MIN,
+                 maximum: int = SETTINGS.BATCH_SIZE_MAX):
+        """
+        Инициализация.
+        :param name: название стадии для логов и метрик
+        :param target_latency: целевое время обработки батча в секундах
+        :param initial: начальный размер
+        :param minimum: минимальный размер
+        :param maximum: максимальный размер
+        """
+        self.name = name
+        self.target_latency = target_latency
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self._size = float(min(max(initial, self.minimum), self.maximum))
+        self._logged = self.value
+        self._lock = threading.Lock()
+        BATCH_SIZE.labels(stage=name).set(self.value)
+
+    @property
+    def value(self) -> int:
+        """
+        Текущий размер батча.
+        :return:
+        """
+        return int(self._size)
+
+    def observe(self,
+                seconds: float,
+                size: int,
+                rejected: bool = False) -> None:
+        """
+        Учесть результат обработки батча.
+        :param seconds: время обработки батча
+        :param size: размер обработанного батча
+        :param rejected: был ли батч отклонен из-за перегрузки
+        :return:
+        """
+        with self._lock:
+            if rejected:
+                desired = self._size * REJECT_FACTOR
+            elif seconds > 0 and size > 0:
+                desired = min(size * self.target_latency / seconds,
+                              self._size * MAX_GROWTH)
+                desired = self._size + (desired - self._size) * SMOOTHING
+            else:
+                return
+            self._size = min(max(desired, self.minimum), self.maximum)
+            value = self.value
+            BATCH_SIZE.labels(stage=self.name).set(value)
+            if abs(value - self._logged) < self._logged * LOG_CHANGE:
+                return
+            self._logged = value
+        logging.info(
+            f'{self.name.capitalize()} batch size set to {value} '
+            f'({size} items in {seconds:.3f}s'
+            f'{", rejected" if rejected else ""}).'
+        )
@@ -0,0 +1,297 @@
+"""Локальный кэш хешей документов, загруженных в Elasticsearch."""
+
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from typing import Generator, Iterable, Optional
+
+
+class DocumentHashCache:
+    """
+    Кэш хешей документов в SQLite-файле.
+    Позволяет не отправлять в индекс документы, которые не изменились.
+    При превышении размера вытесняются давно записанные хеши.
+    """
+
+    def __init__(self, file_path: str, max_size: int):
+        """
+        Открыть кэш.
+        :param file_path: путь до файла кэша
+        :param max_size: максимальное число хранимых хешей
+        """
+        self.file_path = file_path
+        self.max_size = max_size
+        self.conn = sqlite3.connect(file_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS document_hash (
+                id TEXT PRIMARY KEY,
+                hash BLOB NOT NULL,
+                used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS document_hash_used
+                ON document_hash (used);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._tick = self.conn.execute(
+            'SELECT COALESCE(MAX(used), 0) FROM document_hash'
+        ).fetchone()[0]
+
+    @staticmethod
+    def content_hash(content: bytes) -> bytes:
+        """
+        Вычислить хеш сериализованного содержимого документа.
+        :param content: документ, сериализованный загрузчиком
+        :return:
+        """
+        return hashlib.blake2b(content, digest_size=16).digest()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def bind(self, index_uuid: str) -> None:
+        """
+        Привязать кэш к экземпляру индекса. Если индекс был пересоздан,
+        кэш очищается и заполняется заново.
+        :param index_uuid: uuid индекса Elasticsearch
+        :return:
+        """
+        if self._get_meta('index_uuid') == index_uuid:
+            return
+        self.clear()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            ('index_uuid', index_uuid),
+        )
+        self.conn.commit()
+
+    def filter_changed(
+            self,
+            hashes: list[tuple[str, bytes]]
+    ) -> list[tuple[str, bytes]]:
+        """
+        Отобрать документы, хеш которых отличается от сохраненного.
+        :param hashes: пары (id, хеш) документов
+        :return: пары (id, хеш) измененных документов
+        """
+        cached = {}
+        ids = [id_ for id_, _ in hashes]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            cached.update(self.conn.execute(
+                f'SELECT id, hash FROM document_hash '
+                f'WHERE id IN ({placeholders})',
+                chunk,
+            ).fetchall())
+        return [(id_, hash_) for id_, hash_ in hashes
+                if cached.get(id_) != hash_]
+
+    def update(self, hashes: Iterable[tuple[str, bytes]]) -> None:
+        """
+        Сохранить хеши загруженных документов.
+        :param hashes: пары (id, хеш)
+        :return:
+        """
+        rows = []
+        for id_, hash_ in hashes:
+            self._tick += 1
+            rows.append((id_, hash_, self._tick))
+        if not rows:
+            return
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO document_hash (id, hash, used) '
+            'VALUES (?, ?, ?)',
+            rows,
+        )
+        self.conn.commit()
+
+    def discard(self, ids: Iterable[str]) -> None:
+        """
+        Удалить хеши документов, удаленных из индекса.
+        :param ids: ID документов
+        :return:
+        """
+        self.conn.executemany(
+            'DELETE FROM document_hash WHERE id = ?',
+            ((id_,) for id_ in ids),
+        )
+        self.conn.commit()
+
+    def evict(self) -> None:
+        """
+        Удалить давно записанные хеши сверх максимального размера.
+        :return:
+        """
+        self.conn.execute(
+            'DELETE FROM document_hash WHERE used <= ?',
+            (self._tick - self.max_size,),
+        )
+        self.conn.commit()
+
+    def clear(self) -> None:
+        """
+        Очистить кэш.
+        :return:
+        """
+        self.conn.execute('DELETE FROM document_hash')
+        self.conn.commit()
+
+    def close(self) -> None:
+        """
+        Вытеснить лишние хеши и закрыть файл кэша.
+        :return:
+        """
+        self.evict()
+        self.conn.close()
+
+
+class DimensionCache:
+    """
+    Кэш имен персон и жанров в SQLite-файле в том виде, в котором они
+    были загружены в индекс. Позволяет отличить переименование от
+    изменения, не затрагивающего документы фильмов.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Открыть кэш.
+        :param file_path: путь до файла кэша
+        """
+        self.file_path = file_path
+        self.conn = sqlite3.connect(file_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dimension (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT,
+                PRIMARY KEY (kind, id)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def bind(self, index_uuid: str) -> None:
+        """
+        Привязать кэш к экземпляру индекса. Если алиас переключен
+        на другую версию индекса, имена в ней могут быть старше
+        сохраненных, поэтому кэш очищается.
+        :param index_uuid: uuid индекса Elasticsearch
+        :return:
+        """
+        if self._get_meta('index_uuid') == index_uuid:
+            return
+        self.clear()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            ('index_uuid', index_uuid),
+        )
+        self.conn.commit()
+
+    def get_names(self, kind: str, ids: list[str]) -> dict[str, str]:
+        """
+        Получить сохраненные имена объектов.
+        :param kind: тип объекта - person или genre
+        :param ids: ID объектов
+        :return: имена известных кэшу объектов
+        """
+        names = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            names.update(self.conn.execute(
+                f'SELECT id, name FROM dimension '
+                f'WHERE kind = ? AND id IN ({placeholders})',
+                [kind, *chunk],
+            ).fetchall())
+        return names
+
+    def update(self, dimensions: Iterable[tuple[str, str, str]]) -> None:
+        """
+        Сохранить имена объектов.
+        :param dimensions: тройки (тип, id, имя)
+        :return:
+        """
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO dimension (kind, id, name) '
+            'VALUES (?, ?, ?)',
+            dimensions,
+        )
+        self.conn.commit()
+
+    def items(self) -> Generator[tuple[str, str, str], None, None]:
+        """
+        Все сохраненные имена.
+        :return: тройки (тип, id, имя)
+        """
+        yield from self.conn.execute('SELECT kind, id, name FROM dimension')
+
+    def clear(self) -> None:
+        """
+        Очистить кэш.
+        :return:
+        """
+        self.conn.execute('DELETE FROM dimension')
+        self.conn.commit()
+
+    def close(self) -> None:
+        """
+        Закрыть файл кэша.
+        :return:
+        """
+        self.conn.close()
+
+
+@contextmanager
+def dimension_cache_context(
+        file_path: str,
+        enabled: bool
+) -> Generator[Optional[DimensionCache], None, None]:
+    """
+    Открыть кэш имен персон и жанров.
+    :param file_path: путь до файла кэша
+    :param enabled: включены ли частичные обновления
+    :return: кэш или None, если частичные обновления отключены
+    """
+    if not enabled:
+        yield None
+        return
+    cache = DimensionCache(file_path)
+    try:
+        yield cache
+    finally:
+        cache.close()
+
+
+@contextmanager
+def hash_cache_context(
+        file_path: str,
+        max_size: int
+) -> Generator[Optional[DocumentHashCache], None, None]:
+    """
+    Открыть кэш хешей документов.
+    :param file_path: путь до файла кэша
+    :param max_size: максимальное число хешей, 0 - кэш отключен
+    :return: кэш или None, если он отключен
+    """
+    if max_size <= 0:
+        yield None
+        return
+    cache = DocumentHashCache(file_path, max_size)
+    try:
+        yield cache
+    finally:
+        cache.close()
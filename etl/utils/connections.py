@@ -0,0 +1,292 @@
+"""Долгоживущие соединения с PostgreSQL и Elasticsearch между циклами ETL."""
+
+import inspect
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Generator, NamedTuple, Optional
+
+import psycopg2
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.extras import DictCursor
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+from utils.elastic_loader import es_client_options
+from utils.metrics import REPLICA_LAG
+
+REPLICA_LAG_QUERY = """
+    WITH receiver AS (
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_stat_wal_receiver
+            WHERE COALESCE(status = 'streaming', pid IS NOT NULL)
+        ) AS receiving
+    )
+    SELECT
+        pg_is_in_recovery() AS in_recovery,
+        pg_last_xact_replay_timestamp() AS replayed,
+        receiver.receiving,
+        CASE
+            WHEN receiver.receiving
+                AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END AS lag
+    FROM receiver;
+"""
+
+
+class PostgresConnection:
+    """
+    Соединение с PostgreSQL, переиспользуемое между циклами.
+    Перед использованием соединение проверяется не чаще раза
+    в check_interval секунд и переоткрывается, если оно разорвано.
+    """
+
+    def __init__(self,
+                 dsl: dict,
+                 check_interval: float = SETTINGS.CONNECTION_CHECK_INTERVAL):
+        """
+        Инициализация.
+        :param dsl: параметры подключения
+        :param check_interval: интервал проверки соединения в секундах
+        """
+        self.dsl = dsl
+        self.check_interval = check_interval
+        self._conn = None
+        self._checked = 0.0
+
+    def _is_alive(self) -> bool:
+        """
+        Проверить соединение простым запросом.
+        :return:
+        """
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            self._conn.rollback()
+        except (OperationalError, InterfaceError):
+            return False
+        return True
+
+    def connection(self) -> psycopg2.extensions.connection:
+        """
+        Получить живое соединение, переподключившись при необходимости.
+        :return: соединение
+        """
+        now = time.monotonic()
+        if self._conn is not None and not self._conn.closed:
+            if now - self._checked < self.check_interval:
+                return self._conn
+            if self._is_alive():
+                self._checked = now
+                return self._conn
+            logging.warning('PostgreSQL connection is broken, reconnecting.')
+            self.reset()
+        logging.info('Connecting to postgresql.')
+        self._conn = psycopg2.connect(**self.dsl, cursor_factory=DictCursor)
+        self._checked = now
+        return self._conn
+
+    @contextmanager
+    def session(self) -> Generator[psycopg2.extensions.connection,
+                                   None, None]:
+        """
+        Использовать соединение в рамках одного цикла.
+        После цикла открытая транзакция откатывается, чтобы соединение
+        не простаивало в транзакции до следующего цикла. При ошибке
+        соединения оно закрывается и будет открыто заново.
+        :return: соединение
+        """
+        conn = self.connection()
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            self.reset()
+            raise
+        finally:
+            if self._conn is not None and not self._conn.closed:
+                try:
+                    self._conn.rollback()
+                except (OperationalError, InterfaceError):
+                    self.reset()
+
+    def reset(self) -> None:
+        """
+        Закрыть соединение.
+        :return:
+        """
+        if self._conn is not None and not self._conn.closed:
+            try:
+                self._conn.close()
+            except (OperationalError, InterfaceError):
+                pass
+        self._conn = None
+
+
+class ReplicaRead(NamedTuple):
+    """Соединение с репликой и момент, до которого она воспроизвела WAL."""
+
+    conn: psycopg2.extensions.connection
+    replayed: Optional[datetime]
+
+
+class ReplicaConnection(PostgresConnection):
+    """
+    Соединение с репликой для чтения. Перед каждым циклом измеряется
+    отставание реплики; если реплика недоступна, не получает WAL
+    или отстает больше max_lag секунд, цикл читает с основного сервера.
+    Реплика без WAL receiver в состоянии streaming считается отстающей:
+    совпадение полученной и воспроизведенной позиций WAL тогда
+    не означает, что реплика догнала основной сервер. Без роли
+    pg_read_all_stats состояние WAL receiver не видно, и проверяется
+    только, что процесс запущен.
+    """
+
+    def __init__(self,
+                 dsn: str,
+                 max_lag: float = SETTINGS.REPLICA_MAX_LAG,
+                 check_interval: float = SETTINGS.CONNECTION_CHECK_INTERVAL):
+        """
+        Инициализация.
+        :param dsn: строка подключения libpq; может содержать несколько
+            хостов через запятую
+        :param max_lag: допустимое отставание в секундах
+        :param check_interval: интервал проверки соединения в секундах
+        """
+        super().__init__({'dsn': dsn}, check_interval)
+        self.max_lag = max_lag
+
+    def _replay_status(self) -> Optional[tuple]:
+        """
+        Получить состояние воспроизведения WAL на реплике.
+        :return: (in_recovery, replayed, receiving, lag) или None,
+            если реплика недоступна
+        """
+        try:
+            conn = self.connection()
+            with conn.cursor() as cur:
+                cur.execute(REPLICA_LAG_QUERY)
+                status = cur.fetchone()
+            conn.rollback()
+        except (OperationalError, InterfaceError) as error:
+            logging.warning(f'Replica is unavailable: {error}')
+            self.reset()
+            return None
+        return tuple(status)
+
+    @contextmanager
+    def read_session(self) -> Generator[Optional[ReplicaRead], None, None]:
+        """
+        Использовать реплику в рамках одного цикла.
+        :return: соединение с моментом воспроизведения или None, если
+            читать нужно с основного сервера
+        """
+        status = self._replay_status()
+        if status is None:
+            yield None
+            return
+        in_recovery, replayed, receiving, lag = status
+        if not in_recovery:
+            replayed = None
+            lag = 0.0
+        elif replayed is None:
+            logging.warning('Replica has not replayed any transaction yet.')
+            yield None
+            return
+        REPLICA_LAG.set(float(lag))
+        if in_recovery and not receiving:
+            logging.warning('Replica is not receiving WAL, '
+                            'reading from primary.')
+            yield None
+            return
+        if lag > self.max_lag:
+            logging.warning(f'Replica lag {float(lag):.1f}s exceeds '
+                            f'{self.max_lag}s, reading from primary.')
+            yield None
+            return
+        with self.session() as conn:
+            yield ReplicaRead(conn, replayed)
+
+
+class ElasticConnection:
+    """
+    Клиент Elasticsearch, переиспользуемый между циклами.
+    Клиент держит пул HTTP-соединений, поэтому он пересоздается
+    только если после ошибки сервер перестал отвечать на ping.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: str,
+                 check_interval: float = SETTINGS.CONNECTION_CHECK_INTERVAL,
+                 **kwargs):
+        """
+        Инициализация.
+        :param host: адрес сервера
+        :param port: порт сервера
+        :param check_interval: интервал проверки соединения в секундах
+        """
+        self.hosts = f'http://{host}:{port}/'
+        self.check_interval = check_interval
+        self._client: Optional[Elasticsearch] = None
+        self._checked = 0.0
+
+    def _create_client(self) -> Elasticsearch:
+        """
+        Создать клиент.
+        :return:
+        """
+        return Elasticsearch(hosts=self.hosts, **es_client_options())
+
+    def client(self) -> Elasticsearch:
+        """
+        Получить клиент, проверив доступность сервера.
+        :return: клиент
+        """
+        now = time.monotonic()
+        if self._client is None:
+            self._client = self._create_client()
+        elif now - self._checked < self.check_interval:
+            return self._client
+        if not self._client.ping():
+            logging.warning('Elasticsearch is unavailable, recreating client.')
+            self.reset()
+            self._client = self._create_client()
+            if not self._client.ping():
+                raise ConnectionError('Elasticsearch is unavailable.')
+        self._checked = now
+        return self._client
+
+    @contextmanager
+    def session(self) -> Generator[Elasticsearch, None, None]:
+        """
+        Использовать клиент в рамках одного цикла. После ошибки
+        соединения клиент проверяется при следующем использовании.
+        :return: клиент
+        """
+        client = self.client()
+        try:
+            yield client
+        except (ConnectionError, ConnectionTimeout):
+            self._checked = 0.0
+            raise
+
+    def reset(self) -> None:
+        """
+        Закрыть клиент.
+        :return:
+        """
+        if self._client is not None:
+            self._client.transport.close()
+        self._client = None
@@ -0,0 +1,49 @@
+"""Файл документов, которые не удалось загрузить в Elasticsearch."""
+
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Iterable
+
+
+class DeadLetterFile:
+    """
+    NDJSON-файл отклоненных документов. Каждая строка содержит
+    документ, индекс, статус и ошибку Elasticsearch, чтобы документ
+    можно было исправить и загрузить повторно.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Инициализация.
+        :param file_path: путь до файла
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+
+    def write(self,
+              index: str,
+              failures: Iterable[tuple[dict, int, dict]]) -> int:
+        """
+        Дописать отклоненные документы в файл.
+        :param index: название индекса
+        :param failures: тройки (документ, статус, ошибка)
+        :return: число записанных документов
+        """
+        timestamp = datetime.now(timezone.utc).isoformat()
+        lines = [
+            json.dumps({
+                'timestamp': timestamp,
+                'index': index,
+                'id': str(document['id']),
+                'status': status,
+                'error': error,
+                'document': document,
+            }, default=str, ensure_ascii=False)
+            for document, status, error in failures
+        ]
+        if not lines:
+            return 0
+        with self._lock, open(self.file_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return len(lines)
@@ -1,11 +1,18 @@
 import inspect
+import itertools
 import os
+import random
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator, Optional
+from functools import partial
+from typing import Callable, Optional
 
 from elasticsearch import Elasticsearch, helpers
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import (BadRequestError, ConnectionError,
+                                      ConnectionTimeout, NotFoundError)
 
 currentdir = os.path.dirname(
     os.path.abspath(inspect.getfile(inspect.currentframe()))
@@ -14,12 +21,92 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
 from config import SETTINGS, logging
+from utils.batch_size import AdaptiveBatchSize
+from utils.cache import DocumentHashCache
+from utils.dead_letter import DeadLetterFile
+from utils.metrics import (BULK_BYTES, BULK_DOCUMENTS, DEAD_LETTERS,
+                           DOCUMENTS_SKIPPED, RETRIES, STAGE_SECONDS)
+from utils.postgres_extractor import DimensionRename
+from utils.serializers import create_serializers
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class RenameError(Exception):
+    """Переименование применено не ко всем документам."""
+
+
+PERSON_RENAME_SCRIPT = """
+    boolean changed = false;
+    for (def fields : [['actors', 'actors_names'],
+                       ['writers', 'writers_names']]) {
+        def objs = ctx._source[fields[0]];
+        def names = ctx._source[fields[1]];
+        if (objs == null) {
+            continue;
+        }
+        for (def obj : objs) {
+            if (obj.id == params.id && obj.name == params.old_name) {
+                obj.name = params.new_name;
+                changed = true;
+                if (names != null) {
+                    int i = names.indexOf(params.old_name);
+                    if (i >= 0) {
+                        names[i] = params.new_name;
+                    }
+                }
+            }
+        }
+    }
+    if (!changed) {
+        ctx.op = 'noop';
+    } else if (params.modified != '' && (ctx._source.modified == null
+            || ZonedDateTime.parse(
+                ctx._source.modified.replace(' ', 'T')).isBefore(
+                ZonedDateTime.parse(params.modified)))) {
+        ctx._source.modified = params.modified;
+    }
+"""
+
+GENRE_RENAME_SCRIPT = """
+    boolean changed = false;
+    def genres = ctx._source.genre;
+    if (genres != null) {
+        for (int i = 0; i < genres.size(); i++) {
+            if (genres[i] == params.old_name) {
+                genres[i] = params.new_name;
+                changed = true;
+            }
+        }
+    }
+    if (!changed) {
+        ctx.op = 'noop';
+    } else if (params.modified != '' && (ctx._source.modified == null
+            || ZonedDateTime.parse(
+                ctx._source.modified.replace(' ', 'T')).isBefore(
+                ZonedDateTime.parse(params.modified)))) {
+        ctx._source.modified = params.modified;
+    }
+"""
+
+
+def es_client_options() -> dict:
+    """
+    Параметры клиента Elasticsearch: сериализатор и сжатие запросов.
+    :return:
+    """
+    options = {'http_compress': SETTINGS.ELASTIC_DSL.ES_HTTP_COMPRESS}
+    serializers = create_serializers(SETTINGS.ELASTIC_DSL.ES_SERIALIZER)
+    if serializers:
+        options['serializers'] = serializers
+    return options
 
 
 @contextmanager
 def es_create_connection(**kwargs):
     es = Elasticsearch(
-        hosts=f"http://{kwargs['host']}:{kwargs['port']}/"
+        hosts=f"http://{kwargs['host']}:{kwargs['port']}/",
+        **es_client_options()
     )
     yield es
     es.transport.close()
@@ -32,21 +119,46 @@ class ElasticLoader:
                  es_client: Elasticsearch,
                  index: str,
                  mapping: dict = SETTINGS.ELASTIC_DSL.ES_MAPPING,
-                 batch_size: int = SETTINGS.BATCH_SIZE):
+                 batch_size: int = SETTINGS.BATCH_SIZE,
+                 batch_bytes: int = SETTINGS.BULK_MAX_BYTES,
+                 hash_cache: Optional[DocumentHashCache] = None,
+                 max_retries: int = SETTINGS.BULK_MAX_RETRIES,
+                 retry_backoff: float = SETTINGS.BULK_RETRY_BACKOFF,
+                 dead_letter_file: str = SETTINGS.DEAD_LETTER_FILE,
+                 batch_sizer: Optional[AdaptiveBatchSize] = None):
         """
         Инициализация загрузчика
         :param es_client: соединение с Elasticsearch сервером
         :param index: название индекса
         :param mapping: маппинг индекса
         :param batch_size: размер батча
+        :param batch_bytes: максимальный размер батча в байтах
+        :param hash_cache: кэш хешей для пропуска неизмененных документов
+        :param max_retries: число повторов отклоненных документов
+        :param retry_backoff: базовая задержка повтора в секундах
+        :param dead_letter_file: файл для документов, которые не удалось
+            загрузить
+        :param batch_sizer: адаптивный размер bulk-запроса; без него
+            используется batch_size
         """
         self.es_client = es_client
         self.index = index
         self.mapping = mapping
         self._documents = []
+        self._sources = []
+        self._hashes = []
+        self._documents_bytes = 0
+        self._checkpoints = []
         self._batch_size = batch_size
+        self.batch_sizer = batch_sizer
+        self._batch_bytes = batch_bytes
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self.hash_cache = hash_cache
+        self.dead_letter = DeadLetterFile(dead_letter_file)
 
         self._create_index()
+        self._bind_hash_cache()
 
     def _create_index(self) -> None:
         """
@@ -58,6 +170,74 @@ class ElasticLoader:
             self.es_client.indices.create(index=self.index, body=self.mapping)
             return
         logging.info(f"Index {self.index} is already created.")
+        missing = self._missing_properties(
+            self.es_client.indices.get_mapping(index=self.index)
+        )
+        if not missing:
+            return
+        try:
+            self.es_client.indices.put_mapping(index=self.index,
+                                               properties=missing)
+        except BadRequestError as error:
+            self._log_incompatible_mapping(missing, error)
+
+    def _missing_properties(self, current: dict) -> dict:
+        """
+        Поля маппинга, которых еще нет в индексе. Маппинг обновляется
+        только для них, чтобы не менять состояние кластера каждый цикл.
+        :param current: ответ на запрос маппинга индекса
+        :return: недостающие поля
+        """
+        index_mapping = next(iter(current.values()), {})
+        existing = index_mapping.get('mappings', {}).get('properties', {})
+        properties = self.mapping['mappings']['properties']
+        return {name: field for name, field in properties.items()
+                if name not in existing}
+
+    def _log_incompatible_mapping(self,
+                                  missing: dict,
+                                  error: BadRequestError) -> None:
+        """
+        Сообщить, что недостающие поля нельзя добавить в индекс.
+        Загрузка продолжается со старым маппингом.
+        :param missing: недостающие поля
+        :param error: ошибка Elasticsearch
+        :return:
+        """
+        logging.error(
+            f'Cannot add fields {sorted(missing)} to index {self.index}: '
+            f'{error}. Run "python main.py rebuild" to load the index '
+            f'with the new mapping.'
+        )
+
+    @staticmethod
+    def _parse_index_uuid(settings: dict) -> str:
+        """
+        Извлечь uuid индекса из ответа на запрос настроек.
+        :param settings: настройки индекса
+        :return:
+        """
+        index_settings = next(iter(settings.values()))
+        return index_settings['settings']['index']['uuid']
+
+    def index_uuid(self) -> str:
+        """
+        Получить uuid экземпляра индекса, на который указывает алиас.
+        :return:
+        """
+        settings = self.es_client.indices.get_settings(
+            index=self.index, name='index.uuid'
+        )
+        return self._parse_index_uuid(settings)
+
+    def _bind_hash_cache(self) -> None:
+        """
+        Привязать кэш хешей к текущему экземпляру индекса.
+        :return:
+        """
+        if self.hash_cache is None:
+            return
+        self.hash_cache.bind(self.index_uuid())
 
     def get(self, id: str) -> Optional[dict]:
         """
@@ -70,34 +250,492 @@ class ElasticLoader:
         except NotFoundError:
             return
 
+    def _dumps(self, data: dict) -> bytes:
+        """
+        Сериализовать объект сериализатором клиента.
+        :param data: объект
+        :return:
+        """
+        return self.es_client.transport.serializers.dumps(data)
+
     def add_in_batch(self, document: dict) -> None:
         """
-        Добавить документ в текущий батч.
+        Добавить документ в текущий батч. Документ сериализуется один
+        раз: эти же байты считаются в размер батча и отправляются
+        в теле bulk-запроса. При кэше хешей поле modified сериализуется
+        отдельно и дописывается в конец: хешируется содержимое без него,
+        потому что версия фильма меняется и при правке персоны или
+        жанра, не видной в документе. Такой документ не отправляется
+        заново, а его версию исправит сверка.
         :param document:
         """
+        if self.hash_cache is None or 'modified' not in document:
+            source = self._dumps(document)
+            if self.hash_cache is not None:
+                self._hashes.append(self.hash_cache.content_hash(source))
+        else:
+            content = self._dumps({key: value
+                                   for key, value in document.items()
+                                   if key != 'modified'})
+            self._hashes.append(self.hash_cache.content_hash(content))
+            version = self._dumps({'modified': document['modified']})
+            source = content[:-1] + b',' + version[1:]
         self._documents.append(document)
+        self._sources.append(source)
+        self._documents_bytes += len(source)
+
+    def add_checkpoint(self, checkpoint: Callable[[], None]) -> None:
+        """
+        Добавить фиксацию состояния, которая выполнится после сохранения
+        всех добавленных ранее документов.
+        :param checkpoint: функция фиксации состояния
+        """
+        self._checkpoints.append(checkpoint)
+
+    def add_rename(self, rename: DimensionRename) -> None:
+        """
+        Добавить переименование персоны или жанра, которое применится
+        после сохранения всех добавленных ранее документов.
+        :param rename: переименование
+        """
+        self._checkpoints.append(partial(self.rename, rename))
+
+    def _rename_request(self, rename: DimensionRename) -> tuple[dict, str]:
+        """
+        Запрос и скрипт update_by_query для переименования.
+        Режиссеры хранятся без ID и не переименовываются на месте:
+        их фильмы извлекаются заново вместе с переименованием.
+        :param rename: переименование
+        :return:
+        """
+        if rename.kind == 'person':
+            query = {'bool': {'should': [
+                {'nested': {
+                    'path': 'actors',
+                    'query': {'term': {'actors.id': rename.id}},
+                }},
+                {'nested': {
+                    'path': 'writers',
+                    'query': {'term': {'writers.id': rename.id}},
+                }},
+            ]}}
+            return query, PERSON_RENAME_SCRIPT
+        return {'term': {'genre': rename.old_name}}, GENRE_RENAME_SCRIPT
+
+    def rename(self, rename: DimensionRename) -> None:
+        """
+        Заменить имя персоны или жанра в документах фильмов на месте
+        запросом update_by_query. Перед запросом индекс обновляется,
+        чтобы только что загруженные документы были видны запросу.
+        Поле modified документа поднимается до даты изменения персоны
+        или жанра, как версия фильма в базе, чтобы сверка не считала
+        документ устаревшим.
+        Документы, пропущенные из-за конфликта версий, обрабатываются
+        повторным запросом: скрипт меняет только документы со старым
+        именем. Если после всех повторов остались конфликты или ошибки,
+        выбрасывается исключение, и чекпоинт переименования
+        не фиксируется.
+        :param rename: переименование
+        :return:
+        """
+        query, source = self._rename_request(rename)
+        updated = 0
+        for attempt in itertools.count():
+            self.es_client.indices.refresh(index=self.index)
+            response = self.es_client.options(
+                request_timeout=600
+            ).update_by_query(
+                index=self.index,
+                query=query,
+                script={
+                    'source': source,
+                    'params': {
+                        'id': rename.id,
+                        'old_name': rename.old_name,
+                        'new_name': rename.new_name,
+                        'modified': rename.modified,
+                    },
+                },
+                conflicts='proceed',
+            )
+            updated += response.get('updated', 0)
+            failures = response.get('failures') or []
+            conflicts = response.get('version_conflicts', 0)
+            if not failures and not conflicts:
+                break
+            if attempt >= self._max_retries:
+                raise RenameError(
+                    f'Rename of {rename.kind} {rename.id} left '
+                    f'{conflicts} version conflicts and '
+                    f'{len(failures)} failures: {failures[:3]}'
+                )
+            logging.warning(
+                f'Rename of {rename.kind} {rename.id} had {conflicts} '
+                f'version conflicts and {len(failures)} failures, retrying.'
+            )
+            RETRIES.labels(operation='rename').inc()
+            time.sleep(self._retry_delay(attempt))
+        logging.info(
+            f"Renamed {rename.kind} {rename.id}: "
+            f"{updated} documents updated."
+        )
+
+    @property
+    def batch_size(self) -> int:
+        """
+        Текущий размер батча документов.
+        :return:
+        """
+        if self.batch_sizer is None:
+            return self._batch_size
+        return self.batch_sizer.value
 
     def is_batch_ready(self) -> bool:
         """
         Проверить заполненность батча.
         :return:
         """
-        return len(self._documents) >= self._batch_size
+        return (len(self._documents) >= self.batch_size
+                or self._documents_bytes >= self._batch_bytes)
+
+    def delete(self, ids: list[str]) -> int:
+        """
+        Удалить документы из индекса. Уже отсутствующие документы
+        пропускаются.
+        :param ids: ID документов
+        :return: число удаленных документов
+        """
+        actions = ({'_op_type': 'delete', '_index': self.index, '_id': id_}
+                   for id_ in ids)
+        deleted = 0
+        for ok, result in helpers.streaming_bulk(
+                self.es_client, actions, raise_on_error=False):
+            if ok:
+                deleted += 1
+            elif result['delete'].get('status') != 404:
+                logging.warning(f'Failed to delete document: {result}')
+        if self.hash_cache is not None:
+            self.hash_cache.discard(ids)
+        return deleted
+
+    def _bulk_body(self, pending: list[tuple[dict, bytes]]) -> bytes:
+        """
+        Тело bulk-запроса из уже сериализованных документов.
+        :param pending: пары (документ, сериализованный документ)
+        :return:
+        """
+        lines = []
+        for document, source in pending:
+            lines.append(self._dumps({'index': {'_id': str(document['id'])}}))
+            lines.append(source)
+        return b'\n'.join(lines) + b'\n'
+
+    @staticmethod
+    def _bulk_results(response: dict) -> list[tuple[bool, dict]]:
+        """
+        Результаты bulk-запроса по документам в порядке отправки.
+        :param response: ответ Elasticsearch
+        :return: пары (успех, результат)
+        """
+        return [
+            (200 <= next(iter(item.values())).get('status', 500) < 300, item)
+            for item in response['items']
+        ]
+
+    def _pending(
+            self,
+            documents: list[dict],
+            sources: Optional[list[bytes]]
+    ) -> list[tuple[dict, bytes]]:
+        """
+        Сопоставить документы с сериализованными документами.
+        :param documents: документы
+        :param sources: сериализованные документы; если не переданы,
+            документы сериализуются здесь
+        :return:
+        """
+        if sources is None:
+            sources = [self._dumps(document) for document in documents]
+        return list(zip(documents, sources))
+
+    @staticmethod
+    def _retried(pending: list[tuple[dict, bytes]],
+                 documents: list[dict]) -> list[tuple[dict, bytes]]:
+        """
+        Оставить для повтора только отклоненные документы.
+        :param pending: отправленные пары
+        :param documents: документы для повтора
+        :return:
+        """
+        retry = {id(document) for document in documents}
+        return [item for item in pending if id(item[0]) in retry]
+
+    def _retry_delay(self, attempt: int) -> float:
+        """
+        Задержка перед повтором со случайным разбросом (full jitter),
+        чтобы повторы нескольких загрузчиков не совпадали.
+        :param attempt: номер попытки, начиная с нуля
+        :return: задержка в секундах
+        """
+        return random.uniform(0, min(self._retry_backoff * 2 ** attempt, 30))
+
+    def _handle_results(
+            self,
+            documents: list[dict],
+            results: list[tuple[bool, dict]],
+            attempt: int
+    ) -> tuple[list[dict], set[str]]:
+        """
+        Разобрать результаты bulk-запроса по документам.
+        Документы, отклоненные из-за перегрузки кластера, возвращаются
+        для повтора, остальные ошибки и исчерпавшие повторы документы
+        записываются в dead-letter файл.
+        :param documents: отправленные документы
+        :param results: результаты по документам в порядке отправки
+        :param attempt: номер попытки, начиная с нуля
+        :return: документы для повтора и ID записанных в файл документов
+        """
+        rejected, failures = [], []
+        for document, (ok, result) in zip(documents, results):
+            if ok:
+                continue
+            item = next(iter(result.values()))
+            failure = (document, item.get('status'), item.get('error'))
+            if item.get('status') in RETRY_STATUSES:
+                rejected.append(failure)
+            else:
+                failures.append(failure)
+        if rejected and attempt >= self._max_retries:
+            failures.extend(rejected)
+            rejected = []
+        count = self.dead_letter.write(self.index, failures)
+        if count:
+            DEAD_LETTERS.inc(count)
+            logging.warning(
+                f'{count} documents were rejected by {self.index} and '
+                f'written to {self.dead_letter.file_path}.'
+            )
+        if rejected:
+            RETRIES.labels(operation='bulk').inc()
+        return ([document for document, _, _ in rejected],
+                {str(document['id']) for document, _, _ in failures})
+
+    def _observe_bulk(self,
+                      seconds: float,
+                      size: int,
+                      rejected: bool) -> None:
+        """
+        Учесть время bulk-запроса и отказы при подборе размера батча.
+        :param seconds: время запроса
+        :param size: число документов в запросе
+        :param rejected: были ли документы отклонены из-за перегрузки
+            или запрос завершился ошибкой соединения
+        :return:
+        """
+        STAGE_SECONDS.labels(stage='load').observe(seconds)
+        if self.batch_sizer is not None:
+            self.batch_sizer.observe(seconds, size, rejected)
+
+    def _retry_request(self, error: Exception, attempt: int) -> float:
+        """
+        Решить, повторять ли bulk-запрос после ошибки соединения.
+        Повторяется только сам запрос, а не весь цикл ETL.
+        :param error: ошибка
+        :param attempt: номер попытки, начиная с нуля
+        :return: задержка перед повтором в секундах
+        """
+        if attempt >= self._max_retries:
+            raise error
+        logging.warning(f'Bulk request failed, retrying: {error}')
+        RETRIES.labels(operation='bulk').inc()
+        return self._retry_delay(attempt)
+
+    def _bulk(self,
+              documents: list[dict],
+              sources: Optional[list[bytes]] = None) -> set[str]:
+        """
+        Отправить документы в Elasticsearch bulk-запросом, повторяя
+        только отклоненные документы или запрос целиком при ошибке
+        соединения. Метод вызывается из нескольких потоков и не меняет
+        состояние загрузчика.
+        :param documents: документы
+        :param sources: документы, уже сериализованные в add_in_batch
+        :return: ID документов, записанных в dead-letter файл
+        """
+        failed_ids = set()
+        pending = self._pending(documents, sources)
+        for attempt in itertools.count():
+            started = time.perf_counter()
+            try:
+                response = self.es_client.bulk(
+                    index=self.index, operations=self._bulk_body(pending)
+                )
+            except (ConnectionError, ConnectionTimeout) as error:
+                self._observe_bulk(time.perf_counter() - started,
+                                   len(pending), rejected=True)
+                time.sleep(self._retry_request(error, attempt))
+                continue
+            seconds, size = time.perf_counter() - started, len(pending)
+            documents, failed = self._handle_results(
+                [document for document, _ in pending],
+                self._bulk_results(response), attempt
+            )
+            self._observe_bulk(seconds, size, rejected=bool(documents))
+            failed_ids |= failed
+            if not documents:
+                return failed_ids
+            pending = self._retried(pending, documents)
+            time.sleep(self._retry_delay(attempt))
+
+    def _commit(self,
+                checkpoints: list[Callable[[], None]],
+                hashes: list[tuple[str, bytes]],
+                failed_ids: set[str]) -> None:
+        """
+        Сохранить хеши загруженных документов и выполнить чекпоинты.
+        Хеши документов из dead-letter файла не сохраняются, чтобы они
+        были отправлены снова при следующем изменении или перезагрузке.
+        :param checkpoints: чекпоинты батча
+        :param hashes: хеши отправленных документов
+        :param failed_ids: ID документов, записанных в dead-letter файл
+        :return:
+        """
+        if hashes:
+            self.hash_cache.update(
+                (id_, hash_) for id_, hash_ in hashes
+                if id_ not in failed_ids
+            )
+        for checkpoint in checkpoints:
+            checkpoint()
+
+    def _take_batch(self) -> tuple[list[dict],
+                                   list[bytes],
+                                   list[tuple[str, bytes]],
+                                   list[Callable[[], None]]]:
+        """
+        Забрать из буфера документы и чекпоинты.
+        Документы, не изменившиеся с последней загрузки, отбрасываются.
+        :return: документы, сериализованные документы, их хеши и чекпоинты
+        """
+        documents, checkpoints = self._documents, self._checkpoints
+        sources, hashes = self._sources, self._hashes
+        self._documents, self._checkpoints = [], []
+        self._sources, self._hashes = [], []
+        self._documents_bytes = 0
+        if self.hash_cache is not None and documents:
+            hashes = self.hash_cache.filter_changed([
+                (str(document['id']), hash_)
+                for document, hash_ in zip(documents, hashes)
+            ])
+            changed_ids = {id_ for id_, _ in hashes}
+            changed = [
+                (document, source)
+                for document, source in zip(documents, sources)
+                if str(document['id']) in changed_ids
+            ]
+            DOCUMENTS_SKIPPED.inc(len(documents) - len(changed))
+            documents = [document for document, _ in changed]
+            sources = [source for _, source in changed]
+        if documents:
+            BULK_DOCUMENTS.observe(len(documents))
+            BULK_BYTES.observe(sum(map(len, sources)))
+        return documents, sources, hashes, checkpoints
 
     def save(self) -> None:
         """
-        Сохранить все объекты из буфера в ElasticSearch.
+        Сохранить все объекты из буфера в ElasticSearch и зафиксировать
+        накопленные чекпоинты.
         :return:
         """
+        documents, sources, hashes, checkpoints = self._take_batch()
+        failed_ids = self._bulk(documents, sources) if documents else set()
+        self._commit(checkpoints, hashes, failed_ids)
 
-        def get_actions(documents: list[dict]) -> Generator[dict, None, None]:
-            for document in documents:
-                action = {
-                    '_index': self.index,
-                    '_id': document['id'],
-                    '_source': document,
-                }
-                yield action
+    def flush(self) -> None:
+        """
+        Сохранить буфер и дождаться завершения всех запросов.
+        :return:
+        """
+        self.save()
 
-        helpers.bulk(self.es_client, get_actions(self._documents))
-        self._documents = []
+    def close(self) -> None:
+        """
+        Освободить ресурсы загрузчика.
+        :return:
+        """
+
+
+class ConcurrentElasticLoader(ElasticLoader):
+    """
+    Загрузчик, удерживающий несколько bulk-запросов одновременно.
+    Чекпоинты фиксируются строго в порядке добавления батчей.
+    """
+
+    def __init__(self,
+                 *args,
+                 concurrency: int = SETTINGS.BULK_CONCURRENCY,
+                 **kwargs):
+        """
+        Инициализация загрузчика
+        :param concurrency: число одновременных bulk-запросов
+        """
+        super().__init__(*args, **kwargs)
+        self._concurrency = max(concurrency, 1)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._concurrency,
+            thread_name_prefix='bulk',
+        )
+        self._in_flight = deque()
+
+    def _complete(self, limit: int) -> None:
+        """
+        Дождаться завершения старейших запросов, пока в полете их
+        больше limit, и зафиксировать чекпоинты завершенных батчей.
+        :param limit: допустимое число незавершенных запросов
+        :return:
+        """
+        while self._in_flight:
+            future, hashes, checkpoints = self._in_flight[0]
+            if (future is not None and not future.done()
+                    and len(self._in_flight) <= limit):
+                return
+            failed_ids = future.result() if future is not None else set()
+            self._in_flight.popleft()
+            self._commit(checkpoints, hashes, failed_ids)
+
+    def save(self) -> None:
+        """
+        Отправить буфер в Elasticsearch, не дожидаясь ответа,
+        если число запросов в полете меньше заданного.
+        :return:
+        """
+        documents, sources, hashes, checkpoints = self._take_batch()
+        future = None
+        if documents:
+            future = self._executor.submit(self._bulk, documents, sources)
+        self._in_flight.append((future, hashes, checkpoints))
+        try:
+            self._complete(self._concurrency - 1)
+        except Exception:
+            self.close()
+            raise
+
+    def flush(self) -> None:
+        """
+        Сохранить буфер и дождаться завершения всех запросов.
+        :return:
+        """
+        self.save()
+        try:
+            self._complete(0)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """
+        Остановить пул потоков, отменив неотправленные запросы.
+        :return:
+        """
+        self._in_flight.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
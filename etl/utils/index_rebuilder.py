@@ -0,0 +1,175 @@
+"""Полная перезагрузка индекса без простоя через версии и алиас."""
+
+import copy
+import inspect
+import os
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Generator
+
+import psycopg2
+from elasticsearch import Elasticsearch
+from psycopg2 import InterfaceError, OperationalError
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+
+
+@contextmanager
+def handoff_lock(
+        conn: psycopg2.extensions.connection,
+        exclusive: bool = False,
+        key: int = SETTINGS.HANDOFF_LOCK_KEY
+) -> Generator[None, None, None]:
+    """
+    Сессионная advisory-блокировка передачи индекса новой версии.
+    Цикл ETL держит ее в разделяемом режиме от чтения состояния
+    до записи последнего чекпоинта, а перезагрузка и загрузка снимка -
+    в исключительном на время переключения алиаса и записи позиций.
+    Иначе цикл, начатый до переключения, записал бы поверх позиций
+    новой версии свои позиции, которые прошли изменения, загруженные
+    только в прежнюю версию.
+    :param conn: соединение с PostgreSQL
+    :param exclusive: взять блокировку в исключительном режиме
+    :param key: ключ блокировки
+    :return:
+    """
+    suffix = '' if exclusive else '_shared'
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT pg_advisory_lock{suffix}(%s)', (key,))
+    conn.commit()
+    try:
+        yield
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+                with conn.cursor() as cur:
+                    cur.execute(f'SELECT pg_advisory_unlock{suffix}(%s)',
+                                (key,))
+                conn.commit()
+            except (OperationalError, InterfaceError):
+                pass
+
+
+class IndexRebuilder:
+    """
+    Управление версиями индекса за алиасом.
+    Новая версия заполняется без обновлений и реплик, после чего
+    настройки восстанавливаются и алиас атомарно переключается.
+    """
+
+    def __init__(self,
+                 es_client: Elasticsearch,
+                 alias: str,
+                 mapping: dict = SETTINGS.ELASTIC_DSL.ES_MAPPING,
+                 keep_versions: int = SETTINGS.ELASTIC_DSL.ES_KEEP_VERSIONS):
+        """
+        Инициализация.
+        :param es_client: соединение с Elasticsearch сервером
+        :param alias: алиас, под которым индекс доступен читателям
+        :param mapping: маппинг индекса
+        :param keep_versions: сколько версий индекса хранить
+        """
+        self.es_client = es_client
+        self.alias = alias
+        self.mapping = mapping
+        self.keep_versions = max(keep_versions, 1)
+
+    def create_version(self) -> str:
+        """
+        Создать новую версию индекса, настроенную для массовой загрузки.
+        Название содержит время создания с микросекундами и случайный
+        суффикс, поэтому версии, созданные одновременно, не совпадают,
+        а сортировка названий остается хронологической.
+        :return: название новой версии
+        """
+        index = (f'{self.alias}_{datetime.utcnow():%Y%m%d%H%M%S%f}_'
+                 f'{uuid.uuid4().hex[:8]}')
+        body = copy.deepcopy(self.mapping)
+        body.setdefault('settings', {}).update({
+            'refresh_interval': '-1',
+            'number_of_replicas': 0,
+        })
+        logging.info(f'Create index version - {index}.')
+        self.es_client.indices.create(index=index, body=body)
+        return index
+
+    def index_uuid(self, index: str) -> str:
+        """
+        Получить uuid версии индекса.
+        :param index: название версии
+        :return:
+        """
+        settings = self.es_client.indices.get_settings(
+            index=index, name='index.uuid'
+        )
+        return settings[index]['settings']['index']['uuid']
+
+    def finalize(self, index: str) -> None:
+        """
+        Восстановить настройки индекса после загрузки и слить сегменты.
+        :param index: название версии
+        :return:
+        """
+        settings = self.mapping.get('settings', {})
+        self.es_client.indices.put_settings(index=index, settings={
+            'refresh_interval': settings.get('refresh_interval', '1s'),
+            'number_of_replicas': settings.get('number_of_replicas', 1),
+        })
+        self.es_client.indices.refresh(index=index)
+        self.es_client.options(request_timeout=3600).indices.forcemerge(
+            index=index, max_num_segments=1
+        )
+
+    def swap(self, index: str) -> None:
+        """
+        Атомарно переключить алиас на новую версию индекса.
+        Индекс, созданный ранее под именем алиаса, удаляется
+        в той же операции.
+        :param index: название версии
+        :return:
+        """
+        actions = []
+        if self.es_client.indices.exists_alias(name=self.alias):
+            aliased = self.es_client.indices.get_alias(name=self.alias)
+            for old_index in aliased:
+                actions.append(
+                    {'remove': {'index': old_index, 'alias': self.alias}}
+                )
+        elif self.es_client.indices.exists(index=self.alias):
+            actions.append({'remove_index': {'index': self.alias}})
+        actions.append({'add': {'index': index, 'alias': self.alias}})
+        self.es_client.indices.update_aliases(actions=actions)
+        logging.info(f'Alias {self.alias} switched to {index}.')
+
+    def prune(self, index: str) -> None:
+        """
+        Удалить старые версии индекса сверх keep_versions.
+        Версии с названием по времени с точностью до секунды, созданные
+        до появления суффикса, тоже учитываются: они старше новых.
+        :param index: текущая версия, которая не удаляется
+        :return:
+        """
+        pattern = re.compile(
+            rf'{re.escape(self.alias)}_\d{{14}}(\d{{6}}_[0-9a-f]{{8}})?'
+        )
+        versions = sorted(
+            (version for version
+             in self.es_client.indices.get(index=f'{self.alias}_*')
+             if pattern.fullmatch(version)),
+            reverse=True,
+        )
+        stale = [version for version in versions[self.keep_versions:]
+                 if version != index]
+        for version in stale:
+            logging.info(f'Delete stale index version - {version}.')
+            self.es_client.indices.delete(index=version)
@@ -0,0 +1,157 @@
+"""Метрики ETL-процесса и их публикация для Prometheus."""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Generator
+
+from dateutil.parser import parse
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               start_http_server)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+
+REGISTRY = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    'etl_stage_seconds',
+    'Latency of a pipeline stage call in seconds.',
+    ('stage',),
+    buckets=DEFAULT_BUCKETS,
+    registry=REGISTRY,
+)
+ROWS = Counter(
+    'etl_rows',
+    'Film rows extracted from PostgreSQL.',
+    registry=REGISTRY,
+)
+ROWS_PER_SECOND = Gauge(
+    'etl_rows_per_second',
+    'Film rows processed per second during the last load cycle.',
+    registry=REGISTRY,
+)
+BULK_DOCUMENTS = Histogram(
+    'etl_bulk_documents',
+    'Documents sent in one bulk request.',
+    buckets=SIZE_BUCKETS,
+    registry=REGISTRY,
+)
+BULK_BYTES = Histogram(
+    'etl_bulk_bytes',
+    'Serialized size of documents sent in one bulk request.',
+    buckets=BYTES_BUCKETS,
+    registry=REGISTRY,
+)
+BATCH_SIZE = Gauge(
+    'etl_batch_size',
+    'Current batch size chosen for a pipeline stage.',
+    ('stage',),
+    registry=REGISTRY,
+)
+DOCUMENTS_SKIPPED = Counter(
+    'etl_documents_skipped',
+    'Unchanged documents skipped by the document hash cache.',
+    registry=REGISTRY,
+)
+DEAD_LETTERS = Counter(
+    'etl_dead_letter_documents',
+    'Documents rejected by Elasticsearch and written to the dead-letter '
+    'file.',
+    registry=REGISTRY,
+)
+RETRIES = Counter(
+    'etl_retries',
+    'Retried operations after a recoverable error.',
+    ('operation',),
+    registry=REGISTRY,
+)
+RECONCILE_DOCUMENTS = Counter(
+    'etl_reconcile_documents',
+    'Drifted documents found by reconciliation.',
+    ('kind',),
+    registry=REGISTRY,
+)
+REPLICA_LAG = Gauge(
+    'etl_replica_lag_seconds',
+    'Replication lag of the read replica measured before a cycle.',
+    registry=REGISTRY,
+)
+CHECKPOINT_TIMESTAMP = Gauge(
+    'etl_checkpoint_timestamp_seconds',
+    'Modification time of the last committed checkpoint.',
+    ('key',),
+    registry=REGISTRY,
+)
+CHECKPOINT_LAG = Gauge(
+    'etl_checkpoint_lag_seconds',
+    'Delay between a change and the commit of its checkpoint; 0 after '
+    'a cycle that found no changes.',
+    ('key',),
+    registry=REGISTRY,
+)
+
+_checkpoint_lock = threading.Lock()
+_checkpoint_keys = set()
+_cycle_keys = set()
+
+
+def rows_extracted() -> float:
+    """
+    Число строк фильмов, извлеченных процессом.
+    :return:
+    """
+    return REGISTRY.get_sample_value('etl_rows_total') or 0.0
+
+
+def observe_checkpoint(key: str, cursor: tuple[str, str]) -> None:
+    """
+    Учесть зафиксированный чекпоинт: отставание - время от изменения
+    до фиксации его позиции.
+    :param key: ключ состояния
+    :param cursor: курсор (modified, id)
+    :return:
+    """
+    try:
+        timestamp = parse(cursor[0]).timestamp()
+    except (ValueError, OverflowError):
+        return
+    CHECKPOINT_TIMESTAMP.labels(key=key).set(timestamp)
+    CHECKPOINT_LAG.labels(key=key).set(max(time.time() - timestamp, 0.0))
+    with _checkpoint_lock:
+        _checkpoint_keys.add(key)
+        _cycle_keys.add(key)
+
+
+@contextmanager
+def checkpoint_cycle() -> Generator[None, None, None]:
+    """
+    Цикл загрузки изменений с чекпоинтов. Если цикл завершился,
+    не зафиксировав чекпоинтов позиции, ее источник не нашел изменений,
+    и отставание позиции равно нулю.
+    :return:
+    """
+    with _checkpoint_lock:
+        _cycle_keys.clear()
+    yield
+    with _checkpoint_lock:
+        idle = _checkpoint_keys - _cycle_keys
+    for key in idle:
+        CHECKPOINT_LAG.labels(key=key).set(0)
+
+
+def start_metrics_server(host: str, port: int) -> None:
+    """
+    Запустить HTTP-сервер метрик в фоновом потоке.
+    :param host: адрес
+    :param port: порт
+    :return:
+    """
+    start_http_server(port, addr=host, registry=REGISTRY)
+    logger.info(f'Metrics are available at http://{host}:{port}/metrics.')
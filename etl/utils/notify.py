@@ -0,0 +1,129 @@
+"""Получение изменений из PostgreSQL через LISTEN/NOTIFY."""
+
+import inspect
+import os
+import select
+import sys
+import time
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import logging
+from utils.postgres_extractor import postgres_cursor_context
+
+NOTIFY_TABLES = (
+    'film_work',
+    'person',
+    'genre',
+    'person_film_work',
+    'genre_film_work',
+)
+
+NOTIFY_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION content.etl_notify_change()
+    RETURNS trigger AS $$
+    DECLARE
+        rec record;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            rec := OLD;
+        ELSE
+            rec := NEW;
+        END IF;
+        IF TG_TABLE_NAME IN ('person_film_work', 'genre_film_work') THEN
+            PERFORM pg_notify(TG_ARGV[0], 'film_work:' || rec.film_work_id);
+        ELSE
+            PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME || ':' || rec.id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+NOTIFY_TRIGGER_SQL = """
+    DROP TRIGGER IF EXISTS etl_notify_change ON content.{table};
+    CREATE TRIGGER etl_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change('{channel}');
+"""
+
+
+class ChangeListener:
+    """Слушатель уведомлений об изменениях фильмов, персон и жанров."""
+
+    def __init__(self, conn: psycopg2.connect, channel: str):
+        """
+        Инициализация слушателя.
+        :param conn: отдельное соединение, используемое только для LISTEN
+        :param channel: название канала уведомлений
+        """
+        self.conn = conn
+        self.conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        self.channel = channel
+
+    def install_triggers(self) -> None:
+        """
+        Установить триггеры, отправляющие уведомления об изменениях.
+        :return:
+        """
+        with postgres_cursor_context(self.conn) as cur:
+            cur.execute(NOTIFY_FUNCTION_SQL)
+            for table in NOTIFY_TABLES:
+                cur.execute(NOTIFY_TRIGGER_SQL.format(
+                    table=table, channel=self.channel
+                ))
+        logging.info(f'Notify triggers installed for channel {self.channel}.')
+
+    def listen(self) -> None:
+        """
+        Подписаться на канал уведомлений.
+        :return:
+        """
+        with postgres_cursor_context(self.conn) as cur:
+            cur.execute(f'LISTEN {self.channel};')
+
+    def _poll(self, timeout: float) -> bool:
+        """
+        Дождаться уведомлений не дольше timeout секунд.
+        :param timeout: время ожидания
+        :return: получены ли уведомления
+        """
+        deadline = time.monotonic() + timeout
+        while not self.conn.notifies:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.conn], [], [], remaining) != ([], [], []):
+                self.conn.poll()
+        return True
+
+    def collect(self,
+                timeout: float,
+                debounce: float) -> dict[str, set[str]]:
+        """
+        Собрать ID измененных объектов. После первого уведомления
+        изменения накапливаются еще debounce секунд.
+        :param timeout: максимальное время ожидания первого уведомления
+        :param debounce: окно накопления изменений
+        :return: ID изменений по названиям таблиц
+        """
+        changes = defaultdict(set)
+        if not self._poll(timeout):
+            return changes
+        deadline = time.monotonic() + debounce
+        while True:
+            while self.conn.notifies:
+                notify = self.conn.notifies.pop(0)
+                table, _, id_ = notify.payload.partition(':')
+                changes[table].add(id_)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._poll(remaining):
+                return changes
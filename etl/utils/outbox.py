@@ -0,0 +1,93 @@
+"""Журнал изменений фильмов (outbox), заполняемый триггерами PostgreSQL."""
+
+import inspect
+import os
+import sys
+
+import psycopg2
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import logging
+from utils.postgres_extractor import postgres_cursor_context
+
+OUTBOX_TABLES = (
+    'film_work',
+    'person',
+    'genre',
+    'person_film_work',
+    'genre_film_work',
+)
+
+OUTBOX_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS content.etl_outbox (
+        seq bigserial PRIMARY KEY,
+        txid bigint NOT NULL DEFAULT txid_current(),
+        film_work_id uuid NOT NULL,
+        changed_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS etl_outbox_txid_seq_idx
+        ON content.etl_outbox (txid, seq);
+"""
+
+OUTBOX_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION content.etl_outbox_change()
+    RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'film_work' THEN
+            INSERT INTO content.etl_outbox (film_work_id)
+            VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END);
+        ELSIF TG_TABLE_NAME IN ('person_film_work', 'genre_film_work') THEN
+            IF TG_OP <> 'INSERT' THEN
+                INSERT INTO content.etl_outbox (film_work_id)
+                VALUES (OLD.film_work_id);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE'
+                    AND NEW.film_work_id <> OLD.film_work_id) THEN
+                INSERT INTO content.etl_outbox (film_work_id)
+                VALUES (NEW.film_work_id);
+            END IF;
+        ELSIF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'person' THEN
+            INSERT INTO content.etl_outbox (film_work_id)
+            SELECT DISTINCT pfw.film_work_id
+            FROM content.person_film_work pfw
+            WHERE pfw.person_id = NEW.id;
+        ELSIF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'genre' THEN
+            INSERT INTO content.etl_outbox (film_work_id)
+            SELECT DISTINCT gfw.film_work_id
+            FROM content.genre_film_work gfw
+            WHERE gfw.genre_id = NEW.id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+OUTBOX_TRIGGER_SQL = """
+    DROP TRIGGER IF EXISTS etl_outbox_change ON content.{table};
+    CREATE TRIGGER etl_outbox_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+    FOR EACH ROW EXECUTE FUNCTION content.etl_outbox_change();
+"""
+
+
+def install_outbox(conn: psycopg2.connect) -> None:
+    """
+    Создать таблицу журнала изменений и триггеры, которые пишут в нее
+    ID затронутых фильмов, в том числе при изменении связей фильмов
+    с персонами и жанрами. Вставка и удаление персон и жанров
+    фильмы не затрагивают: это делают изменения связей.
+    :param conn: соединение с базой
+    :return:
+    """
+    with postgres_cursor_context(conn) as cur:
+        cur.execute(OUTBOX_TABLE_SQL)
+        cur.execute(OUTBOX_FUNCTION_SQL)
+        for table in OUTBOX_TABLES:
+            cur.execute(OUTBOX_TRIGGER_SQL.format(table=table))
+    conn.commit()
+    logging.info('Outbox table and triggers installed.')
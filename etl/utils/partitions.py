@@ -0,0 +1,212 @@
+"""Разбиение фильмов на партиции между процессами ETL."""
+
+import inspect
+import math
+import os
+import random
+import sys
+from typing import NamedTuple, Optional
+
+import psycopg2
+from psycopg2 import InterfaceError, OperationalError
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+
+WORKERS_QUERY = """
+    SELECT count(*) FROM pg_locks
+    WHERE locktype = 'advisory' AND granted AND objsubid = 2
+        AND classid::bigint = %s AND objid::bigint >= %s;
+"""
+
+
+def partition_of(film_id: str, count: int) -> int:
+    """
+    Номер партиции фильма: первые 32 бита UUID по модулю числа
+    партиций. Совпадает с условием партиции в FILMWORKS_STREAM_QUERY.
+    :param film_id: ID фильма
+    :param count: число партиций
+    :return:
+    """
+    return int(str(film_id)[:8], 16) % count
+
+
+def partition_prefix(index: int, count: int) -> str:
+    """
+    Префикс ключей состояния партиции. В префикс входит число
+    партиций: при его изменении фильмы переходят между партициями,
+    и позиции прежнего разбиения не годятся.
+    :param index: номер партиции
+    :param count: число партиций
+    :return:
+    """
+    return f'partition{index}of{count}_'
+
+
+class PartitionSet(NamedTuple):
+    """Партиции, которые обрабатывает процесс."""
+
+    count: int
+    held: tuple[int, ...]
+
+    @property
+    def prefixes(self) -> tuple[str, ...]:
+        """
+        Префиксы ключей состояния захваченных партиций.
+        :return:
+        """
+        return tuple(partition_prefix(index, self.count)
+                     for index in self.held)
+
+    @property
+    def all_prefixes(self) -> tuple[str, ...]:
+        """
+        Префиксы ключей состояния всех партиций.
+        :return:
+        """
+        return tuple(partition_prefix(index, self.count)
+                     for index in range(self.count))
+
+    def contains(self, film_id: str) -> bool:
+        """
+        Проверить, что фильм относится к захваченным партициям.
+        :param film_id: ID фильма
+        :return:
+        """
+        return partition_of(film_id, self.count) in self.held
+
+
+class PartitionLeases:
+    """
+    Захват партиций через сессионные advisory-блокировки PostgreSQL.
+    Блокировки держит отдельное соединение: если процесс завершится
+    или потеряет соединение, блокировки снимутся и партиции захватят
+    другие процессы.
+
+    Кроме партиций, соединение держит блокировку присутствия с ключом
+    (namespace, -pid): по их числу процесс узнает, сколько процессов
+    работает, и без явного ограничения держит не больше своей доли.
+    Ключи присутствия в pg_locks выглядят как objid не меньше 2^31
+    и не пересекаются с номерами партиций.
+    """
+
+    def __init__(self,
+                 dsl: dict,
+                 count: int = SETTINGS.PARTITIONS,
+                 max_held: int = SETTINGS.PARTITIONS_PER_WORKER,
+                 namespace: int = SETTINGS.PARTITION_LOCK_NAMESPACE):
+        """
+        Инициализация.
+        :param dsl: параметры подключения
+        :param count: число партиций
+        :param max_held: сколько партиций может держать процесс,
+            0 - поровну между работающими процессами
+        :param namespace: первый ключ advisory-блокировок
+        """
+        self.dsl = dsl
+        self.count = count
+        self.max_held = max_held
+        self.namespace = namespace
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._held = set()
+
+    def _connection(self) -> psycopg2.extensions.connection:
+        """
+        Соединение с блокировками. Если оно разорвано, блокировки
+        потеряны и партиции захватываются заново.
+        :return:
+        """
+        if self._conn is not None and not self._conn.closed:
+            try:
+                with self._conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                return self._conn
+            except (OperationalError, InterfaceError):
+                logging.warning('Partition lock connection is broken.')
+                self.release()
+        self._conn = psycopg2.connect(**self.dsl)
+        self._conn.autocommit = True
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_lock(%s, -pg_backend_pid())',
+                        (self.namespace,))
+        return self._conn
+
+    def share(self, cur: psycopg2.extensions.cursor) -> int:
+        """
+        Сколько партиций может держать процесс: заданное ограничение
+        или доля партиций среди процессов с блокировкой присутствия.
+        :param cur: курсор соединения с блокировками
+        :return:
+        """
+        if self.max_held:
+            return self.max_held
+        cur.execute(WORKERS_QUERY, (self.namespace, self.count))
+        workers = max(cur.fetchone()[0], 1)
+        return math.ceil(self.count / workers)
+
+    def verify(self) -> None:
+        """
+        Проверить, что блокировки партиций еще удерживаются. Вызывается
+        перед записью позиций: если соединение разорвано, партиции
+        могли захватить другие процессы, и позиции записывать нельзя.
+        :return:
+        """
+        if self._conn is None or self._conn.closed:
+            raise InterfaceError('Partition locks are not held.')
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute('SELECT 1')
+        except (OperationalError, InterfaceError):
+            logging.warning('Partition lock connection is broken.')
+            self.release()
+            raise
+
+    def claim(self) -> PartitionSet:
+        """
+        Захватить свободные партиции в пределах доли процесса.
+        Партиции сверх доли освобождаются, чтобы их захватили новые
+        процессы: вызывается в начале цикла, когда позиции партиций
+        уже записаны. Обход начинается со случайной партиции, чтобы
+        одновременно запущенные процессы реже соперничали за одни
+        блокировки.
+        :return: захваченные партиции
+        """
+        conn = self._connection()
+        start = random.randrange(self.count)
+        with conn.cursor() as cur:
+            share = self.share(cur)
+            while len(self._held) > share:
+                index = self._held.pop()
+                cur.execute('SELECT pg_advisory_unlock(%s, %s)',
+                            (self.namespace, index))
+                logging.info(f'Released partition {index}/{self.count}.')
+            for offset in range(self.count):
+                if len(self._held) >= share:
+                    break
+                index = (start + offset) % self.count
+                if index in self._held:
+                    continue
+                cur.execute('SELECT pg_try_advisory_lock(%s, %s)',
+                            (self.namespace, index))
+                if cur.fetchone()[0]:
+                    self._held.add(index)
+                    logging.info(f'Claimed partition {index}/{self.count}.')
+        return PartitionSet(self.count, tuple(sorted(self._held)))
+
+    def release(self) -> None:
+        """
+        Освободить все партиции, закрыв соединение.
+        :return:
+        """
+        self._held.clear()
+        if self._conn is not None and not self._conn.closed:
+            try:
+                self._conn.close()
+            except (OperationalError, InterfaceError):
+                pass
+        self._conn = None
@@ -1,10 +1,15 @@
 import inspect
 import os
 import sys
+import time
+from collections import deque
 from contextlib import contextmanager
-from typing import Generator
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Generator, NamedTuple, Optional
 
 import psycopg2
+from dateutil.parser import parse
 from psycopg2.extras import DictCursor, RealDictRow
 
 currentdir = os.path.dirname(
@@ -13,9 +18,14 @@ currentdir = os.path.dirname(
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
-from config import SETTINGS
+from config import SETTINGS, logging
+from utils.batch_size import AdaptiveBatchSize
+from utils.cache import DimensionCache
+from utils.metrics import ROWS, STAGE_SECONDS, observe_checkpoint
+from utils.partitions import PartitionLeases, PartitionSet
+from utils.profiling import PROFILER
 from utils.storage import State
-from utils.transformer import Filmwork
+from utils.transformer import FilmworkRecord
 
 
 @contextmanager
@@ -47,25 +57,541 @@ def postgres_cursor_context(
 
 
 class StateKeys:
-    """Ключи словаря хранилища актуализации."""
+    """
+    Ключи словаря хранилища актуализации. Позиции персон и жанров
+    без кэша имен - курсоры (modified, id фильма) по связям с фильмами,
+    с кэшем имен - курсоры (modified, id) по самим персонам и жанрам.
+    """
 
     FILMWORK = 'movie_filmwork_md'
     PERSON = 'movie_person_md'
     GENRE = 'movie_genre_md'
+    PERSON_DIMENSION = 'movie_person_dimension_md'
+    GENRE_DIMENSION = 'movie_genre_dimension_md'
+    OUTBOX = 'movie_outbox_seq'
+    FULL_LOAD_PERSON = 'movie_full_load_person_md'
+    FULL_LOAD_GENRE = 'movie_full_load_genre_md'
+    FULL_LOAD_OUTBOX = 'movie_full_load_outbox_seq'
+
+
+POSITION_KEYS = (StateKeys.GENRE, StateKeys.PERSON,
+                 StateKeys.GENRE_DIMENSION, StateKeys.PERSON_DIMENSION,
+                 StateKeys.FILMWORK, StateKeys.OUTBOX)
+
+NIL_ID = '00000000-0000-0000-0000-000000000000'
+MAX_ID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+FILM_WORK_IDS_QUERY = """
+    SELECT
+        fw.id,
+        fw.modified
+    FROM film_work fw
+    WHERE (fw.modified, fw.id) > (%s::timestamptz, %s::uuid)
+    ORDER BY fw.modified, fw.id;
+"""
+
+GENRE_IDS_QUERY = """
+    SELECT gfw.film_work_id,
+           g.modified
+    FROM genre g
+    INNER JOIN genre_film_work gfw ON g.id = gfw.genre_id
+    WHERE (g.modified, gfw.film_work_id) >
+          (%s::timestamptz, %s::uuid)
+    ORDER BY g.modified, gfw.film_work_id;
+"""
+
+PERSON_IDS_QUERY = """
+    SELECT
+        pfw.film_work_id,
+        p.modified
+    FROM person p
+    INNER JOIN person_film_work pfw ON p.id = pfw.person_id
+    WHERE (p.modified, pfw.film_work_id) >
+          (%s::timestamptz, %s::uuid)
+    ORDER BY p.modified, pfw.film_work_id;
+"""
+
+PERSON_FILM_IDS_QUERY = """
+    SELECT DISTINCT pfw.film_work_id
+    FROM person_film_work pfw
+    WHERE pfw.person_id = ANY(%s::uuid[]);
+"""
+
+DIRECTOR_FILM_IDS_QUERY = """
+    SELECT DISTINCT pfw.film_work_id
+    FROM person_film_work pfw
+    WHERE pfw.role = 'director' AND pfw.person_id = ANY(%s::uuid[]);
+"""
+
+GENRE_FILM_IDS_QUERY = """
+    SELECT DISTINCT gfw.film_work_id
+    FROM genre_film_work gfw
+    WHERE gfw.genre_id = ANY(%s::uuid[]);
+"""
+
+PERSON_CHANGES_QUERY = """
+    SELECT
+        p.id,
+        p.modified,
+        p.full_name AS name
+    FROM person p
+    WHERE (p.modified, p.id) > (%s::timestamptz, %s::uuid)
+    ORDER BY p.modified, p.id;
+"""
+
+GENRE_CHANGES_QUERY = """
+    SELECT
+        g.id,
+        g.modified,
+        g.name
+    FROM genre g
+    WHERE (g.modified, g.id) > (%s::timestamptz, %s::uuid)
+    ORDER BY g.modified, g.id;
+"""
+
+OUTBOX_IDS_QUERY = """
+    SELECT
+        o.film_work_id,
+        o.txid,
+        o.seq
+    FROM content.etl_outbox o
+    WHERE (o.txid, o.seq) > (%s::bigint, %s::bigint)
+      AND o.txid < txid_snapshot_xmin(txid_current_snapshot())
+    ORDER BY o.txid, o.seq;
+"""
+
+OUTBOX_POSITION_QUERY = """
+    SELECT
+        o.txid,
+        o.seq
+    FROM content.etl_outbox o
+    WHERE o.txid < txid_snapshot_xmin(txid_current_snapshot())
+    ORDER BY o.txid DESC, o.seq DESC
+    LIMIT 1;
+"""
+
+OUTBOX_PRUNE_QUERY = """
+    DELETE FROM content.etl_outbox
+    WHERE (txid, seq) <= (%s::bigint, %s::bigint);
+"""
+
+# Версия документа фильма: последнее изменение фильма, его персон
+# и жанров или их связей с фильмом. Совпадает с полем modified
+# документа, по ней сверка находит устаревшие документы.
+FILM_WORK_VERSION = """
+        GREATEST(
+            fw.modified,
+            (SELECT max(GREATEST(p.modified, pfw.created))
+             FROM content.person_film_work pfw
+             INNER JOIN content.person p ON p.id = pfw.person_id
+             WHERE pfw.film_work_id = fw.id),
+            (SELECT max(GREATEST(g.modified, gfw.created))
+             FROM content.genre_film_work gfw
+             INNER JOIN content.genre g ON g.id = gfw.genre_id
+             WHERE gfw.film_work_id = fw.id)
+        )"""
+
+FILMWORKS_QUERY = f"""
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,{FILM_WORK_VERSION} AS modified,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'role', pfw.role,
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null),
+           '[]'
+        ) as persons,
+        COALESCE (
+           array_agg(DISTINCT g.name) FILTER (WHERE g.name is not null),
+           '{{}}'
+        ) as genres,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', g.id,
+                   'name', g.name
+               )
+           ) FILTER (WHERE g.id is not null),
+           '[]'
+        ) as genre_objs
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE fw.id = ANY(%s::uuid[])
+    GROUP BY fw.id
+    ORDER BY fw.modified;
+"""
+
+FILMWORKS_STREAM_QUERY = f"""
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified AS film_work_modified,{FILM_WORK_VERSION} AS modified,
+        COALESCE (
+            (SELECT json_agg(
+                        DISTINCT jsonb_build_object(
+                            'role', pfw.role,
+                            'id', p.id,
+                            'name', p.full_name
+                        )
+                    )
+             FROM content.person_film_work pfw
+             INNER JOIN content.person p ON p.id = pfw.person_id
+             WHERE pfw.film_work_id = fw.id),
+            '[]'
+        ) as persons,
+        COALESCE (
+            (SELECT array_agg(DISTINCT g.name)
+             FROM content.genre_film_work gfw
+             INNER JOIN content.genre g ON g.id = gfw.genre_id
+             WHERE gfw.film_work_id = fw.id),
+            '{{}}'::text[]
+        ) as genres,
+        COALESCE (
+            (SELECT json_agg(
+                        DISTINCT jsonb_build_object(
+                            'id', g.id,
+                            'name', g.name
+                        )
+                    )
+             FROM content.genre_film_work gfw
+             INNER JOIN content.genre g ON g.id = gfw.genre_id
+             WHERE gfw.film_work_id = fw.id),
+            '[]'
+        ) as genre_objs
+    FROM content.film_work fw
+    WHERE (fw.modified, fw.id) > (%s::timestamptz, %s::uuid)
+        AND ('x' || lpad(left(fw.id::text, 8), 16, '0'))::bit(64)::bigint
+            %% %s = ANY(%s)
+    ORDER BY fw.modified, fw.id;
+"""
+
+DIMENSION_NAMES_QUERY = """
+    SELECT 'person' AS kind, p.id, p.full_name AS name
+    FROM content.person p
+    UNION ALL
+    SELECT 'genre' AS kind, g.id, g.name
+    FROM content.genre g;
+"""
+
+DIMENSIONS_MODIFIED_QUERY = """
+    SELECT
+        (SELECT max(modified) FROM content.person) AS person,
+        (SELECT max(modified) FROM content.genre) AS genre;
+"""
+
+
+DIMENSION_FEEDS = {
+    StateKeys.PERSON_DIMENSION: ('person', PERSON_CHANGES_QUERY,
+                                 PERSON_FILM_IDS_QUERY),
+    StateKeys.GENRE_DIMENSION: ('genre', GENRE_CHANGES_QUERY,
+                                GENRE_FILM_IDS_QUERY),
+}
+
+# Позиции персон и жанров по связям с фильмами и по самим объектам.
+# Если позиции одного вида нет, например после включения частичных
+# обновлений, чтение начинается с момента позиции другого вида.
+LINKED_KEYS = {
+    StateKeys.GENRE: StateKeys.GENRE_DIMENSION,
+    StateKeys.PERSON: StateKeys.PERSON_DIMENSION,
+    StateKeys.GENRE_DIMENSION: StateKeys.GENRE,
+    StateKeys.PERSON_DIMENSION: StateKeys.PERSON,
+}
+
+FULL_LOAD_MARKS = {
+    'genre': StateKeys.FULL_LOAD_GENRE,
+    'person': StateKeys.FULL_LOAD_PERSON,
+}
+
+PROFILED_QUERIES = {
+    FILMWORKS_QUERY: 'get_filmworks',
+    FILM_WORK_IDS_QUERY: 'ids_film_work_since_date',
+    GENRE_IDS_QUERY: 'ids_genre_since_date',
+    PERSON_IDS_QUERY: 'ids_person_since_date',
+}
+
+
+class DimensionRename(NamedTuple):
+    """Переименование персоны или жанра."""
+
+    kind: str
+    id: str
+    old_name: str
+    new_name: str
+    modified: str = ''
+
+
+class Checkpoint(NamedTuple):
+    """
+    Позиция курсора (modified, id) источника изменений.
+    Для источников персон и жанров при частичных обновлениях также
+    содержит переименования и актуальные имена, которые применяются
+    вместе с фиксацией позиции.
+    """
+
+    key: str
+    cursor: tuple[str, str]
+    renames: tuple[DimensionRename, ...] = ()
+    dimensions: tuple[tuple[str, str, str], ...] = ()
+
+    def merge(self, newer: 'Checkpoint') -> 'Checkpoint':
+        """
+        Объединить с более поздним чекпоинтом того же источника.
+        :param newer: более поздний чекпоинт
+        :return:
+        """
+        return newer._replace(
+            renames=self.renames + newer.renames,
+            dimensions=self.dimensions + newer.dimensions,
+        )
+
+
+def to_cursor(value: Any) -> tuple[str, str]:
+    """
+    Привести сохраненное состояние к курсору (modified, id).
+    Поддерживает старый формат состояния - только дату модификации.
+    :param value: значение из хранилища состояния
+    :return:
+    """
+    if not value:
+        return SETTINGS.FIRST_DATE, NIL_ID
+    if isinstance(value, str):
+        return value, NIL_ID
+    modified, id_ = value
+    return str(modified), str(id_)
+
+
+def cursor_order(key: str, value: Any) -> tuple:
+    """
+    Ключ сравнения сохраненных курсоров одного источника.
+    :param key: ключ состояния
+    :param value: значение из хранилища состояния
+    :return:
+    """
+    if key in (StateKeys.OUTBOX, StateKeys.FULL_LOAD_OUTBOX):
+        return tuple(int(part) for part in value)
+    modified, id_ = to_cursor(value)
+    moment = parse(modified)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment, id_
+
+
+def clamp_cursor(cursor: tuple[str, str],
+                 limit: datetime) -> tuple[str, str]:
+    """
+    Ограничить курсор (modified, id) моментом воспроизведения реплики:
+    изменения после него реплика могла еще не получить.
+    :param cursor: курсор
+    :param limit: момент воспроизведения WAL на реплике
+    :return:
+    """
+    if cursor_order(StateKeys.FILMWORK, cursor)[0] <= limit:
+        return cursor
+    return str(limit), NIL_ID
+
+
+class ChangeSet:
+    """Набор ID измененных фильмов, собранный из нескольких источников."""
+
+    def __init__(self, batch_size: int = SETTINGS.BATCH_SIZE):
+        """
+        Инициализация набора.
+        :param batch_size: размер выдаваемых батчей ID
+        """
+        self.batch_size = batch_size
+        self._seen = set()
+        self._pending = []
+        self._checkpoints = deque()
+        self._added = 0
+        self._emitted = 0
+
+    def _emit(self, size: int) -> tuple[tuple[str], Optional[Checkpoint]]:
+        """
+        Выдать батч ID вместе с последним полностью покрытым им чекпоинтом.
+        :param size: размер батча
+        :return:
+        """
+        ids = tuple(self._pending[:size])
+        self._pending = self._pending[size:]
+        self._emitted += len(ids)
+        checkpoint = None
+        while self._checkpoints and self._checkpoints[0][0] <= self._emitted:
+            covered = self._checkpoints.popleft()[1]
+            checkpoint = covered if checkpoint is None else (
+                checkpoint.merge(covered)
+            )
+        return ids, checkpoint
+
+    def add(
+            self,
+            ids: tuple[str],
+            checkpoint: Optional[Checkpoint] = None
+    ) -> Generator[tuple[tuple[str], Optional[Checkpoint]], None, None]:
+        """
+        Добавить ID в набор, пропуская уже встречавшиеся в цикле.
+        Чекпоинт выдается только с батчем, после которого все ID
+        до этой позиции источника уже выданы.
+        :param ids: ID фильмов из источника изменений
+        :param checkpoint: позиция источника после этих ID
+        :return: заполненные батчи ID
+        """
+        for id_ in ids:
+            if id_ not in self._seen:
+                self._seen.add(id_)
+                self._pending.append(id_)
+                self._added += 1
+        if checkpoint is not None:
+            self._checkpoints.append((self._added, checkpoint))
+        while len(self._pending) >= self.batch_size:
+            yield self._emit(self.batch_size)
+
+    def flush(
+            self
+    ) -> Generator[tuple[tuple[str], Optional[Checkpoint]], None, None]:
+        """
+        Выдать остаток набора.
+        :return:
+        """
+        if self._pending or self._checkpoints:
+            yield self._emit(len(self._pending))
 
 
 class PostgresMovieExtractor:
     """Класс, выгружающий фильмы из PostgreSQL."""
 
-    def __init__(self, conn: psycopg2.connect, state: State):
+    def __init__(self,
+                 conn: psycopg2.connect,
+                 state: State,
+                 dimension_cache: Optional[DimensionCache] = None,
+                 batch_sizer: Optional[AdaptiveBatchSize] = None,
+                 state_prefixes: tuple[str, ...] = ('',),
+                 partitions: Optional[PartitionSet] = None,
+                 replica_conn: Optional[psycopg2.connect] = None,
+                 replayed: Optional[datetime] = None,
+                 leases: Optional[PartitionLeases] = None):
         """
         Инициализация параметров класса.
         :param conn: соединение с базой
         :param state: объект-хранилище
+        :param dimension_cache: кэш имен персон и жанров; если передан,
+            переименования применяются частичными обновлениями
+            без повторного извлечения связанных фильмов
+        :param batch_sizer: адаптивный размер батча извлекаемых фильмов;
+            без него используется BATCH_SIZE
+        :param state_prefixes: префиксы ключей состояния индексов,
+            заполняемых из одного прохода; изменения читаются
+            от самого раннего из их курсоров
+        :param partitions: захваченные партиции фильмов; если переданы,
+            извлекаются только фильмы этих партиций, а позиции
+            хранятся отдельно для каждой партиции
+        :param replica_conn: соединение с репликой, с которой читаются
+            фильмы и источники с курсором (modified, id)
+        :param replayed: момент, до которого реплика воспроизвела WAL;
+            позиции этих источников не продвигаются дальше него
+        :param leases: блокировки партиций, которые проверяются
+            перед записью позиций
         """
         self.conn = conn
         self.state = state
-        self.dataklass = Filmwork
+        self.dimension_cache = dimension_cache
+        self.batch_sizer = batch_sizer
+        self.state_prefixes = state_prefixes
+        self.partitions = partitions
+        self.replica_conn = replica_conn
+        self.replayed = replayed
+        self.leases = leases
+        self.dataklass = FilmworkRecord
+        self._committed: dict[Checkpoint, set[str]] = {}
+
+    @property
+    def batch_size(self) -> int:
+        """
+        Текущий размер батча извлекаемых фильмов.
+        :return:
+        """
+        if self.batch_sizer is None:
+            return SETTINGS.BATCH_SIZE
+        return self.batch_sizer.value
+
+    @property
+    def read_conn(self) -> psycopg2.connect:
+        """
+        Соединение для чтения фильмов: реплика, если она задана.
+        :return:
+        """
+        return self.replica_conn or self.conn
+
+    @property
+    def partition_prefixes(self) -> tuple[str, ...]:
+        """
+        Префиксы ключей состояния захваченных партиций.
+        :return:
+        """
+        if self.partitions is None:
+            return ('',)
+        return self.partitions.prefixes
+
+    @property
+    def dimension_keys(self) -> dict[str, str]:
+        """
+        Ключи позиций жанров и персон: с кэшем имен изменения читаются
+        по самим объектам, без него - по связям с фильмами.
+        :return: ключи состояния по типам объектов
+        """
+        if self.dimension_cache is None:
+            return {'genre': StateKeys.GENRE, 'person': StateKeys.PERSON}
+        return {'genre': StateKeys.GENRE_DIMENSION,
+                'person': StateKeys.PERSON_DIMENSION}
+
+    def feed_cursor(self, key: str) -> tuple[str, str]:
+        """
+        Позиция источника с курсором (modified, id). Позиция персон
+        или жанров другого вида дает только момент: курсор начинается
+        с него, и изменения в этот момент читаются повторно.
+        :param key: ключ состояния
+        :return:
+        """
+        value = self.get_state(key)
+        if not value and key in LINKED_KEYS:
+            linked = self.get_state(LINKED_KEYS[key])
+            if linked:
+                return to_cursor(linked)[0], NIL_ID
+        return to_cursor(value)
+
+    def get_state(self,
+                  key: str,
+                  partition_prefixes: Optional[tuple[str, ...]] = None) -> Any:
+        """
+        Самая ранняя позиция источника среди индексов и партиций.
+        :param key: ключ состояния
+        :param partition_prefixes: префиксы партиций; по умолчанию
+            захваченные партиции
+        :return: курсор или None, если хотя бы один индекс еще
+            не читал источник
+        """
+        if partition_prefixes is None:
+            partition_prefixes = self.partition_prefixes
+        values = [self.state.get_state(partition + prefix + key)
+                  for partition in partition_prefixes
+                  for prefix in self.state_prefixes]
+        if not all(values):
+            return None
+        return min(values, key=lambda value: cursor_order(key, value))
 
     def get_tables(self) -> list:
         """Метод для получения всех названий таблиц в базе."""
@@ -80,86 +606,204 @@ class PostgresMovieExtractor:
             self,
             query: str,
             values: tuple,
-            batch_size: int = SETTINGS.BATCH_SIZE
+            batch_size: int = SETTINGS.BATCH_SIZE,
+            conn: Optional[psycopg2.connect] = None
     ) -> Generator[list, None, None]:
         """
         Метод для получения данных из базы по запросу.
         :param query: запрос
         :param values: параметры для запроса
         :param batch_size: размер батча
+        :param conn: соединение; по умолчанию соединение для чтения
         :return:
         """
-        with postgres_cursor_context(self.conn) as cur:
-            cur.execute(query, values)
+        conn = conn or self.read_conn
+        with postgres_cursor_context(conn) as cur:
+            if PROFILER.active and query in PROFILED_QUERIES:
+                name = PROFILED_QUERIES[query]
+                PROFILER.explain(conn, name, query, values)
+                started = time.perf_counter()
+                cur.execute(query, values)
+                PROFILER.observe_query(name, time.perf_counter() - started)
+            else:
+                cur.execute(query, values)
             while rows := cur.fetchmany(batch_size):
                 yield rows
 
     @staticmethod
-    def _split_batch(batch) -> Generator[tuple[tuple[str], str], None, None]:
+    def _split_batch(batch) -> tuple[tuple[str], tuple[str, str]]:
         """
-        Извлечб ID и раннюю дату модификации из батча данных.
+        Извлечь ID и курсор последней строки из батча данных.
         :param batch: батч данных
         :return:
         """
         ids, modified_dates = zip(*(row.values() for row in batch))
-        since = modified_dates[0]
-        yield ids, since
+        return ids, (str(modified_dates[-1]), str(ids[-1]))
 
-    def ids_film_work_since_date(
+    def _ids_since(
             self,
-            since: str = SETTINGS.FIRST_DATE
-    ) -> Generator[tuple[tuple[str], str], None, None]:
+            query: str,
+            cursor: tuple[str, str]
+    ) -> Generator[tuple[tuple[str], tuple[str, str]], None, None]:
         """
-        Получить ID фильмов, отредактированных с указанной даты.
-        :param since: дата модификации
+        Получить ID фильмов по запросу с курсором (modified, id).
+        :param query: запрос, возвращающий пары (id, modified)
+        :param cursor: курсор, после которого начинается выборка
         :return:
         """
-        query = """
-            SELECT
-                fw.id,
-                fw.modified
-            FROM film_work fw
-            WHERE fw.modified >= %s
-            ORDER BY fw.modified, fw.id;
+        for batch in self._execute_raw(query, cursor):
+            yield self._split_batch(batch)
+
+    def ids_film_work_since_date(
+            self,
+            cursor: tuple[str, str] = (SETTINGS.FIRST_DATE, NIL_ID)
+    ) -> Generator[tuple[tuple[str], tuple[str, str]], None, None]:
+        """
+        Получить ID фильмов, отредактированных после курсора.
+        :param cursor: курсор (modified, id)
+        :return:
         """
-        values = (since,)
-        for batch in self._execute_raw(query, values):
-            yield from self._split_batch(batch)
+        yield from self._ids_since(FILM_WORK_IDS_QUERY, cursor)
 
     def ids_genre_since_date(
-            self, since: str = SETTINGS.FIRST_DATE
-    ) -> Generator[tuple[tuple[str], str], None, None]:
+            self,
+            cursor: tuple[str, str] = (SETTINGS.FIRST_DATE, NIL_ID)
+    ) -> Generator[tuple[tuple[str], tuple[str, str]], None, None]:
         """Получить ID фильмов, у которых изменился жанр.
         """
-        query = """
-           SELECT gfw.film_work_id,
-                   g.modified
-            FROM genre g
-            INNER JOIN genre_film_work gfw ON g.id = gfw.genre_id
-            WHERE g.modified >= %s
-            ORDER BY g.modified, gfw.film_work_id;
-        """
-        values = (since,)
-        for batch in self._execute_raw(query, values):
-            yield from self._split_batch(batch)
+        yield from self._ids_since(GENRE_IDS_QUERY, cursor)
 
     def ids_person_since_date(
             self,
-            since: str = SETTINGS.FIRST_DATE
-    ) -> Generator[tuple[tuple[str], str], None, None]:
+            cursor: tuple[str, str] = (SETTINGS.FIRST_DATE, NIL_ID)
+    ) -> Generator[tuple[tuple[str], tuple[str, str]], None, None]:
         """Получить ID фильмов, у которых изменились персоны."""
-        query = """
-            SELECT
-                pfw.film_work_id,
-                p.modified
-            FROM person p
-            INNER JOIN person_film_work pfw ON p.id = pfw.person_id
-            WHERE p.modified >= %s
-            ORDER BY p.modified, pfw.film_work_id;
-        """
-        values = (since,)
-        for batch in self._execute_raw(query, values):
-            yield from self._split_batch(batch)
+        yield from self._ids_since(PERSON_IDS_QUERY, cursor)
+
+    def ids_outbox_since(
+            self,
+            cursor: tuple[str, str] = ('0', '0')
+    ) -> Generator[tuple[tuple[str], tuple[str, str]], None, None]:
+        """
+        Получить ID фильмов из журнала изменений после курсора.
+        Читаются только записи завершенных транзакций с номером меньше
+        xmin текущего снимка: такие записи уже не появятся позже, поэтому
+        курсор (txid, seq) не пропускает долгие транзакции. Журнал
+        читается с основного сервера, как и очищается.
+        :param cursor: курсор (txid, seq)
+        :return:
+        """
+        for batch in self._execute_raw(OUTBOX_IDS_QUERY, cursor,
+                                       conn=self.conn):
+            last = batch[-1]
+            yield (tuple(row['film_work_id'] for row in batch),
+                   (str(last['txid']), str(last['seq'])))
+
+    def outbox_position(self) -> tuple[str, str]:
+        """
+        Позиция журнала изменений в снимке выгрузки всех фильмов:
+        последняя запись завершенных транзакций. Читается в транзакции
+        выгрузки, поэтому выгруженные фильмы уже содержат все изменения
+        до позиции.
+        :return: курсор (txid, seq)
+        """
+        with postgres_cursor_context(self.read_conn) as cur:
+            cur.execute(OUTBOX_POSITION_QUERY)
+            row = cur.fetchone()
+        if row is None:
+            return '0', '0'
+        return str(row['txid']), str(row['seq'])
+
+    def prune_outbox(self) -> None:
+        """
+        Удалить из журнала изменений записи до зафиксированного курсора.
+        Журнал общий для всех партиций, поэтому курсор берется самый
+        ранний среди всех партиций, а не только захваченных.
+        :return:
+        """
+        partition_prefixes = None
+        if self.partitions is not None:
+            partition_prefixes = self.partitions.all_prefixes
+        cursor = self.get_state(StateKeys.OUTBOX, partition_prefixes)
+        if not cursor:
+            return
+        with postgres_cursor_context(self.conn) as cur:
+            cur.execute(OUTBOX_PRUNE_QUERY, tuple(cursor))
+            deleted = cur.rowcount
+        self.conn.commit()
+        logging.info(f'Pruned {deleted} consumed outbox rows.')
+
+    def dimension_changes(
+            self,
+            state_key: str,
+            cursor: tuple[str, str] = (SETTINGS.FIRST_DATE, NIL_ID)
+    ) -> Generator[tuple[tuple[str], Checkpoint], None, None]:
+        """
+        Получить изменения персон или жанров после курсора.
+        Объекты с прежним именем пропускаются, переименованные
+        возвращаются как переименования в чекпоинте, и только для
+        неизвестных кэшу объектов возвращаются ID связанных фильмов.
+        Режиссеры хранятся в документах без ID, поэтому фильмы, где
+        переименованная персона - режиссер, извлекаются заново.
+        :param state_key: ключ состояния источника персон или жанров
+        :param cursor: курсор (modified, id)
+        :return: ID фильмов и чекпоинты
+        """
+        kind, query, film_ids_query = DIMENSION_FEEDS[state_key]
+        for batch in self._execute_raw(query, cursor):
+            known = self.dimension_cache.get_names(
+                kind, [row['id'] for row in batch]
+            )
+            renames, unknown = [], []
+            for row in batch:
+                old_name = known.get(row['id'])
+                if old_name is None:
+                    unknown.append(row['id'])
+                elif old_name != row['name']:
+                    renames.append(DimensionRename(
+                        kind, row['id'], old_name, row['name'],
+                        row['modified'].isoformat()
+                    ))
+            lookups = [(film_ids_query, unknown)]
+            if kind == 'person':
+                lookups.append((DIRECTOR_FILM_IDS_QUERY,
+                                [rename.id for rename in renames]))
+            film_ids = []
+            for ids_query, ids in lookups:
+                if not ids:
+                    continue
+                for rows in self._execute_raw(ids_query, (ids,)):
+                    film_ids.extend(row[0] for row in rows)
+            last = batch[-1]
+            yield tuple(film_ids), Checkpoint(
+                state_key,
+                (str(last['modified']), str(last['id'])),
+                tuple(renames),
+                tuple((kind, row['id'], row['name']) for row in batch),
+            )
+
+    def _feed(
+            self,
+            state_key: str,
+            cursor: tuple[str, str]
+    ) -> Generator[tuple[tuple[str], Checkpoint], None, None]:
+        """
+        Источник изменений для ключа состояния.
+        :param state_key: ключ состояния
+        :param cursor: курсор (modified, id)
+        :return: ID фильмов и чекпоинты
+        """
+        if state_key in DIMENSION_FEEDS:
+            yield from self.dimension_changes(state_key, cursor)
+            return
+        feeds = {
+            StateKeys.OUTBOX: self.ids_outbox_since,
+            StateKeys.GENRE: self.ids_genre_since_date,
+            StateKeys.PERSON: self.ids_person_since_date,
+            StateKeys.FILMWORK: self.ids_film_work_since_date,
+        }
+        for ids, cursor in feeds[state_key](cursor):
+            yield ids, Checkpoint(state_key, cursor)
 
     def get_filmworks(self,
                       ids: tuple[str]) -> Generator[RealDictRow, None, None]:
@@ -168,69 +812,246 @@ class PostgresMovieExtractor:
         :param ids: список id извлекаемых фильмов
         :return:
         """
-        query = """
-            SELECT
-                fw.id,
-                fw.title,
-                fw.description,
-                fw.rating,
-                fw.type,
-                fw.created,
-                fw.modified,
-                COALESCE (
-                   json_agg(
-                       DISTINCT jsonb_build_object(
-                           'role', pfw.role,
-                           'id', p.id,
-                           'name', p.full_name
-                       )
-                   ) FILTER (WHERE p.id is not null),
-                   '[]'
-                ) as persons,
-                array_agg(DISTINCT g.name) as genres
-            FROM content.film_work fw
-            LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-            LEFT JOIN content.person p ON p.id = pfw.person_id
-            LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-            LEFT JOIN content.genre g ON g.id = gfw.genre_id
-            WHERE fw.id IN %s
-            GROUP BY fw.id
-            ORDER BY fw.modified;
-        """
-        values = (tuple(ids),)
-        rows = self._execute_raw(query, values)
+        values = (list(ids),)
+        rows = self._execute_raw(FILMWORKS_QUERY, values)
         yield from rows
 
-    def extract_all(self) -> Generator[RealDictRow, None, None]:
+    def _fetch_rows(self, ids: tuple[str]) -> list:
         """
-        Извлечь все обновленные фильмы.
+        Получить строки фильмов с указанными ID одним списком.
+        :param ids: список id извлекаемых фильмов
+        :return:
+        """
+        rows = []
+        if ids:
+            started = time.perf_counter()
+            for batch in self.get_filmworks(ids):
+                rows.extend(batch)
+            seconds = time.perf_counter() - started
+            STAGE_SECONDS.labels(stage='extract').observe(seconds)
+            if self.batch_sizer is not None:
+                self.batch_sizer.observe(seconds, len(ids))
+            ROWS.inc(len(rows))
+        return rows
+
+    def own_ids(self, ids: tuple[str]) -> tuple[str]:
+        """
+        Оставить ID фильмов захваченных партиций.
+        :param ids: ID фильмов
+        :return:
+        """
+        if self.partitions is None:
+            return ids
+        return tuple(id_ for id_ in ids if self.partitions.contains(id_))
+
+    def begin_snapshot(self) -> None:
+        """
+        Начать на соединении для чтения транзакцию REPEATABLE READ,
+        чтобы все следующие запросы видели один снимок базы.
         :return:
+        """
+        self.read_conn.rollback()
+        with postgres_cursor_context(self.read_conn) as cur:
+            cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ '
+                        'READ ONLY')
+
+    def changed_ids(
+            self
+    ) -> Generator[tuple[tuple[str], Optional[Checkpoint]], None, None]:
+        """
+        Объединить источники изменений (жанры, персоны, фильмы) в единый
+        упорядоченный набор ID фильмов без повторов в пределах цикла.
+        Размер батча ID берется текущим перед каждым добавлением.
+        Источники с курсором (modified, id) и фильмы читаются из одного
+        снимка базы: иначе фильм, извлеченный по изменению жанра
+        и измененный позже, был бы пропущен как повтор в источнике
+        фильмов, а позиция фильмов прошла бы его изменение.
+        :return: батчи ID и чекпоинты источников
+        """
+        change_set = ChangeSet(self.batch_size)
+        if SETTINGS.CHANGE_SOURCE == 'outbox':
+            feeds = ((StateKeys.OUTBOX,
+                      tuple(self.get_state(StateKeys.OUTBOX)
+                            or ('0', '0'))),)
+        else:
+            self.begin_snapshot()
+            feeds = tuple(
+                (state_key, self.feed_cursor(state_key))
+                for state_key in (*self.dimension_keys.values(),
+                                  StateKeys.FILMWORK)
+            )
+        for state_key, cursor in feeds:
+            for ids, checkpoint in self._feed(state_key, cursor):
+                change_set.batch_size = self.batch_size
+                yield from change_set.add(self.own_ids(ids), checkpoint)
+            yield from change_set.flush()
+        if SETTINGS.CHANGE_SOURCE != 'outbox':
+            self.read_conn.rollback()
+
+    def extract_all(
+            self
+    ) -> Generator[tuple[list, Optional[Checkpoint]], None, None]:
+        """
+        Извлечь все обновленные фильмы.
+        Каждый фильм извлекается не более одного раза за цикл.
+        Чекпоинт батча следует фиксировать только после загрузки
+        его документов.
+        :return: батчи строк и чекпоинты
         :rtype:
         """
+        if self.is_full_load() and (SETTINGS.FULL_LOAD_STREAM
+                                    or SETTINGS.CHANGE_SOURCE == 'outbox'):
+            yield from self.stream_all()
+            return
+        if SETTINGS.CHANGE_SOURCE == 'outbox':
+            self.prune_outbox()
+        for ids, checkpoint in self.changed_ids():
+            yield self._fetch_rows(ids), checkpoint
 
-        genre_since = (self.state.get_state(StateKeys.GENRE)
-                       or SETTINGS.FIRST_DATE)
-        flag = True
-        for ids, genre_since in self.ids_genre_since_date(genre_since):
-            if flag:
-                self.state.set_state(StateKeys.GENRE, genre_since)
-                flag = False
-            yield from self.get_filmworks(ids)
-
-        person_since = (self.state.get_state(StateKeys.PERSON)
-                        or SETTINGS.FIRST_DATE)
-        flag = True
-        for ids, person_since in self.ids_person_since_date(person_since):
-            if flag:
-                self.state.set_state(StateKeys.PERSON, person_since)
-                flag = False
-            yield from self.get_filmworks(ids)
-
-        film_work_since = self.state.get_state(
-            StateKeys.FILMWORK) or SETTINGS.FIRST_DATE
-        flag = True
-        for ids, fw_since in self.ids_film_work_since_date(film_work_since):
-            if flag:
-                self.state.set_state(StateKeys.FILMWORK, fw_since)
-                flag = False
-            yield from self.get_filmworks(ids)
+    def is_full_load(self) -> bool:
+        """
+        Проверить, что загрузка полная: позиции персон и жанров
+        обоих видов, а в режиме outbox - позиция журнала изменений, еще
+        не зафиксированы. Журнал содержит только изменения после
+        установки триггеров, поэтому без позиции фильмы выгружаются
+        потоком и при FULL_LOAD_STREAM=False. Позиция фильмов при этом
+        может быть задана, если предыдущая полная загрузка была прервана.
+        :return:
+        """
+        if SETTINGS.CHANGE_SOURCE == 'outbox':
+            return not self.get_state(StateKeys.OUTBOX)
+        return not any(self.get_state(key) for key in LINKED_KEYS)
+
+    def seed_dimension_cache(
+            self,
+            itersize: int = SETTINGS.FULL_LOAD_ITERSIZE
+    ) -> None:
+        """
+        Заполнить кэш имен персон и жанров из снимка полной загрузки:
+        с этими именами фильмы попадают в индекс, поэтому первое же
+        переименование применяется частичным обновлением.
+        :param itersize: число строк, получаемых с сервера за раз
+        :return:
+        """
+        if self.dimension_cache is None:
+            return
+        with self.read_conn.cursor(name='dimension_names') as cur:
+            cur.itersize = itersize
+            cur.execute(DIMENSION_NAMES_QUERY)
+            while rows := cur.fetchmany(itersize):
+                self.dimension_cache.update(tuple(row) for row in rows)
+
+    def stream_all(
+            self,
+            itersize: int = SETTINGS.FULL_LOAD_ITERSIZE
+    ) -> Generator[tuple[list, Optional[Checkpoint]], None, None]:
+        """
+        Извлечь все фильмы одним запросом через серверный курсор.
+        Строки читаются порциями по itersize, поэтому память
+        ограничена размером порции, а число запросов не зависит от
+        числа фильмов. Запрос и позиции персон и жанров читаются из
+        одного снимка базы; позиции фиксируются после всех фильмов,
+        чтобы следующий цикл не выгружал фильмы повторно через
+        изменения персон и жанров. Позиции персон и жанров первой
+        попытки сохраняются сразу и используются при продолжении
+        прерванной загрузки: иначе изменения персон и жанров уже
+        выгруженных фильмов между попытками оказались бы позади позиций.
+        В режиме outbox так же сохраняется позиция журнала изменений.
+        :param itersize: число строк, получаемых с сервера за раз
+        :return: батчи строк и чекпоинты
+        """
+        self.begin_snapshot()
+        mark_keys = {state_key: FULL_LOAD_MARKS[kind]
+                     for kind, state_key in self.dimension_keys.items()}
+        if SETTINGS.CHANGE_SOURCE == 'outbox':
+            mark_keys[StateKeys.OUTBOX] = StateKeys.FULL_LOAD_OUTBOX
+        marks = {state_key: self.get_state(mark_key)
+                 for state_key, mark_key in mark_keys.items()}
+        if not all(marks.values()):
+            with postgres_cursor_context(self.read_conn) as cur:
+                cur.execute(DIMENSIONS_MODIFIED_QUERY)
+                dimensions_modified = cur.fetchone()
+            self.seed_dimension_cache(itersize)
+            for kind, state_key in self.dimension_keys.items():
+                modified = dimensions_modified[kind]
+                marks[state_key] = [str(modified or SETTINGS.FIRST_DATE),
+                                    MAX_ID]
+            if SETTINGS.CHANGE_SOURCE == 'outbox':
+                marks[StateKeys.OUTBOX] = list(self.outbox_position())
+            for state_key, mark_key in mark_keys.items():
+                for partition in self.partition_prefixes:
+                    for prefix in self.state_prefixes:
+                        self.state.set_state(partition + prefix + mark_key,
+                                             marks[state_key])
+        cursor = to_cursor(self.get_state(StateKeys.FILMWORK))
+        partitions = self.partitions or PartitionSet(1, (0,))
+        with self.read_conn.cursor(name='filmworks_stream') as cur:
+            cur.itersize = itersize
+            cur.execute(FILMWORKS_STREAM_QUERY,
+                        (*cursor, partitions.count, list(partitions.held)))
+            while True:
+                with STAGE_SECONDS.labels(stage='extract').time():
+                    rows = list(islice(cur, self.batch_size))
+                if not rows:
+                    break
+                ROWS.inc(len(rows))
+                last = rows[-1]
+                yield rows, Checkpoint(
+                    StateKeys.FILMWORK,
+                    (str(last['film_work_modified']), str(last['id']))
+                )
+        self.read_conn.rollback()
+        for state_key in mark_keys:
+            yield [], Checkpoint(state_key, tuple(marks[state_key]))
+
+    def extract_changes(
+            self,
+            changes: dict[str, set[str]]
+    ) -> Generator[tuple[list, Optional[Checkpoint]], None, None]:
+        """
+        Извлечь фильмы по известным ID измененных объектов, например
+        полученным из уведомлений. Состояние источников не меняется.
+        :param changes: ID изменений по названиям таблиц
+        :return: батчи строк без чекпоинтов
+        """
+        change_set = ChangeSet(self.batch_size)
+        id_sets = [changes.get('film_work', ())]
+        for table, query in (('person', PERSON_FILM_IDS_QUERY),
+                             ('genre', GENRE_FILM_IDS_QUERY)):
+            if changes.get(table):
+                for batch in self._execute_raw(query, (list(changes[table]),)):
+                    id_sets.append([row[0] for row in batch])
+        for ids in id_sets:
+            for film_ids, _ in change_set.add(self.own_ids(tuple(ids))):
+                yield self._fetch_rows(film_ids), None
+        for film_ids, _ in change_set.flush():
+            yield self._fetch_rows(film_ids), None
+
+    def commit(self, checkpoint: Checkpoint, prefix: str = '') -> None:
+        """
+        Зафиксировать позицию источника изменений в хранилище
+        для всех захваченных партиций. Имена персон и жанров попадают
+        в кэш, только когда чекпоинт зафиксировали все индексы: иначе
+        повтор в отставшем индексе не увидел бы переименования.
+        Если блокировки партиций потеряны, позиция не записывается.
+        :param checkpoint: чекпоинт
+        :param prefix: префикс ключей состояния индекса
+        :return:
+        """
+        if self.leases is not None:
+            self.leases.verify()
+        if checkpoint.dimensions and self.dimension_cache is not None:
+            committed = self._committed.setdefault(checkpoint, set())
+            committed.add(prefix)
+            if committed.issuperset(self.state_prefixes):
+                self.dimension_cache.update(checkpoint.dimensions)
+                del self._committed[checkpoint]
+        if self.replayed is not None and checkpoint.key != StateKeys.OUTBOX:
+            checkpoint = checkpoint._replace(
+                cursor=clamp_cursor(checkpoint.cursor, self.replayed)
+            )
+        key = prefix + checkpoint.key
+        for partition in self.partition_prefixes:
+            self.state.set_state(partition + key, list(checkpoint.cursor))
+        if checkpoint.key != StateKeys.OUTBOX:
+            observe_checkpoint(key, checkpoint.cursor)
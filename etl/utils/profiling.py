@@ -0,0 +1,248 @@
+"""Профилирование работающего процесса ETL по сигналу."""
+
+import inspect
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Generator
+
+import psycopg2
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+
+MEMORY_TOP = 30
+MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+)
+
+
+def log_directory() -> str:
+    """
+    Каталог файла лога, рядом с которым записываются результаты.
+    :return:
+    """
+    for handler in logging.getLogger().handlers:
+        file_path = getattr(handler, 'baseFilename', None)
+        if file_path:
+            return os.path.dirname(file_path)
+    return os.getcwd()
+
+
+class StackSampler(threading.Thread):
+    """
+    Поток, который с заданным интервалом снимает стеки всех остальных
+    потоков процесса. Стеки накапливаются в свернутом формате
+    (collapsed stacks), который принимают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval: float):
+        """
+        Инициализация.
+        :param interval: интервал между снимками в секундах
+        """
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def _sample(self) -> None:
+        """
+        Снять стеки потоков.
+        :return:
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} '
+                             f'({os.path.basename(code.co_filename)}'
+                             f':{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> None:
+        """
+        Остановить поток и дождаться его завершения.
+        :return:
+        """
+        self._stop_event.set()
+        self.join()
+
+
+class Profiler:
+    """
+    Профилирование ближайших циклов загрузки по запросу.
+    Запрос - сигнал или вызов request(); следующие cycles циклов
+    записывают свернутые стеки, изменения памяти по tracemalloc
+    и время запросов к базе с планами EXPLAIN (ANALYZE) в файлы
+    profile-<время>-<цикл>.* рядом с логом. Пока профилирование
+    не запрошено, перехватчики проверяют только флаг active.
+    """
+
+    def __init__(self,
+                 cycles: int = SETTINGS.PROFILE_CYCLES,
+                 interval: float = SETTINGS.PROFILE_SAMPLE_INTERVAL):
+        """
+        Инициализация.
+        :param cycles: число профилируемых циклов на один запрос
+        :param interval: интервал снятия стеков в секундах
+        """
+        self.cycles = cycles
+        self.interval = interval
+        self.active = False
+        self._requested = 0
+        self._session = None
+        self._cycle = 0
+        self._timings = defaultdict(list)
+        self._plans = {}
+
+    def request(self, *args) -> None:
+        """
+        Запросить профилирование следующих циклов. Подходит как
+        обработчик сигнала, поэтому только меняет счетчик.
+        :return:
+        """
+        self._requested = self.cycles
+
+    def install(self, signum: int = getattr(signal, 'SIGUSR1', 0)) -> None:
+        """
+        Установить обработчик сигнала, запрашивающего профилирование.
+        :param signum: номер сигнала
+        :return:
+        """
+        if signum:
+            signal.signal(signum, self.request)
+
+    def observe_query(self, name: str, seconds: float) -> None:
+        """
+        Учесть время выполнения запроса.
+        :param name: название запроса
+        :param seconds: время выполнения
+        :return:
+        """
+        self._timings[name].append(seconds)
+
+    def explain(self,
+                conn: psycopg2.connect,
+                name: str,
+                query: str,
+                values: tuple) -> None:
+        """
+        Получить план запроса с фактическим временем выполнения.
+        План снимается один раз за цикл для каждого запроса. Запрос
+        выполняется в точке сохранения, чтобы ошибка EXPLAIN не прервала
+        транзакцию цикла.
+        :param conn: соединение, на котором выполняется запрос
+        :param name: название запроса
+        :param query: текст запроса
+        :param values: параметры запроса
+        :return:
+        """
+        if name in self._plans:
+            return
+        with conn.cursor() as cur:
+            cur.execute('SAVEPOINT profile_explain')
+            try:
+                cur.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, values)
+                self._plans[name] = '\n'.join(row[0]
+                                              for row in cur.fetchall())
+            except psycopg2.Error as error:
+                cur.execute('ROLLBACK TO SAVEPOINT profile_explain')
+                self._plans[name] = f'EXPLAIN failed: {error}'
+            cur.execute('RELEASE SAVEPOINT profile_explain')
+
+    def _write(self,
+               stacks: Counter,
+               memory: list,
+               peak: int,
+               seconds: float) -> None:
+        """
+        Записать результаты цикла в файлы.
+        :param stacks: свернутые стеки
+        :param memory: изменения памяти по строкам кода
+        :param peak: пиковый объем отслеживаемой памяти в байтах
+        :param seconds: длительность цикла
+        :return:
+        """
+        base = os.path.join(log_directory(),
+                            f'profile-{self._session}-{self._cycle}')
+        with open(f'{base}.cpu.folded', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        with open(f'{base}.memory.txt', 'w') as f:
+            f.write(f'Peak traced memory: {peak} bytes\n\n')
+            for stat in memory[:MEMORY_TOP]:
+                f.write(f'{stat}\n')
+        with open(f'{base}.queries.txt', 'w') as f:
+            f.write(f'Cycle: {seconds:.3f}s, '
+                    f'samples: {sum(stacks.values())}\n\n')
+            for name, timings in sorted(self._timings.items()):
+                f.write(f'{name}: count={len(timings)} '
+                        f'total={sum(timings):.3f}s '
+                        f'mean={sum(timings) / len(timings):.4f}s '
+                        f'max={max(timings):.4f}s\n')
+            for name, plan in sorted(self._plans.items()):
+                f.write(f'\n{name}:\n{plan}\n')
+        logging.info(f'Profile of cycle {self._cycle} written to {base}.*')
+
+    @contextmanager
+    def cycle(self) -> Generator[None, None, None]:
+        """
+        Профилировать цикл загрузки, если профилирование запрошено.
+        :return:
+        """
+        if not self._requested:
+            yield
+            return
+        if self._session is None:
+            self._session = datetime.now().strftime('%Y%m%d-%H%M%S')
+            self._cycle = 0
+            logging.info(f'Profiling next {self._requested} cycles.')
+        self._cycle += 1
+        self._timings.clear()
+        self._plans.clear()
+        sampler = StackSampler(self.interval)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot().filter_traces(MEMORY_FILTERS)
+        started = time.perf_counter()
+        sampler.start()
+        self.active = True
+        try:
+            yield
+        finally:
+            self.active = False
+            sampler.stop()
+            seconds = time.perf_counter() - started
+            after = tracemalloc.take_snapshot().filter_traces(MEMORY_FILTERS)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._write(sampler.stacks,
+                        after.compare_to(before, 'lineno'), peak, seconds)
+            self._requested -= 1
+            if self._requested <= 0:
+                self._requested = 0
+                self._session = None
+
+
+PROFILER = Profiler()
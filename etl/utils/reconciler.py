@@ -0,0 +1,226 @@
+"""Сверка индекса с базой и исправление расхождений."""
+
+import inspect
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+from typing import Generator, Iterator, Optional
+
+import psycopg2
+from dateutil.parser import parse
+from elasticsearch import Elasticsearch
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+from utils.cache import DocumentHashCache
+from utils.elastic_loader import ElasticLoader
+from utils.metrics import RECONCILE_DOCUMENTS
+from utils.postgres_extractor import (FILM_WORK_VERSION,
+                                      PostgresMovieExtractor,
+                                      postgres_cursor_context)
+
+FILM_WORK_KEYS_QUERY = f"""
+    SELECT
+        fw.id,{FILM_WORK_VERSION} AS modified
+    FROM content.film_work fw
+    ORDER BY fw.id;
+"""
+
+FILM_WORK_EXISTING_QUERY = """
+    SELECT fw.id
+    FROM content.film_work fw
+    WHERE fw.id = ANY(%s::uuid[]);
+"""
+
+
+class Drift:
+    """Виды расхождений индекса с базой."""
+
+    MISSING = 'missing'
+    STALE = 'stale'
+    ORPHANED = 'orphaned'
+
+
+Keys = Iterator[tuple[str, Optional[datetime]]]
+
+
+def postgres_keys(conn: psycopg2.connect,
+                  itersize: int = SETTINGS.FULL_LOAD_ITERSIZE) -> Keys:
+    """
+    ID и версии фильмов из базы в порядке ID. Версия учитывает
+    изменения персон, жанров и связей фильма, поэтому совпадает с полем
+    modified документа.
+    Строки читаются серверным курсором порциями по itersize.
+    :param conn: соединение с базой
+    :param itersize: число строк, получаемых с сервера за раз
+    :return:
+    """
+    with conn.cursor(name='reconcile_keys') as cur:
+        cur.itersize = itersize
+        cur.execute(FILM_WORK_KEYS_QUERY)
+        for id_, modified in cur:
+            yield str(id_), modified
+
+
+def elastic_keys(es_client: Elasticsearch,
+                 index: str,
+                 page_size: int = SETTINGS.RECONCILE_PAGE_SIZE,
+                 keep_alive: str = '5m') -> Keys:
+    """
+    ID и даты изменения документов индекса в порядке ID.
+    Страницы читаются через point in time и search_after, поэтому
+    выдача согласована и не зависит от глубины пагинации.
+    :param es_client: соединение с Elasticsearch
+    :param index: название индекса или алиаса
+    :param page_size: размер страницы
+    :param keep_alive: время жизни point in time между страницами
+    :return:
+    """
+    pit_id = es_client.open_point_in_time(
+        index=index, keep_alive=keep_alive
+    )['id']
+    try:
+        search_after = None
+        while True:
+            response = es_client.search(
+                pit={'id': pit_id, 'keep_alive': keep_alive},
+                sort=[{'id': 'asc'}],
+                size=page_size,
+                source=['modified'],
+                search_after=search_after,
+                track_total_hits=False,
+            )
+            pit_id = response.get('pit_id', pit_id)
+            hits = response['hits']['hits']
+            if not hits:
+                return
+            for hit in hits:
+                modified = hit['_source'].get('modified')
+                yield hit['_id'], parse(modified) if modified else None
+            search_after = hits[-1]['sort']
+    finally:
+        es_client.close_point_in_time(id=pit_id)
+
+
+def diff_keys(source: Keys,
+              target: Keys) -> Generator[tuple[str, str], None, None]:
+    """
+    Сравнить два упорядоченных по ID потока слиянием за один проход.
+    :param source: ключи базы
+    :param target: ключи индекса
+    :return: пары (вид расхождения, ID)
+    """
+    source_item, target_item = next(source, None), next(target, None)
+    while source_item is not None or target_item is not None:
+        if target_item is None or (
+                source_item is not None and source_item[0] < target_item[0]):
+            yield Drift.MISSING, source_item[0]
+            source_item = next(source, None)
+        elif source_item is None or target_item[0] < source_item[0]:
+            yield Drift.ORPHANED, target_item[0]
+            target_item = next(target, None)
+        else:
+            if source_item[1] != target_item[1]:
+                yield Drift.STALE, source_item[0]
+            source_item, target_item = next(source, None), next(target, None)
+
+
+class Reconciler:
+    """
+    Сверка индекса фильмов с базой. Отсутствующие и устаревшие
+    документы загружаются заново, документы удаленных фильмов
+    удаляются из индекса.
+    """
+
+    def __init__(self,
+                 extractor: PostgresMovieExtractor,
+                 loader: ElasticLoader,
+                 hash_cache: Optional[DocumentHashCache] = None,
+                 batch_size: int = SETTINGS.BATCH_SIZE):
+        """
+        Инициализация.
+        :param extractor: объект, извлекающий фильмы из базы
+        :param loader: загрузчик без кэша хешей, чтобы исправленные
+            документы отправлялись независимо от кэша
+        :param hash_cache: кэш хешей основного цикла, из которого
+            удаляются хеши удаленных документов
+        :param batch_size: размер батча исправляемых ID
+        """
+        self.extractor = extractor
+        self.loader = loader
+        self.hash_cache = hash_cache
+        self.batch_size = batch_size
+
+    def _repair(self, ids: list[str]) -> None:
+        """
+        Загрузить документы фильмов заново.
+        :param ids: ID фильмов
+        :return:
+        """
+        dataklass = self.extractor.dataklass
+        for rows in self.extractor.get_filmworks(tuple(ids)):
+            for row in rows:
+                self.loader.add_in_batch(dataklass(**row).as_document())
+            if self.loader.is_batch_ready():
+                self.loader.save()
+
+    def _delete(self, ids: list[str]) -> None:
+        """
+        Удалить документы фильмов, которых нет в базе. Перед удалением
+        ID проверяются повторно: фильм мог быть добавлен во время сверки.
+        :param ids: ID документов
+        :return:
+        """
+        with postgres_cursor_context(self.extractor.conn) as cur:
+            cur.execute(FILM_WORK_EXISTING_QUERY, (ids,))
+            existing = {str(row[0]) for row in cur.fetchall()}
+        orphans = [id_ for id_ in ids if id_ not in existing]
+        if not orphans:
+            return
+        deleted = self.loader.delete(orphans)
+        if self.hash_cache is not None:
+            self.hash_cache.discard(orphans)
+        logging.info(f'Deleted {deleted} orphaned documents.')
+
+    def run(self) -> Counter:
+        """
+        Сверить индекс с базой и исправить расхождения.
+        Память не зависит от размера каталога: оба потока ключей
+        читаются порциями, исправления выполняются батчами.
+        :return: число расхождений по видам
+        """
+        counts = Counter()
+        repair, orphans = [], []
+        for kind, id_ in diff_keys(
+                postgres_keys(self.extractor.conn),
+                elastic_keys(self.loader.es_client, self.loader.index)):
+            counts[kind] += 1
+            RECONCILE_DOCUMENTS.labels(kind=kind).inc()
+            if kind == Drift.ORPHANED:
+                orphans.append(id_)
+                if len(orphans) >= self.batch_size:
+                    self._delete(orphans)
+                    orphans = []
+            else:
+                repair.append(id_)
+                if len(repair) >= self.batch_size:
+                    self._repair(repair)
+                    repair = []
+        if repair:
+            self._repair(repair)
+        if orphans:
+            self._delete(orphans)
+        self.loader.flush()
+        logging.info(
+            'Reconciliation finished: '
+            + ', '.join(f'{kind}={counts[kind]}'
+                        for kind in (Drift.MISSING, Drift.STALE,
+                                     Drift.ORPHANED))
+        )
+        return counts
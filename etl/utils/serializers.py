@@ -0,0 +1,57 @@
+"""Сериализаторы тел запросов клиента Elasticsearch."""
+
+from typing import Any, Optional
+
+from elasticsearch.serializer import (JsonSerializer, NdjsonSerializer,
+                                      Serializer)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonMixin:
+    """
+    Кодирование JSON через orjson. datetime и UUID orjson сериализует
+    сам, остальные типы передаются в default стандартного сериализатора.
+    """
+
+    def json_dumps(self, data: Any) -> bytes:
+        return orjson.dumps(
+            data, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        )
+
+    def json_loads(self, data: bytes) -> Any:
+        if data == b'':
+            return None
+        return orjson.loads(data)
+
+
+class OrjsonSerializer(OrjsonMixin, JsonSerializer):
+    pass
+
+
+class OrjsonNdjsonSerializer(OrjsonMixin, NdjsonSerializer):
+    pass
+
+
+SERIALIZERS = {
+    'orjson': (OrjsonSerializer, OrjsonNdjsonSerializer),
+}
+
+
+def create_serializers(name: str) -> Optional[dict[str, Serializer]]:
+    """
+    Создать сериализаторы клиента по названию. Клиент сам использует
+    их и для mimetype режима совместимости.
+    :param name: json - стандартный сериализатор, orjson - orjson
+    :return: сериализаторы по mimetype или None для стандартных
+    """
+    if name == 'json':
+        return None
+    if orjson is None:
+        raise ImportError(f'{name} serializer requires the orjson package.')
+    return {
+        serializer.mimetype: serializer() for serializer in SERIALIZERS[name]
+    }
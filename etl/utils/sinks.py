@@ -0,0 +1,95 @@
+"""Дополнительные индексы, заполняемые из тех же строк фильмов."""
+
+import inspect
+import os
+import sys
+from typing import Callable, Iterable, Optional
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS
+from utils.postgres_extractor import DimensionRename
+from utils.transformer import genre_documents, person_documents
+
+
+class Sink:
+    """
+    Индекс, документы которого строятся из строк фильмов.
+    У индекса свои маппинг, ключи состояния и кэш хешей, поэтому
+    он может отставать от остальных и догонять их независимо.
+    """
+
+    def __init__(self,
+                 name: str,
+                 index: str,
+                 mapping: dict,
+                 transform: Callable[[Iterable], list[dict]],
+                 rename_kind: str,
+                 rename_field: str):
+        """
+        Инициализация.
+        :param name: название, префикс ключей состояния
+        :param index: название индекса
+        :param mapping: маппинг индекса
+        :param transform: построение документов по батчу строк фильмов
+        :param rename_kind: вид переименований, меняющих документы
+            индекса при частичных обновлениях
+        :param rename_field: поле документа с именем
+        """
+        self.name = name
+        self.index = index
+        self.mapping = mapping
+        self.transform = transform
+        self.rename_kind = rename_kind
+        self.rename_field = rename_field
+
+    @property
+    def state_prefix(self) -> str:
+        """
+        Префикс ключей состояния индекса.
+        :return:
+        """
+        return f'{self.name}_'
+
+    @property
+    def hash_cache_file(self) -> str:
+        """
+        Путь до кэша хешей документов индекса.
+        :return:
+        """
+        root, ext = os.path.splitext(SETTINGS.HASH_CACHE_FILE)
+        return f'{root}.{self.name}{ext}'
+
+    def rename_document(self, rename: DimensionRename) -> Optional[dict]:
+        """
+        Документ с новым именем персоны или жанра.
+        :param rename: переименование
+        :return: документ или None, если переименование индекс не меняет
+        """
+        if rename.kind != self.rename_kind:
+            return None
+        return {'id': rename.id, self.rename_field: rename.new_name}
+
+
+def create_sinks(names: Iterable[str]) -> list[Sink]:
+    """
+    Создать дополнительные индексы по названиям.
+    :param names: названия из настроек
+    :return:
+    """
+    dsl = SETTINGS.ELASTIC_DSL
+    sinks = {
+        'genres': lambda: Sink(
+            'genres', dsl.ES_GENRES_INDEX_NAME, dsl.ES_GENRES_MAPPING,
+            genre_documents, 'genre', 'name',
+        ),
+        'persons': lambda: Sink(
+            'persons', dsl.ES_PERSONS_INDEX_NAME, dsl.ES_PERSONS_MAPPING,
+            person_documents, 'person', 'full_name',
+        ),
+    }
+    return [sinks[name]() for name in names]
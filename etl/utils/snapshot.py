@@ -0,0 +1,315 @@
+"""Снимок документов индекса в сжатых NDJSON-файлах и загрузка из него."""
+
+import gzip
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Generator, Optional
+
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS, logging
+from utils.elastic_loader import ElasticLoader
+from utils.metrics import STAGE_SECONDS
+from utils.postgres_extractor import DimensionRename, POSITION_KEYS
+from utils.storage import State
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def _dumps(data: dict) -> bytes:
+    """
+    Сериализовать объект в строку JSON.
+    :param data: объект
+    :return:
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str)
+    return json.dumps(data, default=str, ensure_ascii=False).encode()
+
+
+def _write_atomic(file_path: str, data: bytes) -> None:
+    """
+    Записать файл целиком через временный файл.
+    :param file_path: путь до файла
+    :param data: содержимое
+    :return:
+    """
+    tmp_path = f'{file_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Прочитать манифест снимка.
+    :param directory: каталог снимка
+    :return:
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class SnapshotWriter:
+    """
+    Запись документов в снимок вместо Elasticsearch. Интерфейс совпадает
+    с ElasticLoader, поэтому снимок заполняется тем же циклом загрузки.
+    Каждый файл снимка - готовое тело bulk-запроса, сжатое gzip;
+    манифест со списком файлов записывается после последнего файла,
+    поэтому прерванная выгрузка не оставляет годного снимка.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 state: Optional[State] = None,
+                 chunk_size: int = SETTINGS.SNAPSHOT_CHUNK_SIZE,
+                 chunk_bytes: int = SETTINGS.BULK_MAX_BYTES,
+                 compress_level: int = SETTINGS.SNAPSHOT_COMPRESS_LEVEL):
+        """
+        Инициализация.
+        :param directory: каталог снимка
+        :param state: состояние выгрузки; его позиции сохраняются
+            в манифест, чтобы после загрузки снимка продолжить
+            загрузку изменений с того же места
+        :param chunk_size: число документов в файле
+        :param chunk_bytes: максимальный размер файла до сжатия
+        :param compress_level: уровень сжатия gzip
+        """
+        if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+            raise FileExistsError(f'Snapshot already exists in {directory}.')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.state = state
+        self._chunk_size = chunk_size
+        self._chunk_bytes = chunk_bytes
+        self._compress_level = compress_level
+        self._lines = []
+        self._documents = 0
+        self._bytes = 0
+        self._checkpoints = []
+        self._chunks = []
+
+    def add_in_batch(self, document: dict) -> None:
+        """
+        Добавить документ в текущий файл.
+        :param document: документ
+        :return:
+        """
+        line = (_dumps({'index': {'_id': str(document['id'])}}) + b'\n'
+                + _dumps(document) + b'\n')
+        self._lines.append(line)
+        self._documents += 1
+        self._bytes += len(line)
+
+    def add_checkpoint(self, checkpoint: Callable[[], None]) -> None:
+        """
+        Добавить чекпоинт, выполняемый после записи текущего файла.
+        :param checkpoint: чекпоинт
+        :return:
+        """
+        self._checkpoints.append(checkpoint)
+
+    def add_rename(self, rename: DimensionRename) -> None:
+        """
+        Снимок содержит документы целиком, переименования не нужны.
+        :param rename: переименование
+        :return:
+        """
+
+    def is_batch_ready(self) -> bool:
+        """
+        Проверить заполненность файла.
+        :return:
+        """
+        return (self._documents >= self._chunk_size
+                or self._bytes >= self._chunk_bytes)
+
+    def save(self) -> None:
+        """
+        Записать накопленные документы в файл снимка и выполнить
+        чекпоинты.
+        :return:
+        """
+        if self._lines:
+            name = f'chunk-{len(self._chunks):05}.ndjson.gz'
+            with STAGE_SECONDS.labels(stage='snapshot').time():
+                data = gzip.compress(b''.join(self._lines),
+                                     self._compress_level)
+                _write_atomic(os.path.join(self.directory, name), data)
+            self._chunks.append({
+                'file': name,
+                'documents': self._documents,
+                'bytes': self._bytes,
+                'sha256': hashlib.sha256(data).hexdigest(),
+            })
+            self._lines, self._documents, self._bytes = [], 0, 0
+        checkpoints, self._checkpoints = self._checkpoints, []
+        for checkpoint in checkpoints:
+            checkpoint()
+
+    def flush(self) -> None:
+        """
+        Записать остаток документов и манифест снимка.
+        :return:
+        """
+        self.save()
+        state = {}
+        if self.state is not None:
+            state = {key: self.state.get_state(key)
+                     for key in POSITION_KEYS}
+        manifest = {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'documents': sum(chunk['documents'] for chunk in self._chunks),
+            'mapping': SETTINGS.ELASTIC_DSL.ES_MAPPING,
+            'state': state,
+            'chunks': self._chunks,
+        }
+        _write_atomic(os.path.join(self.directory, MANIFEST_FILE),
+                      json.dumps(manifest, indent=2).encode())
+        logging.info(f"Snapshot with {manifest['documents']} documents "
+                     f"written to {self.directory}.")
+
+    def close(self) -> None:
+        """
+        Освободить ресурсы.
+        :return:
+        """
+
+
+class SnapshotLoader(ElasticLoader):
+    """
+    Загрузчик снимка в Elasticsearch без обращения к базе.
+    Файлы распаковываются потоком и отправляются параллельно телами
+    bulk-запросов не больше batch_bytes, поэтому в памяти на каждый
+    поток находится одно тело запроса, а не весь распакованный файл.
+    Документы разбираются только для отклоненных элементов.
+    Повтор выполняется методом _bulk в потоке файла: он, как и
+    в ConcurrentElasticLoader, не меняет состояние загрузчика,
+    а dead-letter файл и подбор размера батча защищены блокировками.
+    """
+
+    @staticmethod
+    def _verify_chunk(file_path: str, sha256: str) -> None:
+        """
+        Проверить контрольную сумму файла снимка, читая его блоками.
+        :param file_path: путь до файла
+        :param sha256: контрольная сумма из манифеста
+        :return:
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while block := f.read(1024 * 1024):
+                digest.update(block)
+        if digest.hexdigest() != sha256:
+            raise ValueError(f'Snapshot file {file_path} is corrupted.')
+
+    def _bodies(self, file_path: str) -> Generator[bytes, None, None]:
+        """
+        Распаковать файл снимка потоком и разбить его на тела
+        bulk-запросов. Строки действия и документа не разделяются.
+        :param file_path: путь до файла
+        :return:
+        """
+        body = bytearray()
+        with gzip.open(file_path, 'rb') as f:
+            for action, source in zip(f, f):
+                body += action
+                body += source
+                if len(body) >= self._batch_bytes:
+                    yield bytes(body)
+                    body.clear()
+        if body:
+            yield bytes(body)
+
+    def _send_body(self, body: bytes) -> None:
+        """
+        Отправить готовое тело bulk-запроса. Документы, отклоненные
+        из-за перегрузки кластера, повторяются методом _bulk, остальные
+        отклоненные документы сразу записываются в dead-letter файл.
+        :param body: тело запроса
+        :return:
+        """
+        for attempt in itertools.count():
+            started = time.perf_counter()
+            try:
+                response = self.es_client.bulk(index=self.index,
+                                               operations=body)
+            except (ConnectionError, ConnectionTimeout) as error:
+                time.sleep(self._retry_request(error, attempt))
+                continue
+            STAGE_SECONDS.labels(stage='load').observe(
+                time.perf_counter() - started
+            )
+            break
+        if not response['errors']:
+            return
+        results = self._bulk_results(response)
+        sources = body.splitlines()[1::2]
+        pending = [
+            (json.loads(source), source)
+            for source, (ok, _) in zip(sources, results) if not ok
+        ]
+        rejected, _ = self._handle_results(
+            [document for document, _ in pending],
+            [result for result in results if not result[0]], 0
+        )
+        if rejected:
+            pending = self._retried(pending, rejected)
+            time.sleep(self._retry_delay(0))
+            self._bulk([document for document, _ in pending],
+                       [source for _, source in pending])
+
+    def _load_chunk(self, directory: str, chunk: dict) -> int:
+        """
+        Загрузить один файл снимка. Файл проверяется целиком до первого
+        запроса, чтобы поврежденный снимок не загружался частично.
+        :param directory: каталог снимка
+        :param chunk: описание файла из манифеста
+        :return: число отправленных документов
+        """
+        file_path = os.path.join(directory, chunk['file'])
+        self._verify_chunk(file_path, chunk['sha256'])
+        for body in self._bodies(file_path):
+            self._send_body(body)
+        return chunk['documents']
+
+    def restore(self,
+                directory: str,
+                workers: int = SETTINGS.SNAPSHOT_RESTORE_WORKERS) -> int:
+        """
+        Загрузить снимок в индекс.
+        :param directory: каталог снимка
+        :param workers: число одновременных bulk-запросов
+        :return: число загруженных документов
+        """
+        manifest = read_manifest(directory)
+        documents = 0
+        with ThreadPoolExecutor(max_workers=max(workers, 1),
+                                thread_name_prefix='restore') as executor:
+            for count in executor.map(
+                    lambda chunk: self._load_chunk(directory, chunk),
+                    manifest['chunks']):
+                documents += count
+        logging.info(f'Restored {documents} documents from {directory} '
+                     f'into {self.index}.')
+        return documents
@@ -2,7 +2,14 @@
 
 import abc
 import json
-from typing import Any, Optional
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Generator, Optional
+
+import psycopg2
 
 
 class BaseStorage:
@@ -16,16 +23,43 @@ class BaseStorage:
         """Загрузить состояние локально из постоянного хранилища"""
         pass
 
+    def close(self) -> None:
+        """Освободить ресурсы хранилища"""
+        pass
+
 
 class JsonFileStorage(BaseStorage):
-    """Хранилище данных в json-файле."""
+    """
+    Хранилище данных в json-файле.
+    Файл перезаписывается атомарно: состояние пишется во временный файл
+    рядом с основным, сбрасывается на диск и переименовывается, поэтому
+    при сбое остается либо старое, либо новое состояние целиком.
+    """
 
     def __init__(self, file_path: Optional[str] = None):
         self.file_path = file_path
 
     def save_state(self, state: dict) -> None:
-        with open(self.file_path, 'w') as f:
-            json.dump(obj=state, fp=f, indent=4, default=str)
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix='.state-', suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(obj=state, fp=f, separators=(',', ':'),
+                          default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> dict:
         try:
@@ -35,22 +69,186 @@ class JsonFileStorage(BaseStorage):
             return {}
 
 
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище данных в SQLite-файле: каждый ключ - отдельная строка.
+    Сохраняются только изменившиеся ключи, поэтому хранилище подходит
+    для большого числа ключей, например курсоров по партициям.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.conn = sqlite3.connect(file_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        self._saved = {}
+
+    def save_state(self, state: dict) -> None:
+        rows = []
+        for key, value in state.items():
+            data = json.dumps(value, default=str)
+            if self._saved.get(key) != data:
+                rows.append((key, data))
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                rows,
+            )
+        self._saved.update(rows)
+
+    def retrieve_state(self) -> dict:
+        self._saved = dict(
+            self.conn.execute('SELECT key, value FROM state').fetchall()
+        )
+        return {key: json.loads(value) for key, value in self._saved.items()}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище данных в таблице PostgreSQL: каждый ключ - отдельная строка.
+    Как и в SQLiteStorage, сохраняются только изменившиеся ключи, поэтому
+    несколько процессов могут писать свои ключи в одно хранилище,
+    не затирая ключи друг друга.
+    """
+
+    def __init__(self, dsl: dict):
+        self.conn = psycopg2.connect(**dsl)
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS content.etl_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+        self._saved = {}
+
+    def save_state(self, state: dict) -> None:
+        rows = []
+        for key, value in state.items():
+            data = json.dumps(value, default=str)
+            if self._saved.get(key) != data:
+                rows.append((key, data))
+        if not rows:
+            return
+        with self.conn, self.conn.cursor() as cur:
+            cur.executemany(
+                'INSERT INTO content.etl_state (key, value) VALUES (%s, %s) '
+                'ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value',
+                rows,
+            )
+        self._saved.update(rows)
+
+    def retrieve_state(self) -> dict:
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute('SELECT key, value FROM content.etl_state')
+            self._saved = dict(cur.fetchall())
+        return {key: json.loads(value) for key, value in self._saved.items()}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class MemoryStorage(BaseStorage):
+    """Хранилище данных в памяти процесса."""
+
+    def __init__(self):
+        self._state = {}
+
+    def save_state(self, state: dict) -> None:
+        self._state = dict(state)
+
+    def retrieve_state(self) -> dict:
+        return dict(self._state)
+
+
 class State:
     """Класс для хранения состояния при работе с данными.
     Предназначен для хранения актуального состояния данных.
+    Состояние читается из хранилища один раз и кэшируется в памяти,
+    запись в хранилище может откладываться на flush_interval секунд.
     """
 
-    def __init__(self, storage: BaseStorage):
+    def __init__(self, storage: BaseStorage, flush_interval: float = 0):
         """Проинициализировать состояние и хранилище состояния."""
         self.storage = storage
-        self._dict = {}
+        self.flush_interval = flush_interval
+        self._dict = None
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    def _load(self) -> dict:
+        if self._dict is None:
+            self._dict = self.storage.retrieve_state()
+        return self._dict
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа."""
-        self._dict[key] = value
-        self.storage.save_state(self._dict)
+        self._load()[key] = value
+        self._dirty = True
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу."""
-        self._dict = self.storage.retrieve_state()
-        return self._dict.get(key)
+        return self._load().get(key)
+
+    def flush(self) -> None:
+        """Записать отложенные изменения в хранилище."""
+        if self._dirty:
+            self.storage.save_state(self._dict)
+            self._dirty = False
+        self._flushed_at = time.monotonic()
+
+
+def create_storage(backend: str,
+                   file_path: str,
+                   dsl: Optional[dict] = None) -> BaseStorage:
+    """
+    Создать хранилище состояния.
+    :param backend: тип хранилища - json, sqlite или postgres
+    :param file_path: путь до файла хранилища
+    :param dsl: параметры подключения к PostgreSQL
+    :return:
+    """
+    if backend == 'postgres':
+        return PostgresStorage(dsl)
+    if backend == 'sqlite':
+        return SQLiteStorage(file_path)
+    return JsonFileStorage(file_path)
+
+
+@contextmanager
+def state_context(backend: str,
+                  file_path: str,
+                  flush_interval: float = 0,
+                  dsl: Optional[dict] = None) -> Generator[State, None, None]:
+    """
+    Открыть состояние и записать отложенные изменения при выходе,
+    в том числе при ошибке: сохраненные чекпоинты уже подтверждены
+    загрузкой.
+    :param backend: тип хранилища - json, sqlite или postgres
+    :param file_path: путь до файла хранилища
+    :param flush_interval: интервал отложенной записи в секундах
+    :param dsl: параметры подключения к PostgreSQL
+    :return:
+    """
+    storage = create_storage(backend, file_path, dsl)
+    state = State(storage, flush_interval)
+    try:
+        yield state
+    finally:
+        try:
+            state.flush()
+        finally:
+            storage.close()
@@ -0,0 +1,112 @@
+import inspect
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Generator, Iterable, Optional
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe()))
+)
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from config import SETTINGS
+from utils.metrics import STAGE_SECONDS
+from utils.postgres_extractor import Checkpoint
+
+
+def _transform_chunk(dataklass: type,
+                     columns: tuple[str],
+                     values: list[tuple]) -> tuple[list[dict], float]:
+    """
+    Преобразовать строки в документы в процессе-обработчике.
+    Строки передаются кортежами значений, чтобы не сериализовать
+    имена колонок для каждой строки.
+    :param dataklass: класс представления фильма
+    :param columns: названия колонок
+    :param values: значения строк
+    :return: документы в порядке строк и время преобразования
+    """
+    start = time.perf_counter()
+    documents = [dataklass(**dict(zip(columns, row))).as_document()
+                 for row in values]
+    return documents, time.perf_counter() - start
+
+
+class TransformPool:
+    """Пул процессов, преобразующий батчи строк в документы по порядку."""
+
+    def __init__(self,
+                 workers: int = SETTINGS.TRANSFORM_WORKERS,
+                 chunk_size: int = SETTINGS.TRANSFORM_CHUNK_SIZE):
+        """
+        Инициализация пула. Процессы запускаются при первой задаче
+        и работают до закрытия пула.
+        :param workers: число процессов
+        :param chunk_size: число строк в одной задаче
+        """
+        self._chunk_size = chunk_size
+        self._window = workers * 2
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def _submit(self, dataklass: type, rows: list) -> Optional[Future]:
+        """
+        Отправить строки на преобразование.
+        :param dataklass: класс представления фильма
+        :param rows: строки
+        :return:
+        """
+        if not rows:
+            return None
+        columns = tuple(rows[0].keys())
+        values = [tuple(row.values()) for row in rows]
+        return self._executor.submit(
+            _transform_chunk, dataklass, columns, values
+        )
+
+    def imap(
+            self,
+            dataklass: type,
+            batches: Iterable[tuple[list, Optional[Checkpoint]]]
+    ) -> Generator[tuple[list[dict], list[Checkpoint]], None, None]:
+        """
+        Преобразовать батчи строк в документы, сохраняя порядок.
+        В работе одновременно не более двух задач на процесс.
+        :param dataklass: класс представления фильма
+        :param batches: батчи строк и чекпоинты
+        :return: документы и чекпоинты, покрытые ими
+        """
+        pending = deque()
+        rows, checkpoints = [], []
+
+        def result(item: tuple[Optional[Future], list]) -> tuple:
+            future, item_checkpoints = item
+            if future is None:
+                return [], item_checkpoints
+            documents, seconds = future.result()
+            STAGE_SECONDS.labels(stage='transform').observe(seconds)
+            return documents, item_checkpoints
+
+        for batch, checkpoint in batches:
+            rows.extend(batch)
+            if checkpoint:
+                checkpoints.append(checkpoint)
+            if len(rows) < self._chunk_size:
+                continue
+            pending.append((self._submit(dataklass, rows), checkpoints))
+            rows, checkpoints = [], []
+            while len(pending) >= self._window:
+                yield result(pending.popleft())
+        if rows or checkpoints:
+            pending.append((self._submit(dataklass, rows), checkpoints))
+        while pending:
+            yield result(pending.popleft())
+
+    def close(self) -> None:
+        """
+        Остановить процессы пула.
+        :return:
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
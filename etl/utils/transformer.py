@@ -1,7 +1,7 @@
 import uuid
 from dataclasses import dataclass, fields
 from datetime import datetime
-from typing import List, Literal
+from typing import Iterable, List, Literal, Mapping
 
 from dateutil.parser import parse
 
@@ -42,6 +42,7 @@ class Filmwork(MixinId, MixinTimeStamped):
                 if isinstance(value, str):
                     setattr(self, own_field.name, parse(value))
 
+        self.genres = [genre for genre in self.genres if genre is not None]
         role_to_names_map = {
             'director': 'director',
             'actor': 'actors_names',
@@ -71,7 +72,8 @@ class Filmwork(MixinId, MixinTimeStamped):
         doc_mapping = {
             'id': 'id',
             'imdb_rating': 'rating',
-            'genre': 'genre',
+            'modified': 'modified',
+            'genre': 'genres',
             'title': 'title',
             'description': 'description',
             'director': 'director',
@@ -84,3 +86,97 @@ class Filmwork(MixinId, MixinTimeStamped):
         for doc_attr, obj_attr in doc_mapping.items():
             doc[doc_attr] = getattr(self, obj_attr, [])
         return doc
+
+
+ROLE_TO_FIELDS = {
+    'director': ('director', None),
+    'actor': ('actors_names', 'actors'),
+    'writer': ('writers_names', 'writers'),
+}
+
+
+class FilmworkRecord:
+    """
+    Облегченное представление фильма для быстрого построения документа.
+    Совместимо с Filmwork по конструктору и результату as_document.
+    """
+
+    __slots__ = ('id', 'title', 'description', 'rating', 'modified',
+                 'genres', 'persons')
+
+    def __init__(self,
+                 id: str,
+                 title: str,
+                 description: str,
+                 rating: float,
+                 genres: List[str],
+                 persons: List[dict],
+                 modified: datetime,
+                 **kwargs) -> None:
+        self.id = id
+        self.title = title
+        self.description = description
+        self.rating = rating
+        self.modified = modified
+        self.genres = [genre for genre in genres if genre is not None]
+        self.persons = persons
+
+    def as_document(self) -> dict:
+        """
+        Построить документ за один проход по персонам.
+        :return:
+        """
+        doc = {
+            'id': self.id,
+            'imdb_rating': self.rating,
+            'modified': self.modified,
+            'genre': self.genres,
+            'title': self.title,
+            'description': self.description,
+            'director': [],
+            'actors_names': [],
+            'writers_names': [],
+            'actors': [],
+            'writers': [],
+        }
+        for person in self.persons:
+            names_field, objs_field = ROLE_TO_FIELDS[person['role']]
+            doc[names_field].append(person['name'])
+            if objs_field:
+                doc[objs_field].append({
+                    'id': person['id'],
+                    'name': person['name'],
+                })
+        return doc
+
+
+def genre_documents(rows: Iterable[Mapping]) -> list[dict]:
+    """
+    Документы жанров, упомянутых в строках фильмов, без повторов.
+    :param rows: строки фильмов с полем genre_objs
+    :return:
+    """
+    documents = {}
+    for row in rows:
+        for genre in row.get('genre_objs') or ():
+            documents[genre['id']] = {
+                'id': genre['id'],
+                'name': genre['name'],
+            }
+    return list(documents.values())
+
+
+def person_documents(rows: Iterable[Mapping]) -> list[dict]:
+    """
+    Документы персон, участвующих в фильмах из строк, без повторов.
+    :param rows: строки фильмов
+    :return:
+    """
+    documents = {}
+    for row in rows:
+        for person in row['persons']:
+            documents[person['id']] = {
+                'id': person['id'],
+                'full_name': person['name'],
+            }
+    return list(documents.values())